@@ -0,0 +1,216 @@
+"""Define class BootstrapROC, which computes bootstrap confidence bands
+of sensitivity and FDR of each score cutoff, by resampling query ZMWs
+with replacement.
+
+Every replicate is a vector of weights of query ZMWs (how many times a
+ZMW is drawn). Per-ZMW numbers of ground truth positive pairs and of
+TP/FP hits in each score bin are computed once, so that numbers of a
+block of replicates are products of weights and these per-ZMW numbers.
+"""
+
+import logging
+import warnings
+from multiprocessing import Pool
+import numpy as np
+from pbove.io.QTSOIO import QTSOReader
+from pbove.Partition import ZmwOfReadName
+
+# Number of replicates of a worker job, fixed so that replicates only
+# depend on seed, not on number of processes.
+REPLICATES_PER_JOB = 10
+
+# Per-ZMW numbers shared by all jobs of a worker process.
+_WORKER_DATA = None
+
+
+def ScoreBinUpperBounds(scores, minScore, stepSize=100):
+    """Return upper bounds of score bins [s, s+stepSize) of scores, as
+    in QTSO.ScoreCounts.getDeltaTables, i.e., bins start from
+    (minScore/100) * 100 - 100."""
+    s0 = (minScore // 100) * 100 - 100
+    return s0 + stepSize * ((np.asarray(scores) - s0) // stepSize + 1)
+
+
+class BootstrapROC(object):
+    """Bootstrap confidence bands of sensitivity, TP / (TP + FN), and
+    FDR, FP / (FP + TP), of each score cutoff of each overlap length
+    cutoff, given a ZmwOverlapHistogram of all query ZMWs and a QTSO
+    file of hits."""
+    def __init__(self, zmwHist, qtsoFile, overlapLengthCutoffs,
+                 stepSize=100):
+        self.cutoffs = [int(c) for c in overlapLengthCutoffs]
+        zmwIndices = dict(zmwHist.zmwIndices)
+        zmws = list(zmwHist.zmws)
+
+        hitZmws, scores, overlaps = [], [], []
+        reader = QTSOReader(qtsoFile)
+        for r in reader:
+            zmw = "{0}/{1}".format(*ZmwOfReadName(r.qname))
+            if zmw not in zmwIndices:
+                # Query ZMW of a hit without query reads, still a unit
+                # of resampling.
+                zmwIndices[zmw] = len(zmws)
+                zmws.append(zmw)
+            hitZmws.append(zmwIndices[zmw])
+            scores.append(r.score)
+            overlaps.append(r.overlap)
+        reader.close()
+        self.numZmws = len(zmws)
+
+        # Index ZMWs by name, so that replicates of a seed do not depend
+        # on the order ZMWs are added, e.g., partition by partition.
+        ranks = np.empty(self.numZmws, dtype=np.int64)
+        ranks[sorted(range(self.numZmws), key=lambda i: zmws[i])] = \
+                np.arange(self.numZmws)
+
+        # Number of ground truth positive pairs of each ZMW of each cutoff
+        gtZmw, gtLength, gtCount = zmwHist.arrays()
+        gtZmw = ranks[gtZmw]
+        self.gtPos = dict([(c, np.bincount(gtZmw[gtLength >= c],
+                                           weights=gtCount[gtLength >= c],
+                                           minlength=self.numZmws))
+                           for c in self.cutoffs])
+
+        # Upper bounds of nonempty score bins, as ScoreCutoff of tables.
+        hitZmws = ranks[np.array(hitZmws, dtype=np.int64)]
+        scores = np.array(scores, dtype=np.int64)
+        overlaps = np.array(overlaps, dtype=np.int64)
+        ubs = ScoreBinUpperBounds(scores, scores.min(), stepSize) \
+              if len(scores) > 0 else scores
+        self.scoreCutoffs, bins = np.unique(ubs, return_inverse=True)
+
+        # For each cutoff, numbers of TP and FP hits of distinct
+        # (ZMW, bin) pairs, sorted by bin.
+        self.hits = {}
+        for c in self.cutoffs:
+            self.hits[c] = (_GroupByZmwAndBin(hitZmws, bins,
+                                              overlaps >= c, self.numZmws),
+                            _GroupByZmwAndBin(hitZmws, bins,
+                                              overlaps <= 0, self.numZmws))
+
+    def _data(self):
+        """Return per-ZMW numbers needed by workers."""
+        return (self.numZmws, len(self.scoreCutoffs), self.cutoffs,
+                self.gtPos, self.hits)
+
+    def pointEstimates(self):
+        """Return a dictionary, cutoff -> (sensitivity, FDR) arrays of
+        all score cutoffs, of all query ZMWs."""
+        _InitWorker(self._data())
+        weights = np.ones((1, self.numZmws), dtype=np.int64)
+        return dict([(c, (sens[0], fdr[0])) for c, (sens, fdr) in
+                     _ReplicateRates(weights).iteritems()])
+
+    def run(self, numReplicates=1000, nproc=1, seed=0, alpha=0.05):
+        """Compute numReplicates replicates using nproc processes.
+        Return a dictionary, cutoff -> (sensitivity, sensitivityLow,
+        sensitivityHigh, FDR, FDRLow, FDRHigh), each an array of all
+        score cutoffs, where [low, high] are (alpha/2, 1-alpha/2)
+        percentiles of replicates, and replicates in which a rate is
+        undefined (e.g., no TP or FP hits for FDR) are ignored."""
+        if self.numZmws == 0:
+            raise ValueError("No query ZMWs to bootstrap.")
+        jobs = []
+        for start in range(0, numReplicates, REPLICATES_PER_JOB):
+            jobs.append((seed + len(jobs),
+                         min(REPLICATES_PER_JOB, numReplicates - start)))
+        logging.info("Computing {n} bootstrap replicates of {z} query " \
+                     "ZMWs in {j} jobs using {p} processes.".format(
+                     n=numReplicates, z=self.numZmws, j=len(jobs), p=nproc))
+        if nproc > 1:
+            pool = Pool(processes=nproc, initializer=_InitWorker,
+                        initargs=(self._data(),))
+            rets = pool.map(_BootstrapJob, jobs)
+            pool.close()
+            pool.join()
+        else:
+            _InitWorker(self._data())
+            rets = [_BootstrapJob(job) for job in jobs]
+
+        points = self.pointEstimates()
+        q = [100 * alpha / 2, 100 * (1 - alpha / 2)]
+        ret = {}
+        for c in self.cutoffs:
+            sens = np.concatenate([r[c][0] for r in rets])
+            fdr = np.concatenate([r[c][1] for r in rets])
+            sensLow, sensHigh = _Percentiles(sens, q)
+            fdrLow, fdrHigh = _Percentiles(fdr, q)
+            ret[c] = (points[c][0], sensLow, sensHigh,
+                      points[c][1], fdrLow, fdrHigh)
+        return ret
+
+    def write(self, bands, outfiles):
+        """Write bands of cutoffs[i] returned by run to outfiles[i]."""
+        header = ("ScoreCutoff", "sensitivity", "sensitivityLow",
+                  "sensitivityHigh", "FDR", "FDRLow", "FDRHigh")
+        for c, outfile in zip(self.cutoffs, outfiles):
+            with open(outfile, 'w') as writer:
+                writer.write("\t".join(header) + "\n")
+                for i, ub in enumerate(self.scoreCutoffs):
+                    writer.write("\t".join([str(ub)] +
+                                 ["{0:.6f}".format(band[i])
+                                  for band in bands[c]]) + "\n")
+
+
+def _GroupByZmwAndBin(zmws, bins, mask, numZmws):
+    """Return (zmws, counts, binStarts, binIndices) of distinct (ZMW,
+    bin) pairs of hits where mask is True, sorted by bin, where pairs of
+    bin binIndices[k] start at binStarts[k]."""
+    keys, counts = np.unique(bins[mask] * numZmws + zmws[mask],
+                             return_counts=True)
+    binIndices, binStarts = np.unique(keys // numZmws, return_index=True)
+    return (keys % numZmws, counts, binStarts, binIndices)
+
+
+def _InitWorker(data):
+    """Set per-ZMW numbers shared by jobs of this process."""
+    global _WORKER_DATA
+    _WORKER_DATA = data
+
+
+def _BootstrapJob(job):
+    """Compute sensitivity and FDR of a job of (seed, numReplicates)."""
+    seed, numReplicates = job
+    numZmws = _WORKER_DATA[0]
+    rng = np.random.RandomState(seed)
+    draws = rng.randint(0, numZmws, size=(numReplicates, numZmws))
+    # weights[r, z]: number of times ZMW z is drawn in replicate r
+    offsets = (np.arange(numReplicates) * numZmws)[:, np.newaxis]
+    weights = np.bincount((draws + offsets).ravel(),
+                          minlength=numReplicates * numZmws).\
+              reshape(numReplicates, numZmws)
+    return _ReplicateRates(weights)
+
+
+def _ReplicateRates(weights):
+    """Return a dictionary, cutoff -> (sensitivity, FDR), each a matrix
+    of replicates by score cutoffs, given weights of query ZMWs of each
+    replicate."""
+    numZmws, numBins, cutoffs, gtPos, hits = _WORKER_DATA
+    ret = {}
+    for c in cutoffs:
+        numGTPos = weights.dot(gtPos[c])[:, np.newaxis]
+        tp, fp = [_CumulativeCounts(weights, numBins, *group)
+                  for group in hits[c]]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ret[c] = (tp / numGTPos, fp / (fp + tp))
+    return ret
+
+
+def _CumulativeCounts(weights, numBins, pairZmws, counts, binStarts,
+                      binIndices):
+    """Return numbers of hits of score bins up to each bin of each
+    replicate, as a float matrix of replicates by bins."""
+    ret = np.zeros((weights.shape[0], numBins), dtype=np.float64)
+    if len(pairZmws) > 0:
+        ret[:, binIndices] = np.add.reduceat(weights[:, pairZmws] * counts,
+                                             binStarts, axis=1)
+    return np.cumsum(ret, axis=1)
+
+
+def _Percentiles(values, q):
+    """Return percentiles q of each column of values, ignoring NaN."""
+    with warnings.catch_warnings():
+        # Columns of all NaN have NaN percentiles.
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return [np.nanpercentile(values, p, axis=0) for p in q]
@@ -0,0 +1,316 @@
+"""Define class EvalPartitioner, which splits inputs of pbove_eval
+(query reads, resequencing and preassembly M4 files) into partitions by
+ZMW on disk, so that overlaps can be evaluated one partition at a time."""
+
+import os.path as op
+import zlib
+import json
+import logging
+from array import array
+import numpy as np
+from pbove.Reseq import SearchOffsetsOfZmws
+from pbove.io.M4IO import M4HEADER
+from pbove.utils.Utils import mkdir
+
+
+def ZmwOfReadName(readName):
+    """Return (movie, holeNumber) of a PacBio read name, such as
+    movie/holeNumber/start_end."""
+    fields = readName.strip().split("/")
+    return (fields[0], int(fields[1]))
+
+
+def ZmwPartition(movie, holeNumber, numPartitions):
+    """Return partition index of a zmw in [0, numPartitions), which is
+    stable across processes and machines."""
+    key = "{0}/{1}".format(movie, holeNumber)
+    return (zlib.crc32(key) & 0xffffffff) % numPartitions
+
+
+def ZmwSampled(movie, holeNumber, fraction):
+    """Return True if a zmw is in a deterministic sample of about
+    fraction of all ZMWs, which is stable across processes and machines,
+    and nested, i.e., a sample of a smaller fraction is a subset of a
+    sample of a larger one."""
+    if fraction is None or fraction >= 1:
+        return True
+    key = "sample:{0}/{1}".format(movie, holeNumber)
+    return (zlib.crc32(key) & 0xffffffff) < fraction * 0x100000000
+
+
+class EvalPartitioner(object):
+    """Split query reads, reseq_m4 and preassembly_m4 into numPartitions
+    partitions by hashing ZMWs of query reads, and put reseq hits of
+    target ZMWs (ZMWs of target reads and targets of preassembly hits),
+    which every partition needs, into a separate file.
+
+    For partition i, files are
+        reseq_m4_of(i)       : reseq hits of non-target ZMWs in i,
+        preassembly_m4_of(i) : preassembly hits whose query ZMW is in i,
+        preassembly_idx_of(i): line index of each hit in preassembly_m4,
+        query_fasta_of(i)    : names of query reads whose ZMW is in i,
+        query_idx_of(i)      : index of each query read in query_fasta.
+    If sampleFraction is not None, only query reads and preassembly hits
+    of query ZMWs in a sample of sampleFraction ZMWs (see ZmwSampled)
+    are written to partitions.
+    """
+    def __init__(self, query_fasta, target_fasta, reseq_m4, preassembly_m4,
+                 out_dir, numPartitions, partitions=None,
+                 sampleFraction=None):
+        """partitions: indices of partitions to write to disk, all
+        partitions if None."""
+        self.query_fasta = query_fasta
+        self.target_fasta = target_fasta
+        self.reseq_m4 = reseq_m4
+        self.preassembly_m4 = preassembly_m4
+        self.out_dir = out_dir
+        self.numPartitions = int(numPartitions)
+        if self.numPartitions < 1:
+            raise ValueError("Number of partitions must be positive.")
+        self.partitions = range(self.numPartitions) if partitions is None \
+                          else sorted(set(partitions))
+        self.sampleFraction = sampleFraction
+        # Sorted zmw keys of all reseq hits and where searchRead stops
+        # in reads of each zmw, see searchOffsets.
+        self.movieRanks = {}
+        self.zmwKeys = None
+        self.zmwOffsets = None
+
+    def _fn(self, name, i):
+        """Return file name of partition i."""
+        return op.join(self.out_dir, "{n}.{i}".format(n=name, i=i))
+
+    def reseq_m4_of(self, i):
+        """Return reseq hits of non-target ZMWs in partition i."""
+        return self._fn("reseq.m4", i)
+
+    @property
+    def target_reseq_m4(self):
+        """Return reseq hits of target ZMWs."""
+        return op.join(self.out_dir, "reseq.m4.targets")
+
+    def preassembly_m4_of(self, i):
+        """Return preassembly hits of partition i."""
+        return self._fn("preassembly.m4", i)
+
+    def preassembly_idx_of(self, i):
+        """Return line indices of preassembly hits of partition i."""
+        return self._fn("preassembly.idx", i)
+
+    def query_fasta_of(self, i):
+        """Return names of query reads of partition i."""
+        return self._fn("query.fasta", i)
+
+    def query_idx_of(self, i):
+        """Return indices of query reads of partition i."""
+        return self._fn("query.idx", i)
+
+    def partition(self, movie, holeNumber):
+        """Return partition index of a zmw."""
+        return ZmwPartition(movie, holeNumber, self.numPartitions)
+
+    def _queryPartition(self, movie, holeNumber):
+        """Return partition index of a query zmw, or None if the zmw is
+        not sampled."""
+        if not ZmwSampled(movie, holeNumber, self.sampleFraction):
+            return None
+        return self.partition(movie, holeNumber)
+
+    def _writers(self, fn_func):
+        """Return a writer of each partition, None if a partition is
+        not written."""
+        writers = [None] * self.numPartitions
+        for i in self.partitions:
+            writers[i] = open(fn_func(i), 'w')
+        return writers
+
+    @staticmethod
+    def _close(writers):
+        """Close writers."""
+        for writer in writers:
+            if writer is not None:
+                writer.close()
+
+    def _targetZmws(self):
+        """Return a set of ZMWs of target reads and targets of
+        preassembly hits."""
+        zmws = set()
+        with open(self.target_fasta, 'r') as reader:
+            for line in reader:
+                if line[0] == ">":
+                    zmws.add(ZmwOfReadName(line[1:]))
+        with open(self.preassembly_m4, 'r') as reader:
+            for line in reader:
+                if _isM4Record(line):
+                    zmws.add(ZmwOfReadName(line.split()[1]))
+        return zmws
+
+    def _splitPreassembly(self):
+        """Split preassembly_m4 by query ZMW, keeping line indices."""
+        m4Writers = self._writers(self.preassembly_m4_of)
+        idxWriters = self._writers(self.preassembly_idx_of)
+        index = 0
+        with open(self.preassembly_m4, 'r') as reader:
+            for line in reader:
+                if not _isM4Record(line):
+                    continue
+                i = self._queryPartition(*ZmwOfReadName(line.split()[0]))
+                if i is not None and m4Writers[i] is not None:
+                    m4Writers[i].write(line)
+                    idxWriters[i].write("{0}\n".format(index))
+                index += 1
+        self._close(m4Writers + idxWriters)
+
+    def _splitQuery(self):
+        """Split names of query reads by ZMW, keeping indices."""
+        faWriters = self._writers(self.query_fasta_of)
+        idxWriters = self._writers(self.query_idx_of)
+        index = 0
+        with open(self.query_fasta, 'r') as reader:
+            for line in reader:
+                if line[0] != ">":
+                    continue
+                i = self._queryPartition(*ZmwOfReadName(line[1:]))
+                if i is not None and faWriters[i] is not None:
+                    faWriters[i].write(line)
+                    idxWriters[i].write("{0}\n".format(index))
+                index += 1
+        self._close(faWriters + idxWriters)
+
+    def _splitReseq(self, targetZmws):
+        """Split reseq_m4 by ZMW, put hits of target ZMWs to
+        target_reseq_m4, and compute search offsets of all ZMWs."""
+        writers = self._writers(self.reseq_m4_of)
+        targetWriter = open(self.target_reseq_m4, 'w')
+        movieIds, movies, holes = {}, array('l'), array('l')
+        with open(self.reseq_m4, 'r') as reader:
+            for line in reader:
+                if not _isM4Record(line):
+                    continue
+                movie, holeNumber = ZmwOfReadName(line.split()[0])
+                if (movie, holeNumber) in targetZmws:
+                    targetWriter.write(line)
+                else:
+                    writer = writers[self.partition(movie, holeNumber)]
+                    if writer is not None:
+                        writer.write(line)
+                movies.append(movieIds.setdefault(movie, len(movieIds)))
+                holes.append(holeNumber)
+        self._close(writers + [targetWriter])
+
+        # Replay searchRead on the whole reseq_m4.
+        self.movieRanks = dict([(m, r) for r, m in
+                                enumerate(sorted(movieIds.keys()))])
+        ranks = np.zeros(len(movieIds), dtype=np.int64)
+        for movie, movieId in movieIds.iteritems():
+            ranks[movieId] = self.movieRanks[movie]
+        keys = (ranks[np.frombuffer(movies, dtype=np.int_)] << 32) + \
+               np.frombuffer(holes, dtype=np.int_)
+        self.zmwKeys, counts = np.unique(keys, return_counts=True)
+        self.zmwOffsets = SearchOffsetsOfZmws(counts)
+
+    def run(self):
+        """Split inputs into partitions."""
+        mkdir(self.out_dir)
+        logging.info("Splitting inputs into {n} partitions in {d}, " \
+                     "writing partitions {p}.".format(n=self.numPartitions,
+                     d=self.out_dir, p=self.partitions))
+        targetZmws = self._targetZmws()
+        self._splitPreassembly()
+        self._splitQuery()
+        self._splitReseq(targetZmws)
+
+    def searchOffsets(self, groundTruth):
+        """Return searchOffsets of ZMWs of a ReseqGroundTruth loaded from
+        some of the partitions, see ReseqGroundTruth.searchRead."""
+        zmws = sorted(set([(r.qpbi.movie, r.qpbi.holeNumber)
+                           for r in groundTruth.readToReference]))
+        if len(zmws) == 0:
+            return {}
+        keys = np.array([(self.movieRanks[m] << 32) + h for m, h in zmws],
+                        dtype=np.int64)
+        offsets = self.zmwOffsets[np.searchsorted(self.zmwKeys, keys)]
+        return dict(zip(zmws, offsets.tolist()))
+
+
+def ParsePartition(value):
+    """Parse a partition string 'i/N' and return (i, N), where
+    0 <= i < N."""
+    try:
+        i, n = [int(v) for v in str(value).split("/")]
+    except ValueError:
+        raise ValueError("Could not parse partition {v} as i/N.".
+                         format(v=value))
+    if not (n >= 1 and 0 <= i < n):
+        raise ValueError("Partition {v} must satisfy 0 <= i < N.".
+                         format(v=value))
+    return (i, n)
+
+
+class PartialEvalResult(object):
+    """Mergeable result of evaluating one partition of N, saved as json.
+    File names are relative to directory of the json file, so that
+    partial results can be moved from node to node.
+        partition, numPartitions: i and N
+        sampleFraction: fraction of sampled query ZMWs, or None
+        numQ, numT:   numbers of query reads of this partition and of
+                      all target reads
+        hist:         ground truth OverlapHistogram of query reads of
+                      this partition to all target reads (npz)
+        scoreCounts:  QTSO.ScoreCounts of hits of this partition (npz)
+        qtso:         QTSO of hits of this partition, of which the 5th
+                      column is index of a hit in preassembly_m4
+        gtOverlaps:   ground truth overlaps of query reads of this
+                      partition, each prefixed with a sort key, or None
+        zmwHist:      ZmwOverlapHistogram of query ZMWs of this partition
+                      for bootstrap (npz), or None
+    """
+    KEYS = ("partition", "numPartitions", "sampleFraction", "numQ", "numT",
+            "hist", "scoreCounts", "qtso", "gtOverlaps", "zmwHist")
+    # Keys of file names
+    PATH_KEYS = ("hist", "scoreCounts", "qtso", "gtOverlaps", "zmwHist")
+
+    def __init__(self, **kwargs):
+        for key in self.KEYS:
+            setattr(self, key, kwargs.get(key, None))
+
+    @staticmethod
+    def fn(out_dir, partition, numPartitions):
+        """Return json file name of partition i/N in out_dir."""
+        return op.join(out_dir, "partial.{i}_of_{n}.json".format(
+                       i=partition, n=numPartitions))
+
+    def write(self, fn):
+        """Save to json file fn, paths relative to directory of fn."""
+        d = op.dirname(op.abspath(fn))
+        ret = {}
+        for key in self.KEYS:
+            value = getattr(self, key)
+            if key in self.PATH_KEYS and value is not None:
+                value = op.relpath(op.abspath(value), d)
+            ret[key] = value
+        with open(fn, 'w') as writer:
+            json.dump(ret, writer, indent=2, sort_keys=True)
+
+    @classmethod
+    def read(cls, fn):
+        """Load from json file fn, with absolute paths."""
+        d = op.dirname(op.abspath(fn))
+        with open(fn, 'r') as reader:
+            ret = json.load(reader)
+        for key in cls.PATH_KEYS:
+            if ret.get(key, None) is not None:
+                ret[key] = op.join(d, str(ret[key]))
+        return cls(**ret)
+
+
+def _isM4Record(line):
+    """Return True if line is a record of an M4 file, see M4StreamReader."""
+    line = line.rstrip()
+    return len(line) > 0 and line[0] != '#' and line != M4HEADER
+
+
+def ReadIndices(fn):
+    """Return a list of int indices, one per line of fn."""
+    with open(fn, 'r') as reader:
+        return [int(line) for line in reader]
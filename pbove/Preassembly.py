@@ -1,6 +1,6 @@
 """Define class PreassmblyPrediction."""
 from pbove.io.M4IO import M4Reader
-from datetime import datetime
+from pbove.utils.Progress import Progress
 
 class PreassemblyPrediction(object):
     """ Read an M4 file which contains read-read alignments as
@@ -32,31 +32,53 @@ class PreassemblyPrediction(object):
     def OverlapLengthOfQandTInReference(self, groundTruth, index, infer=False):
         """Map a read-read M4 entry, compute the overlap length between
            query and Target."""
-        return groundTruth.OverlapLengthOfQandTInReference(
-                self.readToRead[index], infer)
+        return groundTruth.EvaluateHit(self.readToRead[index], infer)[4]
 
 
+    def MappingKeys(self, infer=False):
+        """Return keys (movie, holeNumber, start, end, infer) of all
+        subreads which OverlapLengthsInReference maps to reference."""
+        keys = set()
+        for i in self.readToRead:
+            keys.add((i.qpbi.movie, i.qpbi.holeNumber,
+                      i.qpbi.start, i.qpbi.end, False))
+            keys.add((i.tpbi.movie, i.tpbi.holeNumber,
+                      i.tpbi.start, i.tpbi.end, False))
+            keys.add((i.qpbi.movie, i.qpbi.holeNumber,
+                      i.abs_qstart, i.abs_qend, infer))
+            keys.add((i.tpbi.movie, i.tpbi.holeNumber,
+                      i.abs_tstart, i.abs_tend, infer))
+        return keys
+
     def OverlapLengthsInReference(self, groundTruth, infer=False):
         """For each read to read alignment in the M4 file, compute the
         overlap length of their mapped intervals in the reference genome. """
-        for index, i in enumerate(self.readToRead):
-            if index % 1000 == 0:
-                print "Processing {0} / {1} read-read alignment at {2}" \
-                      .format(index, len(self.readToRead), str(datetime.now()))
-            i.QMappable = groundTruth.IsMappable(i.qpbi)
-            i.TMappable = groundTruth.IsMappable(i.tpbi)
-            i.overlapLength = groundTruth.OverlapLengthOfQandTInReference(
-                i, infer)
+        # The same seed read is the target of many alignments, map each
+        # distinct subread only once.
+        if groundTruth.cacheSize is None:
+            groundTruth.PrecomputeMappings(self.MappingKeys(infer))
+        progress = Progress("Processing read-read alignment",
+                            len(self.readToRead))
+        for i in self.readToRead:
+            progress.update()
+            (_qInterval, _tInterval, i.QMappable, i.TMappable,
+             i.overlapLength) = groundTruth.EvaluateHit(i, infer)
+        progress.done()
 
-    def ToQTSO(self, outfile=""):
-        """For each read to read alignment, print in QTSO format."""
+    def ToQTSO(self, outfile="", indices=None):
+        """For each read to read alignment, print in QTSO format.
+        If indices is not None, append indices[k] of the k-th alignment
+        to its record as the 5th column, e.g., its line number in the
+        original M4 file, which QTSO readers ignore."""
         if outfile != "":
             of = open (outfile, 'w')
-        for i in self.readToRead:
+        for k, i in enumerate(self.readToRead):
             if not i.QMappable or not i.TMappable:
                 continue
             record = "{0}\t{1}\t{2}\t{3}\n"\
                     .format(i.qpbi, i.tpbi, i.score, i.overlapLength)
+            if indices is not None:
+                record = record[:-1] + "\t{0}\n".format(indices[k])
             if outfile == "":
                 print record
             else:
@@ -76,17 +98,18 @@ class PreassemblyPrediction(object):
         # reference) and map(R.target, reference) overlap by 0 bps.
         # Boundry) An alignment R is boundary iff map(R.query, reference)
         # and map(R.target, reference) overlap by > 0 and < 200 bps
-        for index, i in enumerate(self.readToRead):
-            if index % 1000 == 0:
-                print "Processing {0} / {1} read-read alignment at {2}" \
-                      .format(index, len(self.readToRead), str(datetime.now()))
-            i.overlapLength = groundTruth.OverlapLengthOfQandTInReference(
-                i, infer)
+        progress = Progress("Processing read-read alignment",
+                            len(self.readToRead))
+        for i in self.readToRead:
+            progress.update()
+            (_qInterval, _tInterval, i.QMappable, i.TMappable,
+             i.overlapLength) = groundTruth.EvaluateHit(i, infer)
             if i.overlapLength >= overlapLengthCutoff:
                 numTP += 1
             elif i.overlapLength <= 0:
                 numFP += 1
             else:
                 numBoundary += 1
+        progress.done()
         return (numTP, numFP, numBoundary)
 
@@ -1,7 +1,12 @@
 """ Define class QTSO, which is short for Query_Target_Score_Overlap."""
 
 from sys import maxint
+import os.path as op
+import json
 from pbove.io.QTSOIO import QTSOReader
+# numpy and pbove.utils.compute are imported where they are used, so that
+# tools which only read tables and metrics (e.g., pbove_compare_runs)
+# start fast.
 
 
 class QTSO(object):
@@ -53,73 +58,26 @@ class QTSO(object):
             number of PW alignments whose score is in [score_lower_bound,
             score_upper_bound) and overlap length is in [1, overLaplengthCutoff).
         """
-        (minScore, maxScore) = self.getMinMaxScores()
         overlapLengthCutoff = int(overlapLengthCutoff)
-        indx = 0
-        self.deltaTable = []
-        s = (minScore/100) * 100 - 100
-
-        headers = ("scoreLowerBound", "scoreUpperBound",
-                  "numDeltaTruePositive", "numDeltaFalsePositive",
-                  "numDeltaWeakPositive")
-
-        if outfile != "" and outfile is not None:
-            of = open (outfile, 'w')
-            of.write("#" + "\t".join(headers) + "\n")
-
-        while (s <= maxScore):
-            # read-read overlap length l,
-            # if l >=overlapLengthCutoff:
-            #     True Positive
-            #     predicted=positive, ground truth = positive
-            # if l <= 0 :
-            #     False Positive
-            #     predicted=positive, ground truth = negative
-            # otherwise:
-            #     Positive Weak,
-            #     predicted=Positive, ground truth = weak positive
-            numdeltaTP, numdeltaFP, numdeltaPW = 0, 0, 0
-            # Range [s, s+stepSize)
-            while (indx < len(self.records)):
-                r = self.records[indx]
-                if r.score < s:
-                    e = "ERROR computing delta table r.score = {0} < s = {1}".\
-                        format(r.score, s)
-                    raise Exception (e)
-                if r.score >= s + stepSize:
-                    break
-                if r.score >= s and r.score < s + stepSize:
-                    # print r
-                    if (r.overlap >= overlapLengthCutoff):
-                        numdeltaTP += 1
-                    #    print " >= {0}, numdeltaTP = {1}".format(
-                    #        overlapLengthCutoff, numdeltaTP)
-                    elif (r.overlap <= 0):
-                        numdeltaFP += 1
-                    #    print " <= {0}, numdeltaFP = {1}".format(
-                    #        overlapLengthCutoff, numdeltaFP)
-                    elif (r.overlap < overlapLengthCutoff and
-                        r.overlap > 0):
-                        numdeltaPW += 1
-                    #    print "0 < r.overlap < {0}, numdeltaPW = {1}".format(
-                    #        overlapLengthCutoff, numdeltaPW)
-
-                indx += 1
-            if (numdeltaTP != 0 or numdeltaFP != 0 or numdeltaPW != 0):
-                res = (s, s+stepSize, numdeltaTP, numdeltaFP, numdeltaPW)
-                if outfile == "":
-                    print "\t".join([str(item) for item in res])
-                else:
-                    of.write("\t".join([str(item) for item in res]) + "\n")
-                self.deltaTable.append(res)
-            s += stepSize
-
-        if outfile != "":
-            of.close()
+        self.deltaTable = self.getDeltaTables(
+                stepSize=stepSize, overlapLengthCutoffs=[overlapLengthCutoff],
+                outfiles=[outfile])[overlapLengthCutoff]
+
+    def getDeltaTables(self, stepSize, overlapLengthCutoffs, outfiles=None):
+        """Generate delta tables (see getDeltaTable) of multiple overlap
+        length cutoffs in one pass over records. Write the delta table of
+        overlapLengthCutoffs[i] to outfiles[i] ("" to print, None to not
+        write at all). Return a dictionary, cutoff -> delta table."""
+        scoreCounts = ScoreCounts()
+        for r in self.records:
+            scoreCounts.add(r.score, r.overlap)
+        return scoreCounts.getDeltaTables(stepSize=stepSize,
+                overlapLengthCutoffs=overlapLengthCutoffs,
+                outfiles=outfiles)
 
     def getTable(self, numGTPos, numGTNeg, numGTWeak,
                  numUnmappableAlns, numMappableAlns, numAlns,
-                 outfile=""):
+                 outfile="", deltaTable=None, metrics=None):
         """
             Return a table each row of which has the following fields:
             "ScoreCutoff",
@@ -148,62 +106,329 @@ class QTSO(object):
             numMappableAln: number of <readi, readj> pairs of which both readi and readj
             can map to the reference genome.
             numAlns total number of alignments = |# of query reads| * |# of target reads|
-        """
-        numTP, numFP, numFN, numTN, numPW, numNW = 0, 0, 0, 0, 0, 0
-        numGTPos  = long(numGTPos)
-        numGTNeg  = long(numGTNeg)
-        numGTWeak = long(numGTWeak)
-        numPredPos, numPredNeg = 0, 0
-        numUnmappableAlns, numMappableAlns, numAlns = long(numUnmappableAlns), \
-        long(numMappableAlns), long(numAlns)
-        header = ("ScoreCutoff",
-            "numTP", "numFP", "numFN", "numTN", "numPW", "numNW",
-            "numGTPos", "numGTNeg", "numGTWeak",
-            "numPredPos", "numPredNeg",
-            "numUnmappableAlns", "numMappableAlns", "numAlns")
-
-        if outfile == "":
-            print "\t".join(header)
-        else:
-            of = open(outfile, 'w')
-            of.write("\t".join(header) + "\n")
-
-        for deltaItem in self.deltaTable:
-            # each deltaItem has five fields:
-            # score lower bound, score upper bound, numdeltaTP, numdeltaFP,
-            # numdeltaPW
-            _lb, ub, numdeltaTP, numdeltaFP, numdeltaPW = deltaItem
-            numTP += numdeltaTP
-            numFP += numdeltaFP
-            numPW += numdeltaPW
-            numFN = numGTPos - numTP
-            numTN = numGTNeg - numFP
-            numNW = numGTWeak - numPW
-            numPredPos = numTP + numFP + numPW
-            numPredNeg = numFN + numTN + numNW
-            assert(numPredPos + numPredNeg == numMappableAlns)
-            assert(numGTPos + numGTNeg + numGTWeak == numMappableAlns)
-            res = (ub,
-                   numTP, numFP, numFN, numTN, numPW, numNW,
-                   numGTPos, numGTNeg, numGTWeak,
-                   numPredPos, numPredNeg,
-                   numUnmappableAlns, numMappableAlns, numAlns)
-            if outfile == "":
-                print "\t".join([str(item) for item in res])
-            else:
-                of.write("\t".join([str(item) for item in res]) + "\n")
-
-        if outfile != "":
-            of.close()
-
-
-
-
-
-
 
+            deltaTable: delta table to accumulate, self.deltaTable if None.
+            metrics: if not None, a ROCMetrics to which every row is added.
+        """
+        if deltaTable is None:
+            deltaTable = self.deltaTable
+        WriteTable(numGTPos=numGTPos, numGTNeg=numGTNeg, numGTWeak=numGTWeak,
+                   numUnmappableAlns=numUnmappableAlns,
+                   numMappableAlns=numMappableAlns, numAlns=numAlns,
+                   deltaTable=deltaTable, outfile=outfile, metrics=metrics)
+
+
+class ScoreCounts(object):
+    """Numbers of QTSO records of each (score, overlap length), from
+    which delta tables of any overlap length cutoff can be computed,
+    without keeping QTSO records in memory."""
+    def __init__(self):
+        # score -> {overlap length -> number of records}
+        self.counts = {}
+
+    def add(self, score, overlap, count=1):
+        """Add count records of score and overlap length."""
+        ovlCounts = self.counts.setdefault(score, {})
+        ovlCounts[overlap] = ovlCounts.get(overlap, 0) + count
+
+    def addQTSOFile(self, fileName):
+        """Add all records of a QTSO file."""
+        reader = QTSOReader(fileName)
+        for r in reader:
+            self.add(r.score, r.overlap)
+        reader.close()
+
+    def merge(self, another):
+        """Add all records counted in another ScoreCounts."""
+        for score, ovlCounts in another.counts.iteritems():
+            for overlap, count in ovlCounts.iteritems():
+                self.add(score, overlap, count)
+
+    def write(self, fn):
+        """Save to a compressed npz file."""
+        import numpy as np
+        rows = [(score, overlap, count)
+                for score, ovlCounts in sorted(self.counts.iteritems())
+                for overlap, count in sorted(ovlCounts.iteritems())]
+        scores, overlaps, counts = zip(*rows) if len(rows) > 0 \
+                                   else ([], [], [])
+        with open(fn, 'wb') as writer:
+            np.savez_compressed(writer,
+                    score=np.array(scores, dtype=np.int64),
+                    overlap=np.array(overlaps, dtype=np.int64),
+                    count=np.array(counts, dtype=np.int64))
+
+    @classmethod
+    def read(cls, fn):
+        """Load from an npz file."""
+        import numpy as np
+        ret = cls()
+        with np.load(fn) as data:
+            for score, overlap, count in zip(data['score'].tolist(),
+                    data['overlap'].tolist(), data['count'].tolist()):
+                ret.add(score, overlap, count)
+        return ret
 
+    def getDeltaTables(self, stepSize, overlapLengthCutoffs, outfiles=None):
+        """Same as QTSO.getDeltaTables."""
+        scores = sorted(self.counts.keys())
+        (minScore, maxScore) = (scores[0], scores[-1]) if len(scores) > 0 \
+                               else (maxint, -maxint-1)
+        cutoffs = [int(c) for c in overlapLengthCutoffs]
+        if len(set(cutoffs)) != len(cutoffs):
+            raise ValueError("Overlap length cutoffs must be distinct.")
+        if outfiles is None:
+            outfiles = [None] * len(cutoffs)
+        assert(len(outfiles) == len(cutoffs))
+        indx = 0
+        deltaTables = dict([(c, []) for c in cutoffs])
+        s = (minScore/100) * 100 - 100
 
+        headers = ("scoreLowerBound", "scoreUpperBound",
+                  "numDeltaTruePositive", "numDeltaFalsePositive",
+                  "numDeltaWeakPositive")
 
+        ofs = []
+        for outfile in outfiles:
+            of = None
+            if outfile != "" and outfile is not None:
+                of = open (outfile, 'w')
+                of.write("#" + "\t".join(headers) + "\n")
+            ofs.append(of)
 
+        while (s <= maxScore):
+            # read-read overlap length l,
+            # if l >=overlapLengthCutoff:
+            #     True Positive
+            #     predicted=positive, ground truth = positive
+            # if l <= 0 :
+            #     False Positive
+            #     predicted=positive, ground truth = negative
+            # otherwise:
+            #     Positive Weak,
+            #     predicted=Positive, ground truth = weak positive
+            # numdeltaTP, numdeltaFP and numdeltaPW of each cutoff
+            numdeltaTPs = [0] * len(cutoffs)
+            numdeltaFPs = [0] * len(cutoffs)
+            numdeltaPWs = [0] * len(cutoffs)
+            # Range [s, s+stepSize)
+            while (indx < len(scores) and scores[indx] < s + stepSize):
+                for overlap, count in self.counts[scores[indx]].iteritems():
+                    for i, cutoff in enumerate(cutoffs):
+                        if (overlap >= cutoff):
+                            numdeltaTPs[i] += count
+                        elif (overlap <= 0):
+                            numdeltaFPs[i] += count
+                        else:
+                            numdeltaPWs[i] += count
+                indx += 1
+            for i, cutoff in enumerate(cutoffs):
+                numdeltaTP, numdeltaFP, numdeltaPW = \
+                        numdeltaTPs[i], numdeltaFPs[i], numdeltaPWs[i]
+                if (numdeltaTP != 0 or numdeltaFP != 0 or numdeltaPW != 0):
+                    res = (s, s+stepSize, numdeltaTP, numdeltaFP, numdeltaPW)
+                    if outfiles[i] == "":
+                        print "\t".join([str(item) for item in res])
+                    elif ofs[i] is not None:
+                        ofs[i].write("\t".join([str(item) for item in res]) +
+                                     "\n")
+                    deltaTables[cutoff].append(res)
+            s += stepSize
 
+        for of in ofs:
+            if of is not None:
+                of.close()
+        return deltaTables
+
+
+TABLE_HEADER = ("ScoreCutoff",
+    "numTP", "numFP", "numFN", "numTN", "numPW", "numNW",
+    "numGTPos", "numGTNeg", "numGTWeak",
+    "numPredPos", "numPredNeg",
+    "numUnmappableAlns", "numMappableAlns", "numAlns")
+
+# FDR targets at which ROCMetrics reports the best sensitivity.
+FDR_TARGETS = (0.05, 0.1, 0.2, 0.5)
+
+CONFIDENCE_TABLE_HEADER = ("ScoreCutoff",
+    "sensitivity", "sensitivityLow", "sensitivityHigh",
+    "FDR", "FDRLow", "FDRHigh",
+    "estNumTP", "estNumFP", "estNumGTPos")
+
+
+def TableRows(numGTPos, numGTNeg, numGTWeak, numUnmappableAlns,
+              numMappableAlns, numAlns, deltaTable):
+    """Yield a row of accumulated numbers (see TABLE_HEADER) of each
+    score cutoff in deltaTable, see QTSO.getTable."""
+    numTP, numFP, numFN, numTN, numPW, numNW = 0, 0, 0, 0, 0, 0
+    numGTPos  = long(numGTPos)
+    numGTNeg  = long(numGTNeg)
+    numGTWeak = long(numGTWeak)
+    numPredPos, numPredNeg = 0, 0
+    numUnmappableAlns, numMappableAlns, numAlns = long(numUnmappableAlns), \
+    long(numMappableAlns), long(numAlns)
+
+    for deltaItem in deltaTable:
+        # each deltaItem has five fields:
+        # score lower bound, score upper bound, numdeltaTP, numdeltaFP,
+        # numdeltaPW
+        _lb, ub, numdeltaTP, numdeltaFP, numdeltaPW = deltaItem
+        numTP += numdeltaTP
+        numFP += numdeltaFP
+        numPW += numdeltaPW
+        numFN = numGTPos - numTP
+        numTN = numGTNeg - numFP
+        numNW = numGTWeak - numPW
+        numPredPos = numTP + numFP + numPW
+        numPredNeg = numFN + numTN + numNW
+        assert(numPredPos + numPredNeg == numMappableAlns)
+        assert(numGTPos + numGTNeg + numGTWeak == numMappableAlns)
+        yield (ub,
+               numTP, numFP, numFN, numTN, numPW, numNW,
+               numGTPos, numGTNeg, numGTWeak,
+               numPredPos, numPredNeg,
+               numUnmappableAlns, numMappableAlns, numAlns)
+
+
+def WriteTable(numGTPos, numGTNeg, numGTWeak, numUnmappableAlns,
+               numMappableAlns, numAlns, deltaTable, outfile="",
+               metrics=None):
+    """Write a table of accumulated numbers of each score cutoff in
+    deltaTable to outfile ("" to print), see QTSO.getTable, and add
+    every row to metrics (a ROCMetrics) if it is not None."""
+    if outfile == "":
+        print "\t".join(TABLE_HEADER)
+    else:
+        of = open(outfile, 'w')
+        of.write("\t".join(TABLE_HEADER) + "\n")
+
+    for res in TableRows(numGTPos=numGTPos, numGTNeg=numGTNeg,
+                         numGTWeak=numGTWeak,
+                         numUnmappableAlns=numUnmappableAlns,
+                         numMappableAlns=numMappableAlns, numAlns=numAlns,
+                         deltaTable=deltaTable):
+        if outfile == "":
+            print "\t".join([str(item) for item in res])
+        else:
+            of.write("\t".join([str(item) for item in res]) + "\n")
+        if metrics is not None:
+            metrics.add(res)
+
+    if outfile != "":
+        of.close()
+
+
+class ROCMetrics(object):
+    """Summary metrics of a table (see TableRows), computed while rows
+    are added in order of score cutoffs:
+        auc: area under the curve of precision (1 - FDR) versus
+             sensitivity, i.e., the sensitivity-FDR curve with FDR
+             flipped, so that 1 is perfect and higher is better,
+        bestF1, bestF1ScoreCutoff: maximum F1, 2TP / (2TP + FP + FN),
+             and its score cutoff,
+        sensitivityAtFDR: for each FDR target, the maximum sensitivity
+             of score cutoffs whose FDR is at most the target, and the
+             score cutoff, or None if there is none.
+    Sensitivity is TP / (TP + FN), FDR is FP / (FP + TP), weak pairs are
+    not counted, as in R plots of pbove_compare_runs."""
+    def __init__(self, fdrTargets=FDR_TARGETS):
+        self.fdrTargets = sorted(fdrTargets)
+        self.auc = 0.0
+        self.bestF1, self.bestF1ScoreCutoff = 0.0, None
+        self.maxSensitivity = 0.0
+        # FDR target -> (sensitivity, score cutoff)
+        self.sensitivityAtFDR = dict([(t, None) for t in self.fdrTargets])
+        self._last = None
+
+    def add(self, row):
+        """Add a row of a table, see TABLE_HEADER."""
+        scoreCutoff, numTP, numFP, numFN = row[0:4]
+        numPredPos = numTP + numFP
+        if numPredPos == 0:
+            return
+        sensitivity = numTP / float(numTP + numFN) if numTP + numFN > 0 \
+                      else 0.0
+        precision = numTP / float(numPredPos)
+        # Trapezoids between consecutive points, extending the first
+        # point to sensitivity 0.
+        lastSensitivity, lastPrecision = self._last if self._last \
+                                         is not None else (0.0, precision)
+        self.auc += (sensitivity - lastSensitivity) * \
+                    (precision + lastPrecision) / 2
+        self._last = (sensitivity, precision)
+        self.maxSensitivity = max(self.maxSensitivity, sensitivity)
+
+        f1 = 2.0 * numTP / (2 * numTP + numFP + numFN)
+        if f1 > self.bestF1:
+            self.bestF1, self.bestF1ScoreCutoff = f1, scoreCutoff
+
+        fdr = 1 - precision
+        for target in self.fdrTargets:
+            best = self.sensitivityAtFDR[target]
+            if fdr <= target and (best is None or sensitivity > best[0]):
+                self.sensitivityAtFDR[target] = (sensitivity, scoreCutoff)
+
+    def toDict(self):
+        """Return metrics as a dictionary, which can be dumped to json."""
+        return {"auc": self.auc,
+                "bestF1": self.bestF1,
+                "bestF1ScoreCutoff": self.bestF1ScoreCutoff,
+                "maxSensitivity": self.maxSensitivity,
+                "sensitivityAtFDR": dict([(str(t), None if v is None else
+                    {"sensitivity": v[0], "scoreCutoff": v[1]})
+                    for t, v in self.sensitivityAtFDR.iteritems()])}
+
+
+def ROCMetricsFile(out_tb):
+    """Return json of summary metrics of an output table out_tb, e.g.,
+    out.roc.json of out.csv."""
+    root, _ext = op.splitext(out_tb)
+    return "{root}.roc.json".format(root=root)
+
+
+def WriteROCMetrics(metrics, outfile):
+    """Write a dictionary, overlap length cutoff -> ROCMetrics, to a
+    json file, keyed by cutoffs as strings."""
+    with open(outfile, 'w') as writer:
+        json.dump(dict([(str(c), m.toDict()) for c, m in
+                        metrics.iteritems()]),
+                  writer, indent=2, sort_keys=True)
+
+
+def ReadROCMetrics(fn):
+    """Read a json file of WriteROCMetrics, return a dictionary, overlap
+    length cutoff (int) -> dictionary of metrics."""
+    with open(fn, 'r') as reader:
+        return dict([(int(c), m) for c, m in json.load(reader).iteritems()])
+
+
+def WriteConfidenceTable(numGTPos, numGTNeg, numGTWeak, numUnmappableAlns,
+                         numMappableAlns, numAlns, deltaTable,
+                         sampleFraction, outfile, z=1.96):
+    """Given accumulated numbers of a sample of about sampleFraction of
+    query ZMWs, write sensitivity, TP / (TP + FN), and false discovery
+    rate, FP / (FP + TP), of each score cutoff with their Wilson score
+    intervals (95% if z = 1.96), and numbers of TP, FP and ground truth
+    positive pairs scaled to all query reads, to outfile.
+    Intervals treat pairs as independent trials, while pairs of the same
+    query ZMW are not, so they are narrower than the true ones."""
+    from pbove.utils.compute import WilsonInterval
+    with open(outfile, 'w') as of:
+        of.write("\t".join(CONFIDENCE_TABLE_HEADER) + "\n")
+        for row in TableRows(numGTPos=numGTPos, numGTNeg=numGTNeg,
+                             numGTWeak=numGTWeak,
+                             numUnmappableAlns=numUnmappableAlns,
+                             numMappableAlns=numMappableAlns,
+                             numAlns=numAlns, deltaTable=deltaTable):
+            ub, numTP, numFP, numFN = row[0:4]
+            res = (ub,) + \
+                  WilsonInterval(numTP, numTP + numFN, z) + \
+                  WilsonInterval(numFP, numFP + numTP, z) + \
+                  tuple([int(round(n / float(sampleFraction))) for n in
+                         (numTP, numFP, numGTPos)])
+            of.write("\t".join([_fmt(item) for item in res]) + "\n")
+
+
+def _fmt(item):
+    """Format an item of a table."""
+    return "{0:.6f}".format(item) if isinstance(item, float) else str(item)
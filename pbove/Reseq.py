@@ -2,26 +2,52 @@
 from pbove.io.M4IO import M4Reader, by_absqstart
 from pbove.io.PBIReadFastaHeadIO import PBIReadFastaHeadReader
 from pbove.utils.compute import *
-from operator import itemgetter
+from collections import OrderedDict
 from sys import maxint
+import numpy as np
 
 class ReseqGroundTruth(object):
     """Resequencing ground truth."""
-    def __init__(self, fileName):
-        reader = M4Reader(fileName)
+    def __init__(self, fileName, cacheSize=None, searchOffsets=None):
+        """fileName: a reseq M4 file, or a list of reseq M4 files.
+        searchOffsets: see searchRead."""
         self.readToReference = []
-        for i in reader:
-            self.readToReference.append(i)
+        fileNames = fileName if isinstance(fileName, list) else [fileName]
+        for fn in fileNames:
+            reader = M4Reader(fn)
+            for i in reader:
+                self.readToReference.append(i)
+            reader.close()
         # Sort readToReference by query qstart
         self.readToReference = by_absqstart(self.readToReference)
 
+        # Cache of subreads which have been mapped to reference,
+        # (movie, holeNumber, start, end, infer) -> (ref, refStart, refEnd).
+        # If cacheSize is None, keep all mapped subreads; otherwise keep
+        # at most cacheSize least recently used ones, or none if 0.
+        self.cacheSize = cacheSize
+        self.mappingCache = OrderedDict()
+        self.numCacheHits = 0
+        self.numCacheMisses = 0
+
+        # Arrays of readToReference for batch mapping, see hitTable.
+        self._hitTable = None
+
+        # (movie, holeNumber) -> offset in reads of the zmw, where
+        # searchRead of the whole ground truth would start.
+        self.searchOffsets = searchOffsets
+
     def __str__(self):
         return "{0} reads in ground truth.\n" \
                .format(len(self.readToReference))
 
     def searchRead(self, movie, holeNumber):
         """Search reads which have the specified movie and
-        hole number."""
+        hole number. Reads are returned starting from where the binary
+        search stops, going down, and then going up, which decides the
+        best read among reads equally close to a subread. If this ground
+        truth only contains part of reseq_m4 and searchOffsets is given,
+        start from where the search would stop in the whole reseq_m4."""
         searchStart, searchEnd = 0, len(self.readToReference) - 1
         while(searchStart <= searchEnd):
             searchMid = int ((searchStart + searchEnd) / 2)
@@ -37,7 +63,7 @@ class ReseqGroundTruth(object):
             else:
                 break
 
-        subBuffer = []
+        subBuffer, numDown = [], 0
         if (searchStart <= searchEnd):
             searchMid = int ((searchStart + searchEnd) / 2)
             while (searchMid >= 0 and searchMid < len(self.readToReference)):
@@ -48,6 +74,7 @@ class ReseqGroundTruth(object):
                     searchMid -= 1
                 else:
                     break
+            numDown = len(subBuffer)
 
             searchMid = int (searchStart + searchEnd) / 2 + 1
             while (searchMid >= 0 and searchMid < len(self.readToReference)):
@@ -58,8 +85,22 @@ class ReseqGroundTruth(object):
                     searchMid += 1
                 else:
                     break
+
+        if (self.searchOffsets is not None and len(subBuffer) > 0 and
+            (movie, holeNumber) in self.searchOffsets):
+            zmwReads = subBuffer[:numDown][::-1] + subBuffer[numDown:]
+            offset = self.searchOffsets[(movie, holeNumber)]
+            subBuffer = zmwReads[offset::-1] + zmwReads[offset+1:]
         return subBuffer
 
+    def cacheStats(self):
+        """Return a string of hit/miss counts of the mapping cache."""
+        numQueries = self.numCacheHits + self.numCacheMisses
+        return "Mapping cache: {h} hits, {m} misses, {r:.2%} hit rate, " \
+               "{n} cached subreads.".format(h=self.numCacheHits,
+                m=self.numCacheMisses, n=len(self.mappingCache),
+                r=self.numCacheHits / float(max(1, numQueries)))
+
     def MapPBISubreadToReference(self, movie, holeNumber, start, end,
             infer=False):
         """Map a PBI subread (given its movie, holeNumber, start and end) to
@@ -79,12 +120,66 @@ class ReseqGroundTruth(object):
         Note that coordinate of start and end is relative to the full length
         unrolled read.
         """
-        # Get reads which have the specified movie and holeNumber.
-        subBuffer = self.searchRead(movie, holeNumber)
+        return self.MapPBISubreadIntervalsToReference(movie, holeNumber,
+                [(start, end, infer)])[0]
+
+    def MapPBISubreadIntervalsToReference(self, movie, holeNumber,
+            intervals):
+        """Map intervals [(start, end, infer), ...] of the same zmw (given
+        its movie and holeNumber) to reference, and return a list of
+        (reference_name, mapped_start, mapped_end), see
+        MapPBISubreadToReference. Mapped intervals are looked up in the
+        mapping cache first, and reads of the zmw are searched at most
+        once for all intervals which are missing."""
+        ret, subBuffer = [], None
+        for start, end, infer in intervals:
+            key = (movie, holeNumber, start, end, infer)
+            if key in self.mappingCache:
+                self.numCacheHits += 1
+                mapped = self.mappingCache[key]
+                if self.cacheSize is not None:
+                    # most recently used
+                    del self.mappingCache[key]
+                    self.mappingCache[key] = mapped
+            else:
+                self.numCacheMisses += 1
+                if subBuffer is None:
+                    # Get reads which have the specified movie and holeNumber.
+                    subBuffer = self.searchRead(movie, holeNumber)
+                mapped = self._MapIntervalByReads(subBuffer, start, end,
+                                                  infer)
+                if self.cacheSize is None or self.cacheSize > 0:
+                    self.mappingCache[key] = mapped
+                    if (self.cacheSize is not None and
+                        len(self.mappingCache) > self.cacheSize):
+                        self.mappingCache.popitem(last=False)
+            ret.append(mapped)
+        return ret
+
+    def PrecomputeMappings(self, keys):
+        """Map subreads of keys [(movie, holeNumber, start, end, infer),
+        ...] to reference in bulk, ahead of querying them one by one.
+        Reads of each zmw are searched once, and each distinct subread
+        is mapped only once."""
+        zmwToIntervals = {}
+        for movie, holeNumber, start, end, infer in set(keys):
+            if (movie, holeNumber, start, end, infer) not in self.mappingCache:
+                zmwToIntervals.setdefault((movie, holeNumber), []).\
+                        append((start, end, infer))
+        for (movie, holeNumber), intervals in sorted(zmwToIntervals.items()):
+            self.MapPBISubreadIntervalsToReference(movie, holeNumber,
+                                                   intervals)
+
+    def _MapIntervalByReads(self, subBuffer, start, end, infer=False):
+        """Map interval [start, end) to reference by the best read in
+        subBuffer, reads of the same zmw, and return (reference_name,
+        mapped_start, mapped_end), or ("", -1, -1) if unmappable."""
         # Get the best read to query which overlap with interval
         # [start, end) by most bases.
         bestRead = GetBestReadToQueryForInterval(subBuffer, start, end)
-        if bestRead is not None:
+        # A zero-length best read (abs_qstart == abs_qend) maps nothing,
+        # as in MapSubreadArraysToReference.
+        if bestRead is not None and bestRead.abs_qend > bestRead.abs_qstart:
             mappedStart, mappedEnd = bestRead.MapAnIntervalFromQToT(
                 start, end, infer)
             assert(mappedStart <= mappedEnd)
@@ -101,6 +196,30 @@ class ReseqGroundTruth(object):
             return False
         return True
 
+    def EvaluateHit(self, rr, infer=False):
+        """Given a read-read M4 entry, map its query and target to the
+        reference, and return (q_ref_interval, t_ref_interval, q_mappable,
+        t_mappable, overlap), where
+            q_ref_interval: (reference_name, mapped_start, mapped_end) of
+                            the aligned region of query,
+            t_ref_interval: same as q_ref_interval, of target,
+            q_mappable:     whether the query subread can be mapped
+                            to the reference, see IsMappable,
+            t_mappable:     same as q_mappable, of target,
+            overlap:        overlap length of q_ref_interval and
+                            t_ref_interval, see OverlapLengthInReference.
+        Reads of the query and the target zmws are searched once each."""
+        qSubread, qInterval = self.MapPBISubreadIntervalsToReference(
+                rr.qpbi.movie, rr.qpbi.holeNumber,
+                [(rr.qpbi.start, rr.qpbi.end, False),
+                 (rr.abs_qstart, rr.abs_qend, infer)])
+        tSubread, tInterval = self.MapPBISubreadIntervalsToReference(
+                rr.tpbi.movie, rr.tpbi.holeNumber,
+                [(rr.tpbi.start, rr.tpbi.end, False),
+                 (rr.abs_tstart, rr.abs_tend, infer)])
+        return (qInterval, tInterval, qSubread[0] != "", tSubread[0] != "",
+                OverlapLengthOfMappedIntervals(qInterval, tInterval))
+
     def OverlapLengthOfQandTInReference(self, rr, infer=False):
         """Given a read-read M4 entry, compute the overlap length between
            its query and target."""
@@ -124,35 +243,184 @@ class ReseqGroundTruth(object):
         can not map to the same reference, return (-sys.maxint).
         If two PBI subreads can map to the same reference but are
         apart, return (-distance) between them."""
-        refName1, refStart1, refEnd1 = self.MapPBISubreadToReference(
+        interval1 = self.MapPBISubreadToReference(
             movie1, holeNumber1, start1, end1, infer)
-        if (refName1 == ""):
+        if (interval1[0] == ""):
             return -maxint
 
-        refName2, refStart2, refEnd2 = self.MapPBISubreadToReference(
+        interval2 = self.MapPBISubreadToReference(
            movie2, holeNumber2, start2, end2, infer)
-
-        if refName1 != refName2 or refName2 == "":
-            return -maxint
-        else:
-            return GetOverlapLengthOfTwoIntervals(refStart1, refEnd1,
-                                                  refStart2, refEnd2)
+        return OverlapLengthOfMappedIntervals(interval1, interval2)
 
     def MapPBISubreadsToReference(self, reads, infer=False):
         """Map a list of PBI Subreads to references and produce a list of
         [(readobj, ref, start, end), ..., ()]. Sort this list by reference
         name, start, and end and return the sorted list.
         """
-        retList = []
-        (refcol, startcol, endcol) = (1, 2, 3)
-        for read in reads:
-            ref, refstart, refend = self.MapPBISubreadToReference(
-                read.movie, read.holeNumber, read.start, read.end, infer)
-            retList.append((read, ref, refstart, refend))
-        retList = sorted(retList, key=itemgetter(endcol), reverse=True)
-        retList = sorted(retList, key=itemgetter(startcol))
-        retList = sorted(retList, key=itemgetter(refcol))
-        return retList
+        order, refIds, refStarts, refEnds = \
+                self.MapPBISubreadsToReferenceArrays(reads, infer)
+        refNames = self.hitTable['refNames']
+        return [(reads[i], refNames[r] if r >= 0 else "", s, e)
+                for i, r, s, e in zip(order.tolist(), refIds.tolist(),
+                                      refStarts.tolist(), refEnds.tolist())]
+
+    @property
+    def hitTable(self):
+        """Return a dictionary of numpy arrays of readToReference, which
+        is sorted by movie and hole number, for batch mapping.
+            movies:   sorted movie names, movie id is index in movies.
+            refNames: sorted reference names, ref id is index in refNames.
+            zmw:      zmw key (see ZmwKeys) of each hit.
+            qstart, qend, tstart, tend, refId: abs_qstart, abs_qend,
+                      abs_tstart, abs_tend and ref id of each hit.
+            minus:    whether tstrand of each hit is '-'.
+            rank:     position of each hit in searchRead(movie, hole),
+                      which breaks ties when choosing the best hit.
+        """
+        if self._hitTable is None:
+            hits = self.readToReference
+            movies = sorted(set([h.qpbi.movie for h in hits]))
+            refNames = sorted(set([h.tname for h in hits]))
+            movieIds = dict([(m, i) for i, m in enumerate(movies)])
+            refIds = dict([(r, i) for i, r in enumerate(refNames)])
+            table = {'movies': movies, 'refNames': refNames}
+            table['movieIds'] = movieIds
+            table['zmw'] = self.ZmwKeys(
+                    np.array([movieIds[h.qpbi.movie] for h in hits],
+                             dtype=np.int64),
+                    np.array([h.qpbi.holeNumber for h in hits],
+                             dtype=np.int64))
+            for col, attr in [('qstart', 'abs_qstart'), ('qend', 'abs_qend'),
+                              ('tstart', 'abs_tstart'), ('tend', 'abs_tend')]:
+                table[col] = np.array([getattr(h, attr) for h in hits],
+                                      dtype=np.int64)
+            table['refId'] = np.array([refIds[h.tname] for h in hits],
+                                      dtype=np.int64)
+            table['minus'] = np.array([h.tstrand == "-" for h in hits],
+                                      dtype=bool)
+
+            # searchRead returns hits of a zmw starting from where the
+            # binary search stops, going down, and then going up.
+            rank = np.zeros(len(hits), dtype=np.int64)
+            hitIndex = dict([(id(h), i) for i, h in enumerate(hits)])
+            zmw = table['zmw']
+            bounds = np.flatnonzero(np.diff(zmw)) + 1
+            for lo, hi in zip(np.r_[0, bounds].tolist(),
+                              np.r_[bounds, len(hits)].tolist()):
+                if lo >= hi:
+                    continue
+                h = hits[lo]
+                mid = hitIndex[id(self.searchRead(h.qpbi.movie,
+                                                  h.qpbi.holeNumber)[0])]
+                rank[lo:mid+1] = np.arange(mid - lo, -1, -1)
+                rank[mid+1:hi] = np.arange(mid - lo + 1, hi - lo)
+            table['rank'] = rank
+            self._hitTable = table
+        return self._hitTable
+
+    @staticmethod
+    def ZmwKeys(movieIds, holeNumbers):
+        """Return an int64 key of each zmw (movie id, hole number), which
+        sorts in the same order as (movie, hole number)."""
+        return (movieIds.astype(np.int64) << 32) + holeNumbers
+
+    def MovieIds(self, movies):
+        """Return an array of movie ids of movie names, -1 if a movie
+        has no reads in the ground truth."""
+        movieIds = self.hitTable['movieIds']
+        return np.array([movieIds.get(m, -1) for m in movies],
+                        dtype=np.int64)
+
+    def MapSubreadArraysToReference(self, movieIds, holeNumbers,
+                                    starts, ends, infer=False):
+        """Batch version of MapPBISubreadToReference. Given arrays of
+        movie ids (see MovieIds), hole numbers, starts and ends of PBI
+        subreads, return arrays (refIds, refStarts, refEnds), where
+        refIds are indices of reference names in hitTable['refNames'],
+        or -1 (with refStarts and refEnds -1) if unmappable."""
+        tb = self.hitTable
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        n = len(starts)
+        refIds = np.full(n, -1, dtype=np.int64)
+        refStarts = np.full(n, -1, dtype=np.int64)
+        refEnds = np.full(n, -1, dtype=np.int64)
+
+        # Join subreads to hits of the same zmw.
+        keys = self.ZmwKeys(np.asarray(movieIds, dtype=np.int64),
+                            np.asarray(holeNumbers, dtype=np.int64))
+        keys[np.asarray(movieIds) < 0] = -1
+        lo = np.searchsorted(tb['zmw'], keys, side='left')
+        hi = np.searchsorted(tb['zmw'], keys, side='right')
+        counts = hi - lo
+        sub = np.repeat(np.arange(n), counts)
+        if len(sub) == 0:
+            return (refIds, refStarts, refEnds)
+        offsets = np.cumsum(counts) - counts
+        hit = lo[sub] + np.arange(len(sub)) - offsets[sub]
+
+        # Pick the best hit of each subread, which has the shortest
+        # distance to the subread, see GetBestReadToQueryForInterval.
+        dists = - GetOverlapLengthsOfIntervalArrays(
+                tb['qstart'][hit], tb['qend'][hit], starts[sub], ends[sub])
+        order = np.lexsort((tb['rank'][hit], dists, sub))
+        first = order[np.r_[True, np.diff(sub[order]) != 0]]
+        sub, hit = sub[first], hit[first]
+
+        # Map subreads to reference by their best hits, see
+        # MapAnIntervalFromQToT.
+        s, e = starts[sub], ends[sub]
+        qs, qe = tb['qstart'][hit], tb['qend'][hit]
+        ts, te = tb['tstart'][hit], tb['tend'][hit]
+        minus = tb['minus'][hit]
+
+        def infer_points(points):
+            """Vectorized InferAPointFromQToT."""
+            with np.errstate(divide='ignore', invalid='ignore'):
+                plus = (points - qs) * (te - ts).astype(float) / \
+                       (qe - qs).astype(float) + ts
+                neg = te - (te - ts) * (points - qs).astype(float) / \
+                      (qe - qs).astype(float)
+                return np.trunc(np.where(minus, neg, plus)).astype(np.int64)
+
+        ms, me = infer_points(s), infer_points(e)
+        if infer:
+            ms, me = np.where(minus, me, ms), np.where(minus, ms, me)
+        else:
+            sIn = (s >= qs) & (s <= qe)
+            eIn = (e >= qs) & (e <= qe)
+            ms, me = np.where(sIn, ms, -1), np.where(eIn, me, -1)
+            onlyE, onlyS = ~sIn & eIn, sIn & ~eIn
+            cover = ~sIn & ~eIn & (s < qs) & (e > qe)
+            both = sIn & eIn
+            newMs = np.select([onlyE & ~minus, onlyE & minus,
+                               onlyS & minus, cover, both & minus],
+                              [ts, me, ts, ts, me], ms)
+            newMe = np.select([onlyE & minus, onlyS & ~minus,
+                               onlyS & minus, cover, both & minus],
+                              [te, te, ms, te, ms], me)
+            ms, me = newMs, newMe
+
+        # Zero-length best hits (qe == qs) map nothing, as in
+        # _MapIntervalByReads, instead of NaN coordinates.
+        mapped = (ms != -1) & (me != -1) & (qe > qs)
+        sub, ms, me = sub[mapped], ms[mapped], me[mapped]
+        refIds[sub] = tb['refId'][hit[mapped]]
+        refStarts[sub], refEnds[sub] = ms, me
+        return (refIds, refStarts, refEnds)
+
+    def MapPBISubreadsToReferenceArrays(self, reads, infer=False):
+        """Map a list of PBI Subreads to references in batch, and return
+        numpy arrays (order, refIds, refStarts, refEnds) sorted by
+        reference, start, and then -end, where reads[order[i]] is mapped
+        to [refStarts[i], refEnds[i]) of reference
+        hitTable['refNames'][refIds[i]] (-1 if unmappable)."""
+        refIds, refStarts, refEnds = self.MapSubreadArraysToReference(
+                self.MovieIds([r.movie for r in reads]),
+                [r.holeNumber for r in reads],
+                [r.start for r in reads], [r.end for r in reads], infer)
+        order = np.lexsort((-refEnds, refStarts, refIds))
+        return (order, refIds[order], refStarts[order], refEnds[order])
 
 
     def ComputeAllPosNegNumbersFromFiles(self, queryFile, targetFile,
@@ -177,4 +445,24 @@ class ReseqGroundTruth(object):
         return ComputeAllPosNegNumbers(q, t, overlapLengthCutoff)
 
 
-
+def SearchOffsetsOfZmws(counts):
+    """Given numbers of reads of zmws, where zmws are sorted by movie and
+    hole number, return offsets in reads of each zmw where searchRead
+    of a ReseqGroundTruth of all these reads stops, see searchRead.
+    The binary search of searchRead is replayed for all zmws at once."""
+    counts = np.asarray(counts, dtype=np.int64)
+    his = np.cumsum(counts)
+    los = his - counts
+    n = int(his[-1]) if len(his) > 0 else 0
+    starts = np.zeros(len(counts), dtype=np.int64)
+    ends = np.full(len(counts), n - 1, dtype=np.int64)
+    mids = np.zeros(len(counts), dtype=np.int64)
+    active = counts > 0
+    while active.any():
+        m = (starts + ends) // 2
+        mids[active] = m[active]
+        less, greater = m < los, m >= his
+        starts = np.where(active & less, m + 1, starts)
+        ends = np.where(active & greater, m - 1, ends)
+        active &= (less | greater)
+    return mids - los
@@ -1,82 +1,239 @@
 #!/usr/bin/env python
 """Define Class `FastaSplitter` which splits a fasta file into
-smaller files each containing `reads_per_split` reads."""
+smaller files each containing `reads_per_split` reads or about
+`bases_per_split` bases, or into `num_splits` files of similar bases."""
 
 import os
 import os.path as op
-from pbcore.io import FastaReader, FastaWriter
-from pbove.utils.Utils import mkdir
+import heapq
+from pbove.utils.Utils import mkdir, read_fasta, write_fasta, revcmp, \
+        FASTA_BUFFER_SIZE
 
 class FastaSplitter(object):
     """An object of `FastaSplitter` splits a fasta file into
-    smaller chunks with a given prefix."""
-    def __init__(self, input_fasta, reads_per_split, out_dir, out_prefix):
+    smaller chunks with a given prefix, in one of two ways:
+    (1) in order, a split is complete once it has reads_per_split reads,
+        or at least bases_per_split bases, so that splits of reads of
+        variable lengths take similar time to align;
+    (2) into num_splits splits, each read is added to the split of the
+        fewest bases so far.
+    If rc_out_prefix is given, reverse complement of every read is
+    written to a paired split with this prefix in the same pass, e.g.,
+    to align reads in out_fns[i] to reads in rc_out_fns[i].
+    If write_index is True, index_fn records the split of every read in
+    input order, so that splits (or outputs derived from them read by
+    read) can be merged back in this order by `merge`."""
+    def __init__(self, input_fasta, reads_per_split, out_dir, out_prefix,
+                 bases_per_split=None, rc_out_prefix=None, num_splits=None,
+                 write_index=False):
+        if num_splits is not None:
+            if reads_per_split is not None or bases_per_split is not None:
+                raise ValueError("FastaSplitter num_splits can not be " +
+                                 "combined with reads or bases per split.")
+            if int(num_splits) < 1:
+                raise ValueError("FastaSplitter num_splits must be " +
+                                 "positive.")
+        elif reads_per_split is None and bases_per_split is None:
+            raise ValueError("FastaSplitter needs either reads_per_split, " +
+                             "bases_per_split or num_splits.")
         self.input_fasta = input_fasta
         self.out_dir = out_dir
         self.reads_per_split = reads_per_split  # Number of reads per split
+        self.bases_per_split = bases_per_split  # Number of bases per split
+        self.num_splits = None if num_splits is None else int(num_splits)
         self.out_prefix = out_prefix
+        self.rc_out_prefix = rc_out_prefix
+        self.write_index = write_index
         self.out_fns = None
+        self.rc_out_fns = None
+        self._digits = 2
         mkdir(self.out_dir)
 
     def __str__(self):
         if self.out_fns is None or len(self.out_fns) == 0:
             return "{input_fasta} ".format(input_fasta=self.input_fasta) + \
-                "will be splitted into files each has " + \
-                "{n} reads.".format(n=self.reads_per_split)
+                "will be splitted into {n}.".format(n=self._size_str())
         else:
             return "{input_fasta} has been splitted into ".\
                    format(input_fasta=self.input_fasta) + \
-                   "{m} files each has {n} reads:\n".\
+                   "{m} files, {n}:\n".\
                    format(m=len(self.out_fns),
-                n=self.reads_per_split) + ";".join(self.out_fns)
-
-    def _out_fn(self, split_index):
-        """Return name of the `split_index`-th splitted file."""
-        if split_index > 99:
-            raise ValueError("Too many splitted files to generate: number " +
-                "of splitted files exceed 100.")
-        name = "{prefix}_{idx:02d}.fa".format(prefix=self.out_prefix,
-                                              idx=split_index)
+                n=self._size_str()) + ";".join(self.out_fns)
+
+    def _size_str(self):
+        """Return size of a split as a string."""
+        if self.num_splits is not None:
+            return "{n} files of similar bases".format(n=self.num_splits)
+        sizes = []
+        if self.reads_per_split is not None:
+            sizes.append("{n} reads".format(n=self.reads_per_split))
+        if self.bases_per_split is not None:
+            sizes.append("{n} bases".format(n=self.bases_per_split))
+        return "files each has " + " or ".join(sizes)
+
+    @property
+    def index_fn(self):
+        """Return index file, each line of which is a tab-delimited split
+        index and read name, of every read in input order."""
+        return op.join(self.out_dir, "{prefix}_index.txt".format(
+                       prefix=self.out_prefix))
+
+    def _max_num_splits(self):
+        """Return an upper bound of number of splits to generate, given
+        that a read takes at least 4 bytes, e.g., '>r\nA\n'."""
+        if self.num_splits is not None:
+            return self.num_splits
+        size = op.getsize(self.input_fasta)
+        bounds = []
+        if self.reads_per_split is not None:
+            bounds.append(size // (4 * max(1, self.reads_per_split)) + 1)
+        if self.bases_per_split is not None:
+            bounds.append(size // max(1, self.bases_per_split) + 1)
+        return min(bounds)
+
+    def _out_fn(self, split_index, out_prefix=None):
+        """Return name of the `split_index`-th splitted file. Indices are
+        zero-padded to the same width, so that names sort in order."""
+        name = "{prefix}_{idx:0{w}d}.fa".format(
+               prefix=self.out_prefix if out_prefix is None else out_prefix,
+               idx=split_index, w=self._digits)
         return op.join(self.out_dir, name)
 
-    def split(self):
-        """Split `input_fasta` into smaller files each containing
-        `reads_per_split` reads. Return splitted fasta."""
-        split_index = 0
-        self.out_fns = []
-        writer = FastaWriter(self._out_fn(split_index))
+    def _is_full(self, num_reads, num_bases):
+        """Return True if a split of num_reads reads and num_bases bases
+        is complete."""
+        return (self.reads_per_split is not None and
+                num_reads >= self.reads_per_split) or \
+               (self.bases_per_split is not None and
+                num_bases >= self.bases_per_split)
+
+    def _open(self, split_index):
+        """Open the `split_index`-th splitted file, and its reverse
+        complement file if rc_out_prefix is given. Return writers."""
+        writers = []
         self.out_fns.append(self._out_fn(split_index))
-        with FastaReader(self.input_fasta) as reader:
-            for ridx, r in enumerate(reader):
-                if ridx % self.reads_per_split == 0 and ridx != 0:
-                    split_index += 1
+        writers.append(open(self.out_fns[-1], 'w', FASTA_BUFFER_SIZE))
+        if self.rc_out_prefix is not None:
+            self.rc_out_fns.append(self._out_fn(split_index,
+                                                self.rc_out_prefix))
+            writers.append(open(self.rc_out_fns[-1], 'w', FASTA_BUFFER_SIZE))
+        return writers
+
+    def _splits_in_order(self):
+        """Yield (split index, writers, name, sequence) of each read,
+        where splits are filled in order."""
+        split_index, num_reads, num_bases = 0, 0, 0
+        writers = self._open(split_index)
+        try:
+            for name, seq in read_fasta(self.input_fasta):
+                if self._is_full(num_reads, num_bases):
+                    split_index, num_reads, num_bases = split_index + 1, 0, 0
+                    for writer in writers:
+                        writer.close()
+                    writers = self._open(split_index)
+                yield split_index, writers, name, seq
+                num_reads += 1
+                num_bases += len(seq)
+        finally:
+            for writer in writers:
+                writer.close()
+
+    def _splits_balanced(self):
+        """Yield (split index, writers, name, sequence) of each read,
+        where a read goes to the split of the fewest bases so far."""
+        allWriters = [self._open(i) for i in range(self.num_splits)]
+        # (bases, split index) of all splits
+        heap = [(0, i) for i in range(self.num_splits)]
+        try:
+            for name, seq in read_fasta(self.input_fasta):
+                num_bases, split_index = heap[0]
+                yield split_index, allWriters[split_index], name, seq
+                heapq.heapreplace(heap, (num_bases + len(seq), split_index))
+        finally:
+            for writers in allWriters:
+                for writer in writers:
                     writer.close()
-                    writer = FastaWriter(self._out_fn(split_index))
-                    self.out_fns.append(self._out_fn(split_index))
-                writer.writeRecord(r.name, r.sequence)
 
-        writer.close()
+    def split(self):
+        """Split `input_fasta` into smaller files, reading it once.
+        Return splitted fasta."""
+        self._digits = max(2, len(str(max(0, self._max_num_splits() - 1))))
+        self.out_fns = []
+        self.rc_out_fns = [] if self.rc_out_prefix is not None else None
+        splits = self._splits_in_order() if self.num_splits is None \
+                 else self._splits_balanced()
+        index = open(self.index_fn, 'w', FASTA_BUFFER_SIZE) \
+                if self.write_index else None
+        try:
+            for split_index, writers, name, seq in splits:
+                write_fasta(writers[0], name, seq)
+                if self.rc_out_prefix is not None:
+                    write_fasta(writers[1], name, revcmp(seq))
+                if index is not None:
+                    index.write("{i}\t{n}\n".format(i=split_index, n=name))
+        finally:
+            splits.close()
+            if index is not None:
+                index.close()
         return list(self.out_fns)
 
+    def merge(self, split_fns, out_fasta):
+        """Merge reads in split_fns, e.g., out_fns or outputs derived from
+        them read by read, into out_fasta in input order. Return number
+        of reads."""
+        if not self.write_index:
+            raise ValueError("FastaSplitter can only merge splits " +
+                             "with an index, see write_index.")
+        return mergeSplits(split_fns, self.index_fn, out_fasta)
+
     def rmOutFNs(self):
         """Remove splitted files."""
-        for f in self.out_fns:
+        for f in self.out_fns + (self.rc_out_fns or []):
             os.remove(f)
+        if self.write_index and op.exists(self.index_fn):
+            os.remove(self.index_fn)
         self.out_fns = []
+        self.rc_out_fns = [] if self.rc_out_prefix is not None else None
 
 
-def splitFasta(input_fasta, reads_per_split, out_dir, out_prefix):
+def splitFasta(input_fasta, reads_per_split, out_dir, out_prefix, **kwargs):
     """
     Split input_fasta into small fasta files each containing at most
     reads_per_split reads. All splitted fasta files will be placed under
     out_dir with out_prefix. Return paths to splitted files in a list.
+    Other arguments, e.g., num_splits, are passed to FastaSplitter.
     """
     obj = FastaSplitter(input_fasta=input_fasta,
                         reads_per_split=reads_per_split,
-                        out_dir=out_dir, out_prefix=out_prefix)
+                        out_dir=out_dir, out_prefix=out_prefix, **kwargs)
     return obj.split()
 
 
+def mergeSplits(split_fns, index_fn, out_fasta):
+    """
+    Merge reads in split_fns into out_fasta, in the order of reads in
+    index_fn written by FastaSplitter, which must match reads of each
+    split in order. Return number of reads.
+    """
+    readers = [read_fasta(fn) for fn in split_fns]
+    num_reads = 0
+    with open(index_fn, 'r') as index, \
+         open(out_fasta, 'w', FASTA_BUFFER_SIZE) as writer:
+        for line in index:
+            split_index, name = line.rstrip('\n').split('\t', 1)
+            try:
+                r_name, seq = next(readers[int(split_index)])
+            except (StopIteration, IndexError):
+                raise ValueError("Could not find {n} of split {i} in {f}.".
+                                 format(n=name, i=split_index, f=split_fns))
+            if r_name != name:
+                raise ValueError("Expect {n} in split {i}, got {r}.".format(
+                                 n=name, i=split_index, r=r_name))
+            write_fasta(writer, r_name, seq)
+            num_reads += 1
+    return num_reads
+
+
 def get_args():
     """Get arguments."""
     import argparse
@@ -0,0 +1,229 @@
+"""Define class OverlapHistogram, a histogram of ground truth overlap
+lengths of query-target pairs, broken down by reference, which can be
+saved to and loaded from a compressed npz file, and ZmwOverlapHistogram,
+the same broken down by query ZMW.
+
+An npz file of OverlapHistogram contains the following arrays:
+  refs         - names of references
+  numQMapped   - number of query reads mapped to each reference
+  numTMapped   - number of target reads mapped to each reference
+  refIndex     - index of reference of each histogram bin
+  length       - overlap length of each histogram bin
+  count        - number of query-target pairs in each histogram bin
+  totals       - [numUnmappableAlns, numMappableAlns, numAlns]
+"""
+
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+import numpy as np
+
+
+class OverlapHistogram(object):
+    """Histogram of ground truth overlap lengths of query-target pairs,
+    for each reference. Only pairs of which query and target overlap
+    (or touch, i.e., overlap by 0 bases) are counted in histogram bins,
+    numbers of negative pairs are derived from total numbers of pairs.
+    """
+    def __init__(self):
+        # reference -> {overlap length -> number of pairs}
+        self.counts = defaultdict(lambda: defaultdict(int))
+        # reference -> number of query/target reads mapped to it
+        self.numQMapped = defaultdict(int)
+        self.numTMapped = defaultdict(int)
+        self.numUnmappableAlns = 0
+        self.numMappableAlns = 0
+        self.numAlns = 0
+
+    def __str__(self):
+        return "An OverlapHistogram of {n} pairs on {r} references.\n".\
+               format(n=sum(self.lengthCounts().values()),
+                      r=len(self.refs))
+
+    @property
+    def refs(self):
+        """Return sorted names of references."""
+        return sorted(set(self.counts.keys()).union(self.numQMapped.keys()).
+                      union(self.numTMapped.keys()))
+
+    def add(self, ref, length, count=1):
+        """Add count pairs which overlap by length bases on ref."""
+        self.counts[ref][int(length)] += count
+
+    def merge(self, another, sameTargets=False):
+        """Add all pairs and reads in another histogram to this one.
+        If sameTargets is True, another histogram has counted the same
+        target reads (e.g., of another partition of query reads), whose
+        numbers are not added up."""
+        for ref, lenCounts in another.counts.iteritems():
+            for length, count in lenCounts.iteritems():
+                self.counts[ref][length] += count
+        for ref, num in another.numQMapped.iteritems():
+            self.numQMapped[ref] += num
+        for ref, num in another.numTMapped.iteritems():
+            if sameTargets:
+                self.numTMapped[ref] = num
+            else:
+                self.numTMapped[ref] += num
+        self.numUnmappableAlns += another.numUnmappableAlns
+        self.numMappableAlns += another.numMappableAlns
+        self.numAlns += another.numAlns
+
+    def lengthCounts(self, ref=None):
+        """Return a dictionary, overlap length -> number of pairs, of
+        reference ref, or of all references if ref is None."""
+        if ref is not None:
+            return dict(self.counts.get(ref, {}))
+        ret = defaultdict(int)
+        for lenCounts in self.counts.itervalues():
+            for length, count in lenCounts.iteritems():
+                ret[length] += count
+        return dict(ret)
+
+    def cumulativeCounts(self, ref=None):
+        """Return (lengths, numAtLeast), where lengths are sorted overlap
+        lengths and numAtLeast[i] is the number of pairs which overlap
+        by at least lengths[i] bases, of reference ref, or of all
+        references if ref is None. This is the ground truth side of a
+        sensitivity versus overlap length curve."""
+        lenCounts = self.lengthCounts(ref)
+        lengths = sorted(lenCounts.keys())
+        numAtLeast = [0] * len(lengths)
+        total = 0
+        for i in range(len(lengths) - 1, -1, -1):
+            total += lenCounts[lengths[i]]
+            numAtLeast[i] = total
+        return (lengths, numAtLeast)
+
+    def getPosWeak(self, overlapLengthCutoffs, ref=None):
+        """Return a dictionary, cutoff -> (numPos, numWeak), where numPos
+        is the number of pairs which overlap by at least cutoff bases,
+        and numWeak is the number of pairs which overlap by more than 0
+        but less than cutoff bases."""
+        lengths, numAtLeast = self.cumulativeCounts(ref)
+        numAtLeast.append(0)
+        numPositive = numAtLeast[bisect_right(lengths, 0)]
+        ret = {}
+        for cutoff in overlapLengthCutoffs:
+            numPos = numAtLeast[bisect_left(lengths, int(cutoff))]
+            ret[cutoff] = (numPos, max(0, numPositive - numPos))
+        return ret
+
+    def getPosNegWeak(self, overlapLengthCutoff, ref=None):
+        """Return (numPos, numNeg, numWeak) of an overlap length cutoff.
+        If ref is None, negative pairs are all mappable pairs which are
+        neither positive nor weak; otherwise, negative pairs are pairs
+        of which both query and target map to ref, but which are neither
+        positive nor weak."""
+        numPos, numWeak = self.getPosWeak([overlapLengthCutoff],
+                                          ref)[overlapLengthCutoff]
+        numMappable = self.numMappableAlns if ref is None else \
+                      self.numQMapped[ref] * self.numTMapped[ref]
+        return (numPos, numMappable - numPos - numWeak, numWeak)
+
+    def write(self, fn):
+        """Save this histogram to a compressed npz file."""
+        refs = self.refs
+        refIndex, length, count = [], [], []
+        for i, ref in enumerate(refs):
+            for l, c in sorted(self.counts.get(ref, {}).iteritems()):
+                refIndex.append(i)
+                length.append(l)
+                count.append(c)
+        with open(fn, 'wb') as writer:
+            np.savez_compressed(writer,
+                refs=np.array(refs, dtype=str),
+                numQMapped=np.array([self.numQMapped[r] for r in refs],
+                                    dtype=np.int64),
+                numTMapped=np.array([self.numTMapped[r] for r in refs],
+                                    dtype=np.int64),
+                refIndex=np.array(refIndex, dtype=np.int32),
+                length=np.array(length, dtype=np.int64),
+                count=np.array(count, dtype=np.int64),
+                totals=np.array([self.numUnmappableAlns,
+                                 self.numMappableAlns, self.numAlns],
+                                dtype=np.int64))
+
+    @classmethod
+    def read(cls, fn):
+        """Load a histogram from an npz file."""
+        ret = OverlapHistogram()
+        with np.load(fn) as data:
+            refs = [str(r) for r in data['refs']]
+            for i, ref in enumerate(refs):
+                ret.numQMapped[ref] = int(data['numQMapped'][i])
+                ret.numTMapped[ref] = int(data['numTMapped'][i])
+            for i, l, c in zip(data['refIndex'], data['length'],
+                               data['count']):
+                ret.counts[refs[i]][int(l)] = int(c)
+            (ret.numUnmappableAlns, ret.numMappableAlns, ret.numAlns) = \
+                    [int(x) for x in data['totals']]
+        return ret
+
+
+class ZmwOverlapHistogram(object):
+    """Histogram of ground truth overlap lengths of query-target pairs,
+    for each query ZMW, from which numbers of ground truth overlaps of
+    any resample of query ZMWs can be computed, see pbove.Bootstrap.
+    Every query ZMW is kept, including ZMWs which overlap no target.
+
+    An npz file of ZmwOverlapHistogram contains the following arrays:
+      zmws         - names of query ZMWs, movie/holeNumber
+      zmwIndex     - index of ZMW of each histogram bin
+      length       - overlap length of each histogram bin
+      count        - number of query-target pairs in each histogram bin
+    """
+    def __init__(self):
+        self.zmws = []
+        self.zmwIndices = {}
+        # (zmw index, overlap length) -> number of pairs
+        self.counts = defaultdict(int)
+
+    def __str__(self):
+        return "A ZmwOverlapHistogram of {n} pairs of {z} ZMWs.\n".\
+               format(n=sum(self.counts.values()), z=len(self.zmws))
+
+    def addZmw(self, zmw):
+        """Add a query ZMW, movie/holeNumber, return its index."""
+        if zmw not in self.zmwIndices:
+            self.zmwIndices[zmw] = len(self.zmws)
+            self.zmws.append(zmw)
+        return self.zmwIndices[zmw]
+
+    def add(self, zmwIndex, length, count=1):
+        """Add count pairs of ZMW zmwIndex which overlap by length."""
+        self.counts[(zmwIndex, int(length))] += count
+
+    def merge(self, another):
+        """Add all ZMWs and pairs in another histogram to this one."""
+        indices = [self.addZmw(zmw) for zmw in another.zmws]
+        for (i, length), count in another.counts.iteritems():
+            self.counts[(indices[i], length)] += count
+
+    def arrays(self):
+        """Return (zmwIndex, length, count) of all histogram bins as
+        numpy arrays."""
+        items = sorted(self.counts.iteritems())
+        return (np.array([i for (i, _l), _c in items], dtype=np.int64),
+                np.array([l for (_i, l), _c in items], dtype=np.int64),
+                np.array([c for _k, c in items], dtype=np.int64))
+
+    def write(self, fn):
+        """Save this histogram to a compressed npz file."""
+        zmwIndex, length, count = self.arrays()
+        with open(fn, 'wb') as writer:
+            np.savez_compressed(writer, zmws=np.array(self.zmws, dtype=str),
+                                zmwIndex=zmwIndex, length=length,
+                                count=count)
+
+    @classmethod
+    def read(cls, fn):
+        """Load a histogram from an npz file."""
+        ret = cls()
+        with np.load(fn) as data:
+            for zmw in data['zmws']:
+                ret.addZmw(str(zmw))
+            for i, l, c in zip(data['zmwIndex'].tolist(),
+                               data['length'].tolist(),
+                               data['count'].tolist()):
+                ret.counts[(i, l)] += c
+        return ret
@@ -2,31 +2,46 @@
 
 """Define class RunInfo and RunInfoReader."""
 
+from collections import OrderedDict
+
 
 class RunInfo:
     """Info of a run/job, including fofn of movies, run name,
-    and an output directory for analyzing this run."""
-    def __init__(self, fofn, name, group, out_dir):
+    an output directory for analyzing this run, and optionally
+    blasr options for preassembly of this run."""
+    def __init__(self, fofn, name, group, out_dir,
+                 preassembly_blasr_opts=None):
         self.fofn = fofn
         self.name = name
         self.group = group
         self.out_dir = out_dir
+        self.preassembly_blasr_opts = preassembly_blasr_opts
 
     def __str__(self):
-        return "fofn: {fofn}\n".format(fofn=self.fofn) + \
-               "name: {name}\n".format(name=self.name) + \
-               "group: {group}\n".format(group=self.group) + \
-               "dir : {out_dir}\n".format(out_dir=self.out_dir)
+        ret = "fofn: {fofn}\n".format(fofn=self.fofn) + \
+              "name: {name}\n".format(name=self.name) + \
+              "group: {group}\n".format(group=self.group) + \
+              "dir : {out_dir}\n".format(out_dir=self.out_dir)
+        if self.preassembly_blasr_opts is not None:
+            ret += "preassembly_blasr_opts: {o}\n".\
+                   format(o=self.preassembly_blasr_opts)
+        return ret
 
     @classmethod
     def from_string(cls, line):
+        """Interpret a line of four fields, fofn, name, group and out_dir,
+        optionally followed by blasr options for preassembly of this run,
+        as a RunInfo object."""
         try:
             fds = line.split()
-            if len(fds) != 4:
-                raise AssertionError("{l} has more than three fields.".
+            if len(fds) < 4:
+                raise AssertionError("{l} has less than four fields.".
                                      format(l=line))
+            preassembly_blasr_opts = " ".join(fds[4:]) \
+                                     if len(fds) > 4 else None
             return RunInfo(fofn=fds[0], name=fds[1],
-                           group=fds[2], out_dir=fds[3])
+                           group=fds[2], out_dir=fds[3],
+                           preassembly_blasr_opts=preassembly_blasr_opts)
         except (AssertionError, ValueError) as e:
             msg = "String not recognized as a valid RunInfo record. " + \
                     str(e)
@@ -64,4 +79,12 @@ class RunInfoReader:
         self.__close__()
 
 
-
+def group_runinfos_by_fofn(runinfos):
+    """Group runs which share the same fofn of movies, and therefore
+    can share filtered subreads and resequencing ground truth.
+    Return an ordered dict, fofn -> [runinfo, ...], in which groups and
+    runs within groups are in their input order."""
+    groups = OrderedDict()
+    for runinfo in runinfos:
+        groups.setdefault(runinfo.fofn, []).append(runinfo)
+    return groups
@@ -0,0 +1,591 @@
+#!/usr/bin/env python
+
+"""
+Generate synthetic pbove inputs of configurable scale, and benchmark
+pbove itself on them without real PacBio movies or blasr.
+"""
+import os
+import os.path as op
+import sys
+import time
+import json
+import random
+import logging
+import platform
+import subprocess
+from array import array
+from bisect import bisect_left
+import numpy as np
+from pbcore.util.ToolRunner import PBToolRunner
+from pbove.__init__ import get_version
+from pbove.utils.Profiling import add_profile_arguments, profiled
+from pbove.utils.Utils import realpath, mkdir
+from pbove.utils.Metrics import StageMetrics
+from pbove.Reseq import ReseqGroundTruth
+from pbove.Preassembly import PreassemblyPrediction
+from pbove.io.PBIReadFastaHeadIO import PBIReadFastaHeadReader
+from pbove.utils.compute import ComputeAllPosNegNumbers
+from pbove.pbove_compare_overlap import PboveCompareOverlap
+import pbove.QTSO as QTSO
+
+# Movie names of synthetic ZMWs, e.g., m130812_185809_42141_c1005..._s1_p0
+MOVIE_FORMAT = "m1308{d:02d}_185809_42141_c100533960310000001823079711" + \
+               "1013{i:02d}_s1_p0"
+
+# Bases between two subreads of a ZMW, i.e., an adapter.
+ADAPTER_LEN = 45
+
+BASES = np.frombuffer(b"ACGT", dtype=np.uint8)
+
+# Modules of console scripts, of which startup (import and --help) in a
+# new interpreter is benchmarked.
+STARTUP_SCRIPTS = ("pbove_main", "pbove_eval", "pbove_eval_merge",
+                   "pbove_bench", "pbove_compare_runs",
+                   "pbove_compare_overlap", "pbove_plot_runs",
+                   "pbove_filter_subreads", "pbove_print_overlaps",
+                   "pbove_reseq", "pbove_preassembly")
+
+
+class SyntheticDataset(object):
+    """Synthetic inputs of pbove of numReads subreads, in out_dir:
+        reference.fasta   : random reference sequences
+        reseq.m4          : resequencing hits of subreads to reference,
+                            as blasr would report, about 10% unmappable
+        reseq.shifted.m4  : reseq.m4 with shifted and dropped hits, which
+                            pbove_compare_overlap compares with reseq.m4
+        query.fasta       : all subreads
+        target.fasta      : subreads at least targetMinLen long
+        preassembly.m4    : preassembly hits of query to target subreads,
+                            of which about tpFraction overlap in reference
+        read_to_rc_read.sdp: sdpMatcher hits of subreads to their reverse
+                            complements, about palindromeFraction of
+                            which are palindromes
+    Subreads of a ZMW cover the same template on alternating strands, as
+    PacBio subreads do. Reads in fasta files have random sequences of
+    their lengths if withSequences is True, otherwise one base."""
+    def __init__(self, out_dir, numReads, coverage=30, numRefs=2,
+                 numMovies=3, targetMinLen=5000, tpFraction=0.7,
+                 hitsPerRead=1, palindromeFraction=0.01, seed=0,
+                 withSequences=False):
+        self.out_dir = realpath(out_dir)
+        self.numReads = int(numReads)
+        self.coverage = float(coverage)
+        self.numRefs = int(numRefs)
+        self.movies = [MOVIE_FORMAT.format(d=10 + i, i=i)
+                       for i in range(int(numMovies))]
+        self.targetMinLen = int(targetMinLen)
+        self.tpFraction = float(tpFraction)
+        self.hitsPerRead = int(hitsPerRead)
+        self.palindromeFraction = float(palindromeFraction)
+        self.seed = int(seed)
+        self.withSequences = withSequences
+        self.rng = random.Random(self.seed)
+        # Random bases of sequences
+        self.baseRng = np.random.RandomState(self.seed)
+        # Subreads, see _generateReads.
+        self.reads = dict([(k, array('l')) for k in
+                           ("movie", "hole", "start", "end",
+                            "ref", "refStart", "refEnd")])
+        self.refLens = []
+
+    @property
+    def ref_fasta(self):
+        """Return reference fasta."""
+        return op.join(self.out_dir, "reference.fasta")
+
+    @property
+    def reseq_m4(self):
+        """Return resequencing hits."""
+        return op.join(self.out_dir, "reseq.m4")
+
+    @property
+    def shifted_reseq_m4(self):
+        """Return shifted resequencing hits."""
+        return op.join(self.out_dir, "reseq.shifted.m4")
+
+    @property
+    def query_fasta(self):
+        """Return query reads."""
+        return op.join(self.out_dir, "query.fasta")
+
+    @property
+    def target_fasta(self):
+        """Return target reads."""
+        return op.join(self.out_dir, "target.fasta")
+
+    @property
+    def preassembly_m4(self):
+        """Return preassembly hits."""
+        return op.join(self.out_dir, "preassembly.m4")
+
+    @property
+    def sdp(self):
+        """Return sdpMatcher hits of reads to their reverse complements."""
+        return op.join(self.out_dir, "read_to_rc_read.sdp")
+
+    @property
+    def done_file(self):
+        """Return a file which exists if all inputs are generated."""
+        return op.join(self.out_dir, "generated.json")
+
+    def exists(self):
+        """Return True if inputs of the same parameters exist."""
+        if not op.exists(self.done_file):
+            return False
+        with open(self.done_file, 'r') as reader:
+            return json.load(reader) == self.params()
+
+    def params(self):
+        """Return parameters which determine inputs."""
+        return {"numReads": self.numReads, "coverage": self.coverage,
+                "numRefs": self.numRefs, "numMovies": len(self.movies),
+                "targetMinLen": self.targetMinLen,
+                "tpFraction": self.tpFraction,
+                "hitsPerRead": self.hitsPerRead,
+                "palindromeFraction": self.palindromeFraction,
+                "seed": self.seed, "withSequences": self.withSequences}
+
+    def readName(self, i):
+        """Return name of the i-th subread, movie/holeNumber/start_end."""
+        return "{m}/{h}/{s}_{e}".format(m=self.movies[self.reads["movie"][i]],
+                                        h=self.reads["hole"][i],
+                                        s=self.reads["start"][i],
+                                        e=self.reads["end"][i])
+
+    def _bases(self, length):
+        """Return a random sequence of length bases."""
+        return BASES[self.baseRng.randint(0, 4, size=length)].tostring()
+
+    def _sequence(self, length):
+        """Return a random sequence of length, or 'A'."""
+        return self._bases(length) if self.withSequences else "A"
+
+    def _writeReference(self):
+        """Write references, of which the total length gives coverage."""
+        # Mean subread length is about 4250 bases.
+        total = max(50000 * self.numRefs,
+                    int(self.numReads * 4250 / self.coverage))
+        self.refLens = [total // self.numRefs] * self.numRefs
+        with open(self.ref_fasta, 'w') as writer:
+            for r, refLen in enumerate(self.refLens):
+                writer.write(">ref{r}\n".format(r=r))
+                for start in xrange(0, refLen, 60 * 10000):
+                    seq = self._bases(min(60 * 10000, refLen - start))
+                    writer.write("\n".join([seq[i:i+60] for i in
+                                            xrange(0, len(seq), 60)]) + "\n")
+
+    def _writeReseqHit(self, writers, name, start, end, zmwLen, ref,
+                       refStart, refEnd, strand):
+        """Write a reseq hit of a subread to reseq.m4, and a shifted one,
+        unless dropped, to reseq.shifted.m4."""
+        refLen = self.refLens[ref]
+        score = -5 * (end - start) + self.rng.randint(-500, 500)
+        for writer, shift in zip(writers, [0, self.rng.randint(-300, 300)]):
+            if shift != 0 and self.rng.random() < 0.05:
+                continue
+            s = min(max(0, refStart + shift), refLen - 1)
+            e = min(max(s + 1, refEnd + shift), refLen)
+            tstart, tend = (s, e) if strand == 0 else \
+                           (refLen - e, refLen - s)
+            writer.write("{q} ref{r} {sc} 86.5 0 {qs} {qe} {ql} {ts} " \
+                         "{tb} {te} {tl} 254\n".format(q=name, r=ref,
+                         sc=score, qs=start, qe=end, ql=zmwLen, ts=strand,
+                         tb=tstart, te=tend, tl=refLen))
+
+    def _generateReads(self):
+        """Generate ZMWs of subreads until there are numReads subreads,
+        write query.fasta, target.fasta, reseq.m4, reseq.shifted.m4 and
+        read_to_rc_read.sdp, and keep subreads in self.reads."""
+        rng = self.rng
+        reseqWriters = [open(self.reseq_m4, 'w'),
+                        open(self.shifted_reseq_m4, 'w')]
+        qWriter = open(self.query_fasta, 'w')
+        tWriter = open(self.target_fasta, 'w')
+        sdpWriter = open(self.sdp, 'w')
+        sdpWriter.write("qid,tid,qstart,qend,qlen,tstart,tend,tlen,score\n")
+        hole = 0
+        while len(self.reads["hole"]) < self.numReads:
+            movie = rng.randrange(len(self.movies))
+            hole += rng.randint(1, 20)
+            ref = rng.randrange(self.numRefs)
+            lens = [rng.randint(500, 8000) for _k in
+                    range(min(rng.randint(1, 4),
+                              self.numReads - len(self.reads["hole"])))]
+            zmwLen = sum(lens) + ADAPTER_LEN * (len(lens) - 1)
+            pos = rng.randint(0, self.refLens[ref] - max(lens))
+            strand = rng.randint(0, 1)
+            x = 0
+            for length in lens:
+                name = "{m}/{h}/{s}_{e}".format(m=self.movies[movie],
+                                                h=hole, s=x, e=x + length)
+                mapped = rng.random() < 0.9
+                if mapped:
+                    # Clip ends of subreads, shift and add indels.
+                    start = x + rng.randint(0, 50)
+                    end = x + length - rng.randint(0, 50)
+                    refStart = max(0, pos + rng.randint(-100, 100))
+                    refEnd = min(self.refLens[ref], refStart + end - start +
+                                 rng.randint(-200, 200))
+                    self._writeReseqHit(reseqWriters, name, start, end,
+                                        zmwLen, ref, refStart, refEnd,
+                                        strand)
+                for k, v in (("movie", movie), ("hole", hole),
+                             ("start", x), ("end", x + length),
+                             ("ref", ref if mapped else -1),
+                             ("refStart", refStart if mapped else 0),
+                             ("refEnd", refEnd if mapped else 0)):
+                    self.reads[k].append(v)
+
+                seq = self._sequence(length)
+                qWriter.write(">{n}\n{s}\n".format(n=name, s=seq))
+                if length >= self.targetMinLen:
+                    tWriter.write(">{n}\n{s}\n".format(n=name, s=seq))
+                if rng.random() < self.palindromeFraction:
+                    half = length // 2
+                    sdpWriter.write("{n},{n},0,{h},{l},{t},{l},{l},{s}\n".
+                                    format(n=name, h=half, l=length,
+                                           t=length - half, s=-5 * half))
+                else:
+                    a = rng.randint(0, length - 100)
+                    sdpWriter.write("{n},{n},{a},{b},{l},{c},{d},{l},{s}\n".
+                                    format(n=name, a=a, b=a + 50, l=length,
+                                           c=length - a - 50, d=length - a,
+                                           s=-rng.randint(50, 250)))
+                x += length + ADAPTER_LEN
+                strand = 1 - strand
+        for writer in reseqWriters + [qWriter, tWriter, sdpWriter]:
+            writer.close()
+
+    def _writePreassembly(self):
+        """Write hitsPerRead preassembly hits of each query subread to
+        targets, of which about tpFraction are hits to a target which
+        overlaps the query in reference, and the others to a random
+        target."""
+        rng = self.rng
+        reads = self.reads
+        targets = [i for i in xrange(len(reads["hole"]))
+                   if reads["end"][i] - reads["start"][i] >=
+                   self.targetMinLen]
+        if len(targets) == 0:
+            raise ValueError("No target reads of at least {n} bases.".
+                             format(n=self.targetMinLen))
+        # Mapped targets of each reference, sorted by reference start.
+        mapped = [sorted([(reads["refStart"][i], i) for i in targets
+                          if reads["ref"][i] == r])
+                  for r in range(self.numRefs)]
+        starts = [[s for s, _i in m] for m in mapped]
+
+        with open(self.preassembly_m4, 'w') as writer:
+            for q in xrange(len(reads["hole"])):
+                for _k in range(self.hitsPerRead):
+                    t, tp = None, False
+                    r = reads["ref"][q]
+                    if r >= 0 and len(mapped[r]) > 0 and \
+                       rng.random() < self.tpFraction:
+                        # A target starting before the end of query
+                        hi = bisect_left(starts[r], reads["refEnd"][q])
+                        if hi > 0:
+                            t = mapped[r][rng.randint(max(0, hi - 10),
+                                                      hi - 1)][1]
+                            tp = True
+                    if t is None:
+                        t = targets[rng.randrange(len(targets))]
+                    if t == q:
+                        continue
+                    ovl = min(reads["refEnd"][q], reads["refEnd"][t]) - \
+                          max(reads["refStart"][q], reads["refStart"][t])
+                    score = -5 * max(ovl, 100) if tp else \
+                            -rng.randint(100, 2000)
+                    tLen = reads["end"][t] - reads["start"][t]
+                    writer.write("{q} {t} {sc} 80.0 0 {qs} {qe} {ql} {ts} " \
+                                 "0 {tl} {tl} 254\n".format(
+                                 q=self.readName(q), t=self.readName(t),
+                                 sc=score + rng.randint(-200, 200),
+                                 qs=reads["start"][q], qe=reads["end"][q],
+                                 ql=reads["end"][q] + ADAPTER_LEN,
+                                 ts=rng.randint(0, 1), tl=tLen))
+
+    def generate(self):
+        """Generate all inputs."""
+        mkdir(self.out_dir)
+        logging.info("Generating {n} synthetic subreads in {d}.".format(
+                     n=self.numReads, d=self.out_dir))
+        self._writeReference()
+        self._generateReads()
+        self._writePreassembly()
+        with open(self.done_file, 'w') as writer:
+            json.dump(self.params(), writer, indent=2, sort_keys=True)
+
+
+class DoBench(object):
+    """Benchmark pbove components on synthetic datasets of each number
+    of subreads in numReads, and write a json report, which can be
+    compared with a report of another version (baseline)."""
+    def __init__(self, numReads, out_dir, report, baseline=None,
+                 ovl_cut_off=200, force_redo=False, startup_repeats=0,
+                 **datasetOpts):
+        self.numReads = [int(n) for n in numReads]
+        self.startup_repeats = int(startup_repeats)
+        self.out_dir = realpath(out_dir)
+        self.report = realpath(report)
+        self.baseline = realpath(baseline)
+        self.ovl_cut_off = int(ovl_cut_off)
+        self.force_redo = force_redo
+        self.datasetOpts = datasetOpts
+        mkdir(self.out_dir)
+        self.metrics = StageMetrics(op.join(self.out_dir, "metrics.json"))
+
+    def _stage(self, name, n, rows=None):
+        """Measure benchmark name on dataset of n subreads, or on no
+        dataset if n is None."""
+        stage = self.metrics.stage("bench.{b}".format(b=name) if n is None
+                                   else "bench.{n}.{b}".format(n=n, b=name),
+                                   rows=rows)
+        return _BenchStage(stage, name, n)
+
+    def _benchStartup(self):
+        """Benchmark startup of every console script, i.e., importing it
+        and printing --help in a new interpreter, startup_repeats times,
+        and record the best time as bestSeconds."""
+        for script in STARTUP_SCRIPTS:
+            cmd = [sys.executable, "-c",
+                   "import sys; sys.argv[0] = '{s}.py'; ".format(s=script) +
+                   "from pbove.{s} import main; sys.exit(main())".
+                   format(s=script), "--help"]
+            with self._stage("startup." + script, None,
+                             rows=self.startup_repeats) as stage, \
+                 open(os.devnull, 'w') as devnull:
+                seconds = []
+                for _i in range(self.startup_repeats):
+                    start = time.time()
+                    if subprocess.call(cmd, stdout=devnull) != 0:
+                        raise RuntimeError("Failed to start {s}.".
+                                           format(s=script))
+                    seconds.append(time.time() - start)
+                stage.extra["bestSeconds"] = min(seconds)
+            logging.info("{s} starts in {b:.3f}s.".format(s=script,
+                                                          b=min(seconds)))
+
+    def _bench(self, n):
+        """Benchmark on a dataset of n subreads."""
+        data = SyntheticDataset(op.join(self.out_dir, "data_{n}".format(n=n)),
+                                n, **self.datasetOpts)
+        if self.force_redo or not data.exists():
+            with self._stage("generate", n, rows=n):
+                data.generate()
+
+        with self._stage("ReseqGroundTruth", n) as stage:
+            gt = ReseqGroundTruth(data.reseq_m4)
+            stage.rows = len(gt.readToReference)
+
+        queryReads = PBIReadFastaHeadReader(data.query_fasta).reads
+        targetReads = PBIReadFastaHeadReader(data.target_fasta).reads
+        with self._stage("MapPBISubreadsToReference", n,
+                         rows=len(queryReads) + len(targetReads)):
+            q = gt.MapPBISubreadsToReference(queryReads)
+            t = gt.MapPBISubreadsToReference(targetReads)
+
+        with self._stage("ComputeAllPosNegNumbers", n, rows=len(q)):
+            gtNumbers = ComputeAllPosNegNumbers(q, t, self.ovl_cut_off)
+
+        pred = PreassemblyPrediction(data.preassembly_m4)
+        with self._stage("OverlapLengthsInReference", n,
+                         rows=len(pred.readToRead)):
+            pred.OverlapLengthsInReference(gt, infer=True)
+        out_qtso = op.join(data.out_dir, "out.qtso")
+        pred.ToQTSO(out_qtso)
+        del pred, gt
+
+        with self._stage("QTSOTables", n) as stage:
+            scoreCounts = QTSO.ScoreCounts()
+            scoreCounts.addQTSOFile(out_qtso)
+            deltaTable = scoreCounts.getDeltaTables(stepSize=100,
+                    overlapLengthCutoffs=[self.ovl_cut_off])[self.ovl_cut_off]
+            (numGTPos, numGTNeg, numGTWeak, numUnmappableAlns,
+             numMappableAlns, numAlns) = gtNumbers
+            QTSO.WriteTable(numGTPos=numGTPos, numGTNeg=numGTNeg,
+                    numGTWeak=numGTWeak, numUnmappableAlns=numUnmappableAlns,
+                    numMappableAlns=numMappableAlns, numAlns=numAlns,
+                    deltaTable=deltaTable,
+                    outfile=op.join(data.out_dir, "out.csv"))
+            stage.rows = sum([sum(c.values()) for c in
+                              scoreCounts.counts.itervalues()])
+
+        comparer = PboveCompareOverlap(query_reads=data.query_fasta,
+                                  ref=data.ref_fasta, m4_1=data.reseq_m4,
+                                  m4_2=data.shifted_reseq_m4,
+                                  out_file=op.join(data.out_dir, "cmp.txt"))
+        comparer.get_ref_infos()
+        ais_1 = comparer.get_aln_infos(comparer.m4_1)
+        ais_2 = comparer.get_aln_infos(comparer.m4_2)
+        with self._stage("cmp_aln_infos", n,
+                         rows=len(set(ais_1.keys()).union(ais_2.keys()))):
+            comparer.cmp_aln_infos(ais_1, ais_2)
+
+    def _compare(self, results):
+        """Add wall seconds of the same benchmarks in baseline report
+        and speedups to results, and log them."""
+        with open(self.baseline, 'r') as reader:
+            old = dict([((r["benchmark"], r["numReads"]), r) for r in
+                        json.load(reader)["results"]])
+        for r in results:
+            o = old.get((r["benchmark"], r["numReads"]), None)
+            if o is None or not r["wallSeconds"]:
+                continue
+            r["baselineWallSeconds"] = o["wallSeconds"]
+            r["speedup"] = o["wallSeconds"] / r["wallSeconds"]
+            logging.info("{b} of {n} reads: {o:.2f}s -> {w:.2f}s, " \
+                         "speedup {s:.2f}x.".format(b=r["benchmark"],
+                         n=r["numReads"], o=o["wallSeconds"],
+                         w=r["wallSeconds"], s=r["speedup"]))
+
+    def run(self):
+        """Run"""
+        if self.startup_repeats > 0:
+            self._benchStartup()
+        for n in self.numReads:
+            self._bench(n)
+
+        results = [r.to_dict() for r in self.metrics.records]
+        if self.baseline is not None:
+            self._compare(results)
+        params = SyntheticDataset(self.out_dir, 0,
+                                  **self.datasetOpts).params()
+        del params["numReads"]
+        with open(self.report, 'w') as writer:
+            json.dump({"version": get_version(),
+                       "python": platform.python_version(),
+                       "platform": platform.platform(),
+                       "numReads": self.numReads,
+                       "ovlCutOff": self.ovl_cut_off,
+                       "dataset": params,
+                       "results": results}, writer, indent=2, sort_keys=True)
+        logging.info("Benchmark report written to {f}.".format(f=self.report))
+
+
+class _BenchStage(object):
+    """A StageMetrics stage whose record is tagged with a benchmark
+    name and number of reads, see DoBench._stage."""
+    def __init__(self, stage, name, numReads):
+        self.stage = stage
+        self.name = name
+        self.numReads = numReads
+
+    def __enter__(self):
+        record = self.stage.__enter__()
+        record.extra.update({"benchmark": self.name,
+                             "numReads": self.numReads})
+        return record
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self.stage.__exit__(exc_type, exc_value, traceback)
+
+
+def set_parser(parser):
+    """Set parser arguments."""
+    parser.add_argument("report", type=str,
+        help="Output benchmark report in json.")
+
+    parser.add_argument("--num_reads", type=int, nargs="*",
+        default=[10000, 100000],
+        help="Numbers of synthetic subreads of datasets to benchmark on, " +
+             "e.g., 10000 100000 1000000 10000000, or none to only " +
+             "benchmark startup.")
+
+    parser.add_argument("--startup_repeats", type=int, default=3,
+        help="Number of times to start every console script with " +
+             "--help to benchmark startup time, 0 to skip.")
+
+    parser.add_argument('-d', "--out_dir", dest="out_dir",
+                        type=str, default="pbove_bench",
+                        help="Output directory of synthetic datasets.")
+
+    parser.add_argument("--baseline", type=str, default=None,
+        help="Benchmark report of another version to compare with.")
+
+    parser.add_argument("--ovl_cut_off", type=int, default=200,
+        help="Minimum number of overlapping base pairs to consider two " +
+             "reads as positive overlap.")
+
+    parser.add_argument("--coverage", type=float, default=30,
+        help="Coverage of reference by synthetic subreads.")
+
+    parser.add_argument("--num_refs", type=int, default=2,
+        help="Number of synthetic references.")
+
+    parser.add_argument("--num_movies", type=int, default=3,
+        help="Number of synthetic movies.")
+
+    parser.add_argument("--target_min_len", type=int, default=5000,
+        help="Minimum length of target subreads.")
+
+    parser.add_argument("--tp_fraction", type=float, default=0.7,
+        help="Fraction of preassembly hits to overlapping targets.")
+
+    parser.add_argument("--hits_per_read", type=int, default=1,
+        help="Number of preassembly hits of each query subread.")
+
+    parser.add_argument("--palindrome_fraction", type=float, default=0.01,
+        help="Fraction of palindrome subreads in sdp output.")
+
+    parser.add_argument("--seed", type=int, default=0,
+        help="Random seed of synthetic datasets.")
+
+    parser.add_argument("--with_sequences", default=False,
+        action="store_true",
+        help="Write random sequences of subreads instead of one base.")
+
+    parser.add_argument("--force_redo", default=False, action="store_true",
+        help="Regenerate synthetic datasets which exist.")
+    return parser
+
+
+class DoBenchRunner(PBToolRunner):
+    """pbove bench runner"""
+    def __init__(self):
+        desc = "Generate synthetic inputs and benchmark pbove on them."
+        PBToolRunner.__init__(self, desc)
+        set_parser(self.parser)
+        add_profile_arguments(self.parser)
+
+    def getVersion(self):
+        """Get version string"""
+        return get_version()
+
+    @profiled
+    def run(self):
+        """Run"""
+        logging.info("Running {f} v{v}.".format(f=op.basename(__file__),
+                                                v=self.getVersion()))
+        args = self.args
+        try:
+            obj = DoBench(numReads=args.num_reads,
+                          out_dir=args.out_dir,
+                          report=args.report,
+                          baseline=args.baseline,
+                          ovl_cut_off=args.ovl_cut_off,
+                          force_redo=args.force_redo,
+                          startup_repeats=args.startup_repeats,
+                          coverage=args.coverage,
+                          numRefs=args.num_refs,
+                          numMovies=args.num_movies,
+                          targetMinLen=args.target_min_len,
+                          tpFraction=args.tp_fraction,
+                          hitsPerRead=args.hits_per_read,
+                          palindromeFraction=args.palindrome_fraction,
+                          seed=args.seed,
+                          withSequences=args.with_sequences)
+            obj.run()
+        except ValueError as e:
+            logging.error(str(e))
+            return 1
+        return 0
+
+
+def main():
+    """Main function."""
+    runner = DoBenchRunner()
+    return runner.start()
+
+if __name__ == "__main__":
+    sys.exit(main())
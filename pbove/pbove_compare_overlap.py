@@ -9,12 +9,11 @@ import logging
 from collections import namedtuple, defaultdict
 
 from pbcore.util.ToolRunner import PBToolRunner
-from pbcore.io import FastaReader
-from pbalign.utils.fileutil import checkReferencePath
 
 from pbove.io.M4IO import M4Reader
 from pbove.utils.Utils import realpath #, mkdir
 from pbove.__init__ import get_version
+from pbove.utils.Profiling import add_profile_arguments, profiled
 from pbove.utils.Interval import Interval, RefIntervals
 
 RefInfo = namedtuple('RefInfo', ['name', 'len', 'index'])
@@ -52,6 +51,8 @@ def fdr(intersect_len, sub_1_2_len, sub_2_1_len, take_1_as_gold=True):
 class PboveCompareOverlap(object):
     """Class of pbove_compare_overlap."""
     def __init__(self, query_reads, ref, m4_1, m4_2, out_file):
+        # pbalign is slow to import, import it only when needed.
+        from pbalign.utils.fileutil import checkReferencePath
         self.query_reads = query_reads
         self.ref = ref
         _a, self.ref_fasta, _b, _c, _d = checkReferencePath(self.ref)
@@ -71,6 +72,7 @@ class PboveCompareOverlap(object):
            ref_infos: dictionary,
                       ref_name -> RefInfo(ref_name, length, index_of_this_ref)
         """
+        from pbcore.io import FastaReader
         with FastaReader(self.ref_fasta) as reader:
             self.ref_infos = {r.name.split()[0]:
                               RefInfo(r.name.split()[0], len(r.sequence), idx)
@@ -253,11 +255,13 @@ class PboveCompareOverlapRunner(PBToolRunner):
                "two different aligners."
         PBToolRunner.__init__(self, desc)
         set_parser(self.parser)
+        add_profile_arguments(self.parser)
 
     def getVersion(self):
         """Get version string"""
         return get_version()
 
+    @profiled
     def run(self):
         """Run"""
         logging.info("Running {f} v{v}.".format(f=op.basename(__file__),
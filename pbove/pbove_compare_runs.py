@@ -4,13 +4,19 @@ plot a ROC-like figure."""
 
 import os.path as op
 import os, sys
+import json
+import hashlib
 import logging
 from pbcore.util.ToolRunner import PBToolRunner
 from pbcore.util.Process import backticks
-from pbove.utils.Utils import realpath, mkdir, cat_files
-from pbove.io.RunInfoReader import RunInfo, RunInfoReader
+from pbove.utils.Utils import realpath, mkdir, cat_files, \
+        to_cutoff_list
+from pbove.io.RunInfoReader import RunInfo, RunInfoReader, \
+        group_runinfos_by_fofn
 from pbove.pbove_main import add_params_to_parser
+from pbove.QTSO import ReadROCMetrics, ROCMetricsFile, FDR_TARGETS
 from pbove.__init__ import get_version, get_dir
+from pbove.utils.Profiling import add_profile_arguments, profiled
 
 
 class PboveComparePreassembly(object):
@@ -18,7 +24,7 @@ class PboveComparePreassembly(object):
     def __init__(self, runinfos_fn, ref, plot_dir,
                  reseq_blasr_opts, preassembly_blasr_opts,
                  force_redo, min_seed_len, split_palindrome,
-                 ovl_cut_off, palindrome_score_cutoff):
+                 ovl_cut_off, palindrome_score_cutoff, resume=False):
         self.runinfos_fn = realpath(runinfos_fn)
         self.ref = ref
         self.plot_dir = plot_dir
@@ -29,8 +35,9 @@ class PboveComparePreassembly(object):
         self.force_redo = force_redo
         self.min_seed_len = min_seed_len
         self.split_palindrome = split_palindrome
-        self.ovl_cut_off = int(ovl_cut_off)
+        self.ovl_cut_off = to_cutoff_list(ovl_cut_off)
         self.palindrome_score_cutoff = int(palindrome_score_cutoff)
+        self.resume = resume
 
         self.runinfos = []
         with RunInfoReader(self.runinfos_fn) as reader:
@@ -52,11 +59,95 @@ class PboveComparePreassembly(object):
         """Return out table, e.g., "out.csv", for the given run."""
         return op.join(runinfo.out_dir, "out.csv")
 
-    def create_pbove_job(self, runinfo):
+    @property
+    def shared_reseq_root(self):
+        """Return root directory of filtered subreads and resequencing
+        outputs shared by runs of the same movies."""
+        return realpath(op.join(self.plot_dir, "shared_reseq"))
+
+    def shared_reseq_params(self, fofn):
+        """Return a dictionary of inputs and options which determine
+        filtered subreads and resequencing outputs of movies in fofn."""
+        with open(fofn, 'r') as reader:
+            fofn_md5 = hashlib.md5(reader.read()).hexdigest()
+        return {"fofn": realpath(fofn), "fofn_md5": fofn_md5,
+                "ref": realpath(self.ref),
+                "reseq_blasr_opts": self.reseq_blasr_opts,
+                "split_palindrome": self.split_palindrome,
+                "palindrome_score_cutoff": self.palindrome_score_cutoff}
+
+    def shared_reseq_dir(self, fofn):
+        """Return directory of filtered subreads and resequencing outputs
+        shared by runs of movies in fofn, named by a digest of
+        shared_reseq_params, so that outputs of different inputs or
+        options are never reused."""
+        key = hashlib.md5(json.dumps(self.shared_reseq_params(fofn),
+                                     sort_keys=True)).hexdigest()
+        return op.join(self.shared_reseq_root, key[:16])
+
+    def shared_all_reads_fasta(self, fofn):
+        """Return filtered subreads shared by runs of movies in fofn."""
+        return op.join(self.shared_reseq_dir(fofn), "all_reads.fasta")
+
+    def shared_reseq_m4(self, fofn):
+        """Return resequencing output shared by runs of movies in fofn."""
+        return op.join(self.shared_reseq_dir(fofn), "reseq_out.m4")
+
+    def shared_reseq_job(self, fofn):
+        """Return job script which filters subreads and does
+        resequencing for runs of movies in fofn."""
+        return op.join(self.shared_reseq_dir(fofn), "reseq_job.sh")
+
+    def create_shared_reseq_job(self, fofn):
+        """Create a job script, which filters subreads from fofn and
+        aligns them to reference, for all runs of movies in fofn,
+        chmod +x, and return path to the job script. Inputs and options
+        of the shared outputs are saved to params.json next to them.
+        """
+        out_dir = self.shared_reseq_dir(fofn)
+        mkdir(out_dir)
+        log = op.join(out_dir, "reseq_job.log")
+        with open(op.join(out_dir, "params.json"), 'w') as writer:
+            json.dump(self.shared_reseq_params(fofn), writer, indent=2,
+                      sort_keys=True)
+
+        cmd = "#!/bin/bash \n"
+        cmd += "pbove_filter_subreads.py -vv {fofn} {fa} --out_dir {od} ".\
+               format(fofn=fofn,
+                      fa=self.shared_all_reads_fasta(fofn),
+                      od=out_dir) + \
+               ("--force_redo " if self.force_redo else "")
+        if self.split_palindrome:
+            cmd += "--split_palindrome " + \
+                   "--palindrome_score_cutoff={psc} ".\
+                   format(psc=self.palindrome_score_cutoff)
+        cmd += "2>{log} && \\\n".format(log=log)
+
+        cmd += "pbove_reseq.py -vv {fa} {ref} {m4} ".\
+               format(fa=self.shared_all_reads_fasta(fofn),
+                      ref=self.ref,
+                      m4=self.shared_reseq_m4(fofn)) + \
+               "--blasr_opts=\"{rbo}\" ".format(rbo=self.reseq_blasr_opts) + \
+               ("--force_redo " if self.force_redo else "") + \
+               "2>>{log}".format(log=log)
+
+        job_fn = self.shared_reseq_job(fofn)
+        with open(job_fn, 'w') as writer:
+            writer.write(cmd + "\n")
+
+        os.chmod(job_fn, 0744)
+        return job_fn
+
+    def create_pbove_job(self, runinfo, shared=False):
         """Create a job script, self.pbove_job(runinfo), for a give run,
         chmod +x, and return path to the job script.
+        If shared is True, this run uses filtered subreads and
+        resequencing outputs shared by runs of the same movies.
         """
         mkdir(runinfo.out_dir)
+        preassembly_blasr_opts = runinfo.preassembly_blasr_opts \
+                                 if runinfo.preassembly_blasr_opts is not None \
+                                 else self.preassembly_blasr_opts
 
         cmd = "#!/bin/bash \n"
         cmd += "pbove -vv {fofn} {ref} {out} --out_dir {od} ".\
@@ -67,16 +158,24 @@ class PboveComparePreassembly(object):
                "--reseq_blasr_opts=\"{rbo}\" ".\
                format(rbo=self.reseq_blasr_opts) + \
                "--preassembly_blasr_opts=\"{pbo}\" ".\
-               format(pbo=self.preassembly_blasr_opts) + \
+               format(pbo=preassembly_blasr_opts) + \
                ("--force_redo " if self.force_redo else "") + \
+               ("--resume " if self.resume else "") + \
                "--min_seed_len={msl} ".format(msl=self.min_seed_len) + \
-               "--ovl_cut_off={oco} ".format(oco=self.ovl_cut_off)
+               "--ovl_cut_off {oco} ".format(
+                   oco=" ".join([str(c) for c in self.ovl_cut_off]))
 
         if self.split_palindrome:
             cmd += "--split_palindrome " + \
                    "--palindrome_score_cutoff={psc} ".\
                    format(psc=self.palindrome_score_cutoff)
 
+        if shared:
+            cmd += "--shared_all_reads_fasta={fa} ".\
+                   format(fa=self.shared_all_reads_fasta(runinfo.fofn)) + \
+                   "--shared_reseq_m4={m4} ".\
+                   format(m4=self.shared_reseq_m4(runinfo.fofn))
+
         cmd += "2>{log}".format(log=self.pbove_log(runinfo))
 
         job_fn = self.pbove_job(runinfo)
@@ -94,15 +193,27 @@ class PboveComparePreassembly(object):
     def create_pbove_jobs(self):
         """Create a job script for every run folder in run_folders,
         and save job scripts to file: self.all_pbove_jobs.
+        Runs of the same movies share one job which filters subreads
+        and does resequencing, and which is executed before their own
+        preassembly and eval jobs.
         """
-        self.job_fns = []
-        with open(self.all_pbove_jobs, 'w') as writer:
-            for runinfo in self.runinfos:
+        shared_job_fns, run_job_fns = [], []
+        groups = group_runinfos_by_fofn(self.runinfos)
+        for fofn, runinfos in groups.iteritems():
+            shared = len(runinfos) > 1
+            if shared:
+                logging.debug("Creating a shared resequencing job at {f}".
+                              format(f=self.shared_reseq_job(fofn)))
+                shared_job_fns.append(self.create_shared_reseq_job(fofn))
+            for runinfo in runinfos:
                 logging.debug("Creating a job script at {f}".
                               format(f=self.pbove_job(runinfo)))
-                job_fn = self.create_pbove_job(runinfo)
+                run_job_fns.append(self.create_pbove_job(runinfo, shared))
+
+        self.job_fns = shared_job_fns + run_job_fns
+        with open(self.all_pbove_jobs, 'w') as writer:
+            for job_fn in self.job_fns:
                 writer.write(job_fn + "\n")
-                self.job_fns.append(job_fn)
 
         os.chmod(self.all_pbove_jobs, 0744)
         logging.info("Writing all scripts to {f}.".
@@ -119,6 +230,48 @@ class PboveComparePreassembly(object):
                                    format(cmd=cmd) +
                                    str(_out) + " " + str(_msg))
 
+    @property
+    def rank_fn(self):
+        """Return ranks of runs."""
+        return realpath(op.join(self.plot_dir, "pbove_rank.txt"))
+
+    def rank_runs(self):
+        """Rank runs by summary metrics (see QTSO.ROCMetrics) of the
+        first overlap length cutoff, read from out.roc.json of each run,
+        by AUC and then best F1, and write ranks to self.rank_fn.
+        Return a ranked list of (runinfo, metrics)."""
+        cutoff = self.ovl_cut_off[0]
+        ranked = []
+        for runinfo in self.runinfos:
+            fn = ROCMetricsFile(self.pbove_out_csv(runinfo))
+            metrics = ReadROCMetrics(fn).get(cutoff, None) \
+                      if op.exists(fn) else None
+            if metrics is None:
+                logging.warning("Could not find metrics of run {n} of " \
+                                "overlap length cutoff {c} in {f}.".format(
+                                n=runinfo.name, c=cutoff, f=fn))
+                continue
+            ranked.append((runinfo, metrics))
+        ranked.sort(key=lambda x: (-x[1]["auc"], -x[1]["bestF1"]))
+
+        header = ["rank", "name", "group", "auc", "bestF1",
+                  "bestF1ScoreCutoff", "maxSensitivity"] + \
+                 ["sensitivityAtFDR{t}".format(t=t) for t in FDR_TARGETS]
+        with open(self.rank_fn, 'w') as writer:
+            writer.write("\t".join(header) + "\n")
+            for rank, (runinfo, m) in enumerate(ranked):
+                atFDR = [m["sensitivityAtFDR"].get(str(t), None)
+                         for t in FDR_TARGETS]
+                writer.write("\t".join([str(rank + 1), runinfo.name,
+                    runinfo.group, "{0:.6f}".format(m["auc"]),
+                    "{0:.6f}".format(m["bestF1"]),
+                    str(m["bestF1ScoreCutoff"]),
+                    "{0:.6f}".format(m["maxSensitivity"])] +
+                    ["NA" if v is None else
+                     "{0:.6f}".format(v["sensitivity"]) for v in atFDR]) +
+                    "\n")
+        return ranked
+
     @property
     def R_input(self):
         """return R input."""
@@ -183,6 +336,9 @@ class PboveComparePreassembly(object):
         logging.info("Executing scripts for runs.")
         self.execute_pbove_jobs()
 
+        logging.info("Ranking runs to {f}.".format(f=self.rank_fn))
+        self.rank_runs()
+
         logging.info("Plotting figures.")
         self.plot_figures()
 
@@ -193,9 +349,13 @@ def set_parser(parser):
     """Set parser."""
     parser.add_argument("runinfos", type=str,
                         help="A file containing info of jobs/movies " +
-                             "to compare. Each line has three fields, " +
-                             "fofn of a job, job name and an output " +
-                             "directory for analyzing this job.")
+                             "to compare. Each line has four fields, " +
+                             "fofn of a job, job name, group name and an " +
+                             "output directory for analyzing this job, " +
+                             "optionally followed by blasr options for " +
+                             "preassembly of this job. Jobs of the same " +
+                             "fofn share filtered subreads and " +
+                             "resequencing outputs.")
 
     helpstr = "Reference sequence or reference repository."
     parser.add_argument("ref", type=str, help=helpstr)
@@ -213,11 +373,13 @@ class PboveComparePreassemblyRunner(PBToolRunner):
                "jobs/runs in the context of preassembly overlap prediction."
         PBToolRunner.__init__(self, desc)
         set_parser(self.parser)
+        add_profile_arguments(self.parser)
 
     def getVersion(self):
         """Get version string"""
         return get_version()
 
+    @profiled
     def run(self):
         """Run"""
         logging.info("Running {f} v{v}.".format(f=op.basename(__file__),
@@ -234,7 +396,8 @@ class PboveComparePreassemblyRunner(PBToolRunner):
                 min_seed_len=args.min_seed_len,
                 split_palindrome=args.split_palindrome,
                 ovl_cut_off=args.ovl_cut_off,
-                palindrome_score_cutoff=args.palindrome_score_cutoff)
+                palindrome_score_cutoff=args.palindrome_score_cutoff,
+                resume=args.resume)
             obj.run()
         except ValueError as e:
             logging.error(str(e))
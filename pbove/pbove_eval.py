@@ -4,18 +4,41 @@
 Evaluate overlap detection of preassembly.
 """
 import os.path as op
+import shutil
 from pbcore.util.ToolRunner import PBToolRunner
 from pbove.__init__ import get_version
+from pbove.utils.Profiling import add_profile_arguments, profiled
 from pbove.Reseq import ReseqGroundTruth
-from pbove.utils.Utils import mkdir
+from pbove.utils.Utils import mkdir, to_cutoff_list, parse_mem_size, \
+        merge_sorted_shards
 from pbove.Preassembly import PreassemblyPrediction
 from pbove.io.PBIReadFastaHeadIO import PBIReadFastaHeadReader
-from pbove.utils.compute import ComputeAllPosNegNumbers, \
-        write_gt_overlaps
+from pbove.utils.compute import ComputeOverlapLengthDistribution, \
+        GetAllPosNegNumbersForCutoffs, write_gt_overlaps
+from pbove.utils.IntervalIndex import ReferenceIntervalIndex
+from pbove.io.OverlapHistogramIO import OverlapHistogram, \
+        ZmwOverlapHistogram
+from pbove.utils.Metrics import StageMetrics
+from pbove.utils.Progress import SetProgressInterval
+from pbove.Partition import EvalPartitioner, PartialEvalResult, \
+        ParsePartition, ReadIndices, ZmwSampled
 import pbove.QTSO as QTSO
 import sys
+import math
 import logging
 
+# Approximate bytes of memory needed per byte of M4 input, which are
+# parsed into M4Entry objects in memory.
+MEM_PER_M4_BYTE = 10
+
+
+def NumPartitionsForMemory(max_mem, reseq_m4, preassembly_m4):
+    """Return number of partitions needed to evaluate reseq_m4 and
+    preassembly_m4 using at most max_mem bytes of memory."""
+    m4Bytes = op.getsize(reseq_m4) + op.getsize(preassembly_m4)
+    return max(1, int(math.ceil(m4Bytes * MEM_PER_M4_BYTE / float(max_mem))))
+
+
 class Summary(object):
     """Brief summary"""
     def __init__(self):
@@ -23,6 +46,8 @@ class Summary(object):
         self.numGTPos, self.numGTNeg, \
         self.numGTWeak, self.numUnmappableAlns, \
         self.numMappableAlns, self.numAlns = 0, 0, 0, 0, 0, 0, 0, 0
+        # Fraction of sampled query ZMWs, None if all are evaluated.
+        self.sampleFraction = None
 
     def __str__(self):
         ret = "Number of query reads: " + str(self.numQ) + "\n" + \
@@ -38,6 +63,19 @@ class Summary(object):
             "Number of ground truth mappable pairs of reads: " + \
             str(self.numMappableAlns) + "\n" + \
             "Total number of pairs of reads: " + str(self.numAlns)
+        if self.sampleFraction is not None:
+            scale = lambda n: str(int(round(n / self.sampleFraction)))
+            ret += "\n" + \
+                "Fraction of sampled query ZMWs: " + \
+                str(self.sampleFraction) + "\n" + \
+                "Estimated number of query reads: " + \
+                scale(self.numQ) + "\n" + \
+                "Estimated number of ground truth positive overlaps: " + \
+                scale(self.numGTPos) + "\n" + \
+                "Estimated number of ground truth negative overlaps: " + \
+                scale(self.numGTNeg) + "\n" + \
+                "Estimated number of ground truth weak overlaps: " + \
+                scale(self.numGTWeak)
         return ret
 
 
@@ -45,10 +83,23 @@ class DoEval(object):
     """
     Evaluate the sensitivity and sepcificity of overlap detection
     in preassembly.
+    ovl_cut_off can be a list of overlap length cutoffs, in which case
+    outputs of the first cutoff are written to out_tb, out_dtb and
+    summary.txt, and outputs of every other cutoff, e.g., 500, are
+    written to files with suffix '.ovl500' added before extensions.
+    If sample_fraction is given, only query reads and preassembly hits
+    of a deterministic sample of about sample_fraction of query ZMWs are
+    evaluated, and sensitivity and FDR with confidence intervals are
+    written to out_ci (e.g., out.ci.csv of out.csv).
+    If bootstrap is given, query ZMWs are resampled bootstrap times to
+    compute confidence bands of sensitivity and FDR, using nproc
+    processes, which are written to out_bootstrap.
     """
     def __init__(self, query_fasta, target_fasta, reseq_m4, preassembly_m4,
                  out_dir, out_tb, out_qtso=None, out_dtb=None,
-                 ovl_cut_off=200, gt_overlaps_file=None):
+                 ovl_cut_off=200, gt_overlaps_file=None, gt=None,
+                 max_mem=None, partition=None, sample_fraction=None,
+                 bootstrap=None, nproc=1):
         self.query_fasta = query_fasta
         self.target_fasta = target_fasta
         self.reseq_m4 = reseq_m4
@@ -59,36 +110,155 @@ class DoEval(object):
                         (op.join(self.out_dir, "out.qtso"))
         self.out_dtb = out_dtb if out_dtb is not None else \
                         (op.join(self.out_dir, "out.delta"))
-        self.ovl_cut_off = int(ovl_cut_off)
+        self.ovl_cut_offs = to_cutoff_list(ovl_cut_off)
+        self.ovl_cut_off = self.ovl_cut_offs[0]
         self.gt_overlaps_file = gt_overlaps_file
+        # Ground truth (ReseqGroundTruth) which has been loaded from
+        # reseq_m4 by the caller, if any.
+        self.gt = gt
+        # If max_mem (e.g., 4G) is given, inputs which need more memory
+        # are evaluated partition by partition, see _run_out_of_core.
+        self.max_mem = max_mem
+        self.num_partitions = 1
+        # If partition (i, N) is given, only evaluate partition i of N
+        # and save a mergeable partial result, see _run_partition.
+        self.partition = partition
+        if self.partition is not None:
+            self.num_partitions = self.partition[1]
+        elif self.max_mem is not None:
+            self.num_partitions = NumPartitionsForMemory(
+                    parse_mem_size(max_mem), self.reseq_m4,
+                    self.preassembly_m4)
+
+        self.sample_fraction = None
+        if sample_fraction is not None:
+            self.sample_fraction = float(sample_fraction)
+            if not 0 < self.sample_fraction <= 1:
+                raise ValueError("Sample fraction must be in (0, 1].")
+
+        # Number of bootstrap replicates, and ground truth overlap
+        # lengths of each query ZMW which bootstrap resamples.
+        self.bootstrap = None if bootstrap is None else int(bootstrap)
+        self.nproc = max(1, int(nproc))
+        self.zmw_hist = None
+        if self.bootstrap is not None:
+            if self.bootstrap < 1:
+                raise ValueError("Number of bootstrap replicates must " +
+                                 "be positive.")
+            self.zmw_hist = ZmwOverlapHistogram()
 
         mkdir(self.out_dir)
+        self.metrics = StageMetrics(self.metrics_fn)
         self.summary = Summary()
+        self.summary.sampleFraction = self.sample_fraction
         self.summary_f = op.join(out_dir, "summary.txt")
 
+    @property
+    def out_gt_hist(self):
+        """Return histogram of ground truth overlap lengths of all
+        query-target pairs in npz, which can be reused to compute
+        numbers of ground truth overlaps of any other cutoff."""
+        return op.join(self.out_dir, "gt_overlaps.hist.npz")
+
+    @property
+    def metrics_fn(self):
+        """Return json of wall time, CPU time, peak memory and throughput
+        of stages, e.g., metrics.json, or metrics.i_of_N.json if only
+        partition i of N is evaluated."""
+        if self.partition is not None:
+            return op.join(self.out_dir, "metrics.{i}_of_{n}.json".format(
+                           i=self.partition[0], n=self.partition[1]))
+        return op.join(self.out_dir, "metrics.json")
+
+    @property
+    def partition_dir(self):
+        """Return directory of partitions of inputs for out-of-core
+        evaluation, which is removed when evaluation completes."""
+        if self.partition is not None:
+            return op.join(self.out_dir, "partitions.{i}_of_{n}".format(
+                           i=self.partition[0], n=self.partition[1]))
+        return op.join(self.out_dir, "partitions")
+
+    @property
+    def out_ci(self):
+        """Return table of sensitivity and FDR with confidence intervals
+        of sampled query ZMWs, e.g., out.ci.csv of out_tb out.csv."""
+        root, ext = op.splitext(self.out_tb)
+        return "{root}.ci{ext}".format(root=root, ext=ext)
+
+    @property
+    def out_roc(self):
+        """Return json of summary metrics (see QTSO.ROCMetrics) of all
+        cutoffs, e.g., out.roc.json of out_tb out.csv."""
+        return QTSO.ROCMetricsFile(self.out_tb)
+
+    @property
+    def out_bootstrap(self):
+        """Return table of bootstrap confidence bands of sensitivity and
+        FDR, e.g., out.bootstrap.csv of out_tb out.csv."""
+        root, ext = op.splitext(self.out_tb)
+        return "{root}.bootstrap{ext}".format(root=root, ext=ext)
+
+    def cutoff_fn(self, fn, cutoff):
+        """Return output file of an overlap length cutoff, which is fn
+        itself for the first cutoff, otherwise, e.g., out.ovl500.csv."""
+        if cutoff == self.ovl_cut_off:
+            return fn
+        root, ext = op.splitext(fn)
+        return "{root}.ovl{c}{ext}".format(root=root, c=cutoff, ext=ext)
+
     def run(self):
         """Run"""
-        logging.info("Read resequencing M4 file: {f}".format(f=self.reseq_m4))
-        # Get ground truth from reseq_m4.
-        gt = ReseqGroundTruth(self.reseq_m4)
-
-        logging.info("Get query reads from {f}".format(f=self.query_fasta))
-        # Get query reads from query_fasta.
-        queryReads = PBIReadFastaHeadReader(self.query_fasta)
-
-        logging.info("Find positions of query reads in coordinate of " +
-                     "reference genome.")
-        q = gt.MapPBISubreadsToReference(queryReads.reads)
-
-        # Get target reads from target_fasta.
-        logging.info("Get target reads from {f}".format(f=self.target_fasta))
-        targetReads = PBIReadFastaHeadReader(self.target_fasta)
-
-        logging.info("Find positions of target reads in coordinate of " +
-                     "reference genome.")
-        t = gt.MapPBISubreadsToReference(targetReads.reads)
-
-        # Compute number of
+        if self.partition is not None:
+            self._run_partition()
+            return
+        if self.num_partitions > 1:
+            gtHist, numQ, numT = self._run_out_of_core()
+        else:
+            gtHist, numQ, numT = self._run_in_memory()
+        self._write_results(gtHist, numQ, numT)
+
+    def _run_in_memory(self):
+        """Compute ground truth overlap length histogram and write QTSO
+        of all reads and hits in memory. Return (gtHist, numQ, numT)."""
+        with self.metrics.stage("eval.load_ground_truth") as stage:
+            if self.gt is not None:
+                gt = self.gt
+            else:
+                logging.info("Read resequencing M4 file: {f}".
+                             format(f=self.reseq_m4))
+                # Get ground truth from reseq_m4.
+                gt = ReseqGroundTruth(self.reseq_m4)
+            stage.rows = len(gt.readToReference)
+
+        with self.metrics.stage("eval.map_reads") as stage:
+            logging.info("Get query reads from {f}".
+                         format(f=self.query_fasta))
+            # Get query reads from query_fasta.
+            queryReads = PBIReadFastaHeadReader(self.query_fasta)
+            if self.sample_fraction is not None:
+                queryReads.reads = [r for r in queryReads.reads if
+                                    ZmwSampled(r.movie, r.holeNumber,
+                                               self.sample_fraction)]
+                logging.info("Sampled {n} query reads of {f} of ZMWs.".
+                             format(n=len(queryReads.reads),
+                                    f=self.sample_fraction))
+
+            logging.info("Find positions of query reads in coordinate of " +
+                         "reference genome.")
+            q = gt.MapPBISubreadsToReference(queryReads.reads)
+
+            # Get target reads from target_fasta.
+            logging.info("Get target reads from {f}".
+                         format(f=self.target_fasta))
+            targetReads = PBIReadFastaHeadReader(self.target_fasta)
+
+            logging.info("Find positions of target reads in coordinate of " +
+                         "reference genome.")
+            t = gt.MapPBISubreadsToReference(targetReads.reads)
+            stage.rows = len(q) + len(t)
+
+        # Compute overlap length distribution of
         #     ground truth positive overlap,
         #     ground truth negative overlap,
         #     ground truth weak overlap
@@ -101,51 +271,279 @@ class DoEval(object):
         # weak: query and target overlap length >= 0, < OverlapLengthCutoff.
         #
         logging.info("Computing numbers of ground truth posivitive, negative.")
-        (numGTPos, numGTNeg, numGTWeak, numUnmappableAlns, numMappableAlns,
-         numAlns) = ComputeAllPosNegNumbers(q, t, self.ovl_cut_off)
-
-        self.summary.numQ = len(queryReads.reads)
-        self.summary.numT = len(targetReads.reads)
-        self.summary.numGTPos = numGTPos
-        self.summary.numGTNeg = numGTNeg
-        self.summary.numGTWeak = numGTWeak
-        self.summary.numUnmappableAlns = numUnmappableAlns
-        self.summary.numMappableAlns = numMappableAlns
-        self.summary.numAlns = numAlns
-
-        with open(self.summary_f, 'w') as writer:
-            writer.write(str(self.summary) + "\n")
-
-        if (self.gt_overlaps_file is not None):
-            logging.info("Writing ground truth overlap pairs to {f}".
-                         format(f=self.gt_overlaps_file))
-            write_gt_overlaps(query=q, target=t,
-                              out_file=self.gt_overlaps_file)
-
-        # Query-target overlap relationships read from preassembly_m4.
-        logging.info("Reading overlap relations from {f}".
-                     format(f=self.preassembly_m4))
-        pred = PreassemblyPrediction(self.preassembly_m4)
-
-        logging.info("Retrieve overlap lengths from ground truth.")
+        with self.metrics.stage("eval.ground_truth_overlaps", rows=len(q)):
+            # Index of target reads in reference coordinate, shared by
+            # computing ground truth numbers and writing ground truth
+            # overlaps.
+            tIndex = ReferenceIntervalIndex(t)
+            gtHist = ComputeOverlapLengthDistribution(q, t, tIndex,
+                                                      zmwHist=self.zmw_hist)
+
+            if (self.gt_overlaps_file is not None):
+                logging.info("Writing ground truth overlap pairs to {f}".
+                             format(f=self.gt_overlaps_file))
+                write_gt_overlaps(query=q, target=t,
+                                  out_file=self.gt_overlaps_file,
+                                  tIndex=tIndex)
+
+        with self.metrics.stage("eval.preassembly_hits") as stage:
+            # Query-target overlap relationships read from preassembly_m4.
+            logging.info("Reading overlap relations from {f}".
+                         format(f=self.preassembly_m4))
+            pred = PreassemblyPrediction(self.preassembly_m4)
+            if self.sample_fraction is not None:
+                pred.readToRead = [i for i in pred.readToRead if
+                                   ZmwSampled(i.qpbi.movie, i.qpbi.holeNumber,
+                                              self.sample_fraction)]
+            stage.rows = len(pred.readToRead)
+
+            logging.info("Retrieve overlap lengths from ground truth.")
+            pred.OverlapLengthsInReference(gt, infer=True)
+            logging.debug(gt.cacheStats())
+
+            logging.info("Write QTSO info to {f}.".format(f=self.out_qtso))
+            pred.ToQTSO(self.out_qtso)
+        return (gtHist, len(queryReads.reads), len(targetReads.reads))
+
+    def _partitioner(self, partitions=None):
+        """Return an EvalPartitioner which has split inputs into
+        self.num_partitions partitions, of which partitions are written
+        to self.partition_dir."""
+        partitioner = EvalPartitioner(query_fasta=self.query_fasta,
+                target_fasta=self.target_fasta, reseq_m4=self.reseq_m4,
+                preassembly_m4=self.preassembly_m4,
+                out_dir=self.partition_dir,
+                numPartitions=self.num_partitions, partitions=partitions,
+                sampleFraction=self.sample_fraction)
+        with self.metrics.stage("eval.split_partitions"):
+            partitioner.run()
+        return partitioner
+
+    def _map_targets(self, partitioner):
+        """Map all target reads to reference using ground truth of target
+        ZMWs. Return (t, tIndex, numT)."""
+        logging.info("Find positions of target reads in coordinate of " +
+                     "reference genome.")
+        with self.metrics.stage("eval.map_targets") as stage:
+            targetGT = ReseqGroundTruth(partitioner.target_reseq_m4)
+            targetGT.searchOffsets = partitioner.searchOffsets(targetGT)
+            targetReads = PBIReadFastaHeadReader(self.target_fasta)
+            t = targetGT.MapPBISubreadsToReference(targetReads.reads)
+            tIndex = ReferenceIntervalIndex(t)
+            stage.rows = len(t)
+        return (t, tIndex, len(targetReads.reads))
+
+    def _eval_partition(self, partitioner, i, t, tIndex, out_qtso,
+                        out_gt_overlaps=None):
+        """Evaluate query reads and preassembly hits of partition i,
+        write QTSO of hits, with index of each hit in preassembly_m4 as
+        the 5th column, to out_qtso, and ground truth overlaps, each
+        prefixed with a sort key, to out_gt_overlaps if it is not None.
+        Return (gtHist, numQ) of partition i."""
+        logging.info("Evaluating partition {i} / {n}.".format(
+                     i=i, n=self.num_partitions))
+        with self.metrics.stage("eval.partition.{i}".format(i=i)) as stage:
+            gtHist, numQ = self._eval_partition_reads(partitioner, i, t,
+                    tIndex, out_qtso, out_gt_overlaps)
+            stage.rows = numQ
+        return (gtHist, numQ)
+
+    def _eval_partition_reads(self, partitioner, i, t, tIndex, out_qtso,
+                              out_gt_overlaps):
+        """See _eval_partition."""
+        gt = ReseqGroundTruth([partitioner.reseq_m4_of(i),
+                               partitioner.target_reseq_m4])
+        gt.searchOffsets = partitioner.searchOffsets(gt)
+
+        queryReads = PBIReadFastaHeadReader(partitioner.query_fasta_of(i))
+        q = gt.MapPBISubreadsToReference(queryReads.reads)
+        gtHist = ComputeOverlapLengthDistribution(q, t, tIndex,
+                                                  zmwHist=self.zmw_hist)
+
+        if (out_gt_overlaps is not None):
+            # Prefix ground truth overlaps of a query read with its
+            # position in q of all query reads, sorted by reference,
+            # start, -end, and then index in query_fasta.
+            queryIndices = dict(zip([id(r) for r in queryReads.reads],
+                    ReadIndices(partitioner.query_idx_of(i))))
+            prefixes = ["{r}\t{s}\t{e}\t{i}\t".format(r=ref, s=s, e=-e,
+                        i=queryIndices[id(read)]) for read, ref, s, e in q]
+            write_gt_overlaps(query=q, target=t, out_file=out_gt_overlaps,
+                              tIndex=tIndex, prefixes=prefixes)
+
+        pred = PreassemblyPrediction(partitioner.preassembly_m4_of(i))
         pred.OverlapLengthsInReference(gt, infer=True)
+        pred.ToQTSO(out_qtso,
+                    indices=ReadIndices(partitioner.preassembly_idx_of(i)))
+        return (gtHist, len(queryReads.reads))
+
+    def _run_out_of_core(self):
+        """Same as _run_in_memory, but split inputs into partitions by
+        ZMW on disk, and process one partition at a time, keeping only
+        ground truth and mapped positions of target reads in memory.
+        Return (gtHist, numQ, numT)."""
+        partitioner = self._partitioner()
+        t, tIndex, numT = self._map_targets(partitioner)
+
+        gtHist, numQ = OverlapHistogram(), 0
+        qtsoShards, gtShards = [], []
+        for i in range(self.num_partitions):
+            qtsoShards.append(op.join(self.partition_dir,
+                                      "out.qtso.{i}".format(i=i)))
+            gtShards.append(None if self.gt_overlaps_file is None else
+                            op.join(self.partition_dir,
+                                    "gt_overlaps.{i}".format(i=i)))
+            hist, n = self._eval_partition(partitioner, i, t, tIndex,
+                                           qtsoShards[i], gtShards[i])
+            gtHist.merge(hist, sameTargets=True)
+            numQ += n
+
+        with self.metrics.stage("eval.merge_shards"):
+            MergeShards(qtsoShards, self.out_qtso, gtShards,
+                        self.gt_overlaps_file)
+        shutil.rmtree(self.partition_dir)
+        return (gtHist, numQ, numT)
+
+    def _run_partition(self):
+        """Evaluate partition i of N (self.partition), and save a
+        mergeable PartialEvalResult to out_dir, see pbove_eval_merge."""
+        i, n = self.partition
+        partitioner = self._partitioner(partitions=[i])
+        t, tIndex, numT = self._map_targets(partitioner)
+
+        fn = lambda name: op.join(self.out_dir, "{name}.{i}_of_{n}".format(
+                                  name=name, i=i, n=n))
+        partial = PartialEvalResult(partition=i, numPartitions=n,
+                sampleFraction=self.sample_fraction, numT=numT,
+                hist=fn("gt_overlaps.hist") + ".npz",
+                scoreCounts=fn("score_counts") + ".npz", qtso=fn("out.qtso"),
+                gtOverlaps=None if self.gt_overlaps_file is None
+                           else fn("gt_overlaps"),
+                zmwHist=None if self.zmw_hist is None
+                        else fn("zmw_overlaps.hist") + ".npz")
+        gtHist, partial.numQ = self._eval_partition(partitioner, i, t,
+                tIndex, partial.qtso, partial.gtOverlaps)
+        gtHist.write(partial.hist)
+        if self.zmw_hist is not None:
+            self.zmw_hist.write(partial.zmwHist)
+
+        with self.metrics.stage("eval.score_counts"):
+            scoreCounts = QTSO.ScoreCounts()
+            scoreCounts.addQTSOFile(partial.qtso)
+            scoreCounts.write(partial.scoreCounts)
+
+        out_json = PartialEvalResult.fn(self.out_dir, i, n)
+        logging.info("Write partial result of partition {i}/{n} to {f}.".
+                     format(i=i, n=n, f=out_json))
+        partial.write(out_json)
+        shutil.rmtree(self.partition_dir)
+
+    def _write_results(self, gtHist, numQ, numT, scoreCounts=None):
+        """Write ground truth overlap length histogram, summaries, delta
+        tables and tables of all cutoffs, given gtHist and ScoreCounts
+        of QTSO, which is computed from out_qtso if None."""
+        with self.metrics.stage("eval.write_results"):
+            self._write_tables(gtHist, numQ, numT, scoreCounts)
+        if self.bootstrap is not None:
+            with self.metrics.stage("eval.bootstrap", rows=self.bootstrap):
+                self._write_bootstrap()
+
+    def _write_tables(self, gtHist, numQ, numT, scoreCounts):
+        """See _write_results."""
+        logging.info("Write ground truth overlap length histogram to {f}.".
+                     format(f=self.out_gt_hist))
+        gtHist.write(self.out_gt_hist)
+        gtNumbers = GetAllPosNegNumbersForCutoffs(gtHist, self.ovl_cut_offs)
+
+        self.summary.numQ = numQ
+        self.summary.numT = numT
+        for cutoff in reversed(self.ovl_cut_offs):
+            # self.summary ends up with numbers of the first cutoff
+            (self.summary.numGTPos, self.summary.numGTNeg,
+             self.summary.numGTWeak, self.summary.numUnmappableAlns,
+             self.summary.numMappableAlns, self.summary.numAlns) = \
+                    gtNumbers[cutoff]
+            with open(self.cutoff_fn(self.summary_f, cutoff), 'w') as writer:
+                writer.write(str(self.summary) + "\n")
+
+        # Delta tables only need numbers of QTSO records of each score
+        # and overlap length, QTSO records are not kept in memory.
+        if scoreCounts is None:
+            scoreCounts = QTSO.ScoreCounts()
+            scoreCounts.addQTSOFile(self.out_qtso)
+
+        logging.info("Write delta tables to {f}.".format(f=self.out_dtb))
+        deltaTables = scoreCounts.getDeltaTables(stepSize=100,
+                overlapLengthCutoffs=self.ovl_cut_offs,
+                outfiles=[self.cutoff_fn(self.out_dtb, cutoff)
+                          for cutoff in self.ovl_cut_offs])
+
+        rocMetrics = {}
+        for cutoff in self.ovl_cut_offs:
+            rocMetrics[cutoff] = QTSO.ROCMetrics()
+            out_tb = self.cutoff_fn(self.out_tb, cutoff)
+            logging.info("Write output to {f}.".format(f=out_tb))
+            (numGTPos, numGTNeg, numGTWeak, numUnmappableAlns,
+             numMappableAlns, numAlns) = gtNumbers[cutoff]
+            QTSO.WriteTable(numGTPos=numGTPos, numGTNeg=numGTNeg,
+                    numGTWeak=numGTWeak, numUnmappableAlns=numUnmappableAlns,
+                    numMappableAlns=numMappableAlns,
+                    numAlns=numAlns, outfile=out_tb,
+                    deltaTable=deltaTables[cutoff],
+                    metrics=rocMetrics[cutoff])
+            if self.sample_fraction is not None:
+                out_ci = self.cutoff_fn(self.out_ci, cutoff)
+                logging.info("Write confidence intervals to {f}.".
+                             format(f=out_ci))
+                QTSO.WriteConfidenceTable(numGTPos=numGTPos,
+                        numGTNeg=numGTNeg, numGTWeak=numGTWeak,
+                        numUnmappableAlns=numUnmappableAlns,
+                        numMappableAlns=numMappableAlns, numAlns=numAlns,
+                        deltaTable=deltaTables[cutoff],
+                        sampleFraction=self.sample_fraction, outfile=out_ci)
+
+        logging.info("Write summary metrics to {f}.".format(f=self.out_roc))
+        QTSO.WriteROCMetrics(rocMetrics, self.out_roc)
+
+    def _write_bootstrap(self):
+        """Write bootstrap confidence bands of all cutoffs."""
+        from pbove.Bootstrap import BootstrapROC
+        roc = BootstrapROC(self.zmw_hist, self.out_qtso, self.ovl_cut_offs)
+        bands = roc.run(numReplicates=self.bootstrap, nproc=self.nproc)
+        outfiles = [self.cutoff_fn(self.out_bootstrap, cutoff)
+                    for cutoff in self.ovl_cut_offs]
+        logging.info("Write bootstrap confidence bands to {f}.".
+                     format(f=", ".join(outfiles)))
+        roc.write(bands, outfiles)
+
+
+def MergeShards(qtsoShards, out_qtso, gtShards=None, gt_overlaps_file=None):
+    """Merge QTSO shards of partitions to out_qtso, in order of hits in
+    preassembly_m4, and ground truth overlaps shards of partitions to
+    gt_overlaps_file, if it is not None, in order of sorted query reads.
+    """
+    logging.info("Merge QTSO of partitions to {f}.".format(f=out_qtso))
+    merge_sorted_shards(qtsoShards, out_qtso, key_func=_qtso_shard_key)
+    if (gt_overlaps_file is not None):
+        logging.info("Merge ground truth overlap pairs to {f}".
+                     format(f=gt_overlaps_file))
+        merge_sorted_shards(gtShards, gt_overlaps_file,
+                            key_func=_gt_overlaps_shard_key,
+                            header="#query\ttarget\toverlap_len\n")
 
-        logging.info("Write QTSO info to {f}.".format(f=self.out_qtso))
-        pred.ToQTSO(self.out_qtso)
-
-        qtso = QTSO.QTSO(self.out_qtso)
 
-        logging.info("Write delta table to {f}.".format(f=self.out_dtb))
-        qtso.getDeltaTable(stepSize=100,
-                           outfile=self.out_dtb,
-                           overlapLengthCutoff=self.ovl_cut_off)
+def _qtso_shard_key(line):
+    """Return (index in preassembly_m4, QTSO record) of a line of a
+    QTSO shard, of which the 5th column is the index."""
+    record, index = line.rstrip("\n").rsplit("\t", 1)
+    return (int(index), record + "\n")
 
-        logging.info("Write output to {f}.".format(f=self.out_tb))
-        qtso.getTable(numGTPos=numGTPos, numGTNeg=numGTNeg,
-                numGTWeak=numGTWeak, numUnmappableAlns=numUnmappableAlns,
-                numMappableAlns=numMappableAlns,
-                numAlns=numAlns, outfile=self.out_tb)
 
+def _gt_overlaps_shard_key(line):
+    """Return ((ref, start, -end, query index), ground truth overlap)
+    of a line of a ground truth overlaps shard."""
+    ref, start, negEnd, index, overlap = line.split("\t", 4)
+    return ((ref, int(start), int(negEnd), int(index)), overlap)
 
 def set_parser(parser):
     """Set parser arguments."""
@@ -161,9 +559,10 @@ def set_parser(parser):
 
     parser.add_argument("out_tb", type=str, help="Output table results.")
 
-    parser.add_argument("--ovl_cut_off", type=int, default=200,
+    parser.add_argument("--ovl_cut_off", type=int, nargs="+", default=[200],
         help="Minimum number of overlapping base pairs to consider two " +
-             "reads as positive overlap.")
+             "reads as positive overlap. Multiple distinct cutoffs can be " +
+             "evaluated in one pass, e.g., --ovl_cut_off 200 500 1000.")
 
     parser.add_argument('-d', "--out_dir", dest="out_dir",
                         type=str, default="pbove_out", help="Output directory")
@@ -174,6 +573,36 @@ def set_parser(parser):
 
     parser.add_argument("--out_dtb", type=str, default=None,
         help="Delta results in a table.")
+
+    parser.add_argument("--max_mem", type=str, default=None,
+        help="Maximum memory to use, e.g., 4G. If inputs need more, " +
+             "split them by ZMW on disk and evaluate one partition at " +
+             "a time. Outputs are identical.")
+
+    parser.add_argument("--partition", type=str, default=None,
+        help="Only evaluate partition i of N (i/N, 0 <= i < N) of query " +
+             "ZMWs, and save a partial result to out_dir, which can be " +
+             "merged with partial results of other partitions by " +
+             "pbove_eval_merge.py.")
+
+    parser.add_argument("--sample_fraction", type=float, default=None,
+        help="Only evaluate query reads and preassembly hits of a " +
+             "deterministic hash-sampled fraction (0, 1] of query ZMWs, " +
+             "write estimated numbers of all query reads to summary, " +
+             "and sensitivity and FDR with 95%% confidence intervals to " +
+             "out_tb with suffix '.ci'.")
+
+    parser.add_argument("--bootstrap", type=int, default=None,
+        help="Number of bootstrap replicates, e.g., 1000, resampling " +
+             "query ZMWs, to compute 95%% confidence bands of sensitivity " +
+             "and FDR, written to out_tb with suffix '.bootstrap'.")
+
+    parser.add_argument("--nproc", type=int, default=1,
+        help="Number of processes to compute bootstrap replicates.")
+
+    parser.add_argument("--progress_interval", type=float, default=30,
+        help="Minimum seconds between two progress reports of a long " +
+             "loop, with items/s, ETA and memory. 0 to not report.")
     return parser
 
 
@@ -184,16 +613,19 @@ class DoEvalRunner(PBToolRunner):
                "evaluate sensitivity & sepcificity of overlap detection."
         PBToolRunner.__init__(self, desc)
         set_parser(self.parser)
+        add_profile_arguments(self.parser)
 
     def getVersion(self):
         """Get version string"""
         return get_version()
 
+    @profiled
     def run(self):
         """Run"""
         logging.info("Running {f} v{v}.".format(f=op.basename(__file__),
                                                 v=self.getVersion()))
         args = self.args
+        SetProgressInterval(args.progress_interval)
         try:
             obj = DoEval(query_fasta=args.query_fasta,
                          target_fasta=args.target_fasta,
@@ -203,7 +635,13 @@ class DoEvalRunner(PBToolRunner):
                          out_tb=args.out_tb,
                          out_qtso=args.out_qtso,
                          out_dtb=args.out_dtb,
-                         ovl_cut_off=args.ovl_cut_off)
+                         ovl_cut_off=args.ovl_cut_off,
+                         max_mem=args.max_mem,
+                         partition=None if args.partition is None else
+                                   ParsePartition(args.partition),
+                         sample_fraction=args.sample_fraction,
+                         bootstrap=args.bootstrap,
+                         nproc=args.nproc)
             obj.run()
         except ValueError as e:
             logging.error(str(e))
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+"""
+Merge partial results of pbove_eval.py --partition i/N of all N
+partitions, and write the same outputs as pbove_eval.py.
+"""
+import os.path as op
+from pbcore.util.ToolRunner import PBToolRunner
+from pbove.__init__ import get_version
+from pbove.utils.Profiling import add_profile_arguments, profiled
+from pbove.io.OverlapHistogramIO import OverlapHistogram, \
+        ZmwOverlapHistogram
+from pbove.Partition import PartialEvalResult
+from pbove.pbove_eval import DoEval, MergeShards
+import pbove.QTSO as QTSO
+import sys
+import logging
+
+
+class DoEvalMerge(DoEval):
+    """Merge partial results (PartialEvalResult json files) of all
+    partitions of pbove_eval, and write summaries, QTSO, delta tables
+    and tables of all cutoffs as DoEval does."""
+    def __init__(self, partial_jsons, out_dir, out_tb, out_qtso=None,
+                 out_dtb=None, ovl_cut_off=200, gt_overlaps_file=None,
+                 bootstrap=None, nproc=1):
+        DoEval.__init__(self, query_fasta=None, target_fasta=None,
+                        reseq_m4=None, preassembly_m4=None,
+                        out_dir=out_dir, out_tb=out_tb, out_qtso=out_qtso,
+                        out_dtb=out_dtb, ovl_cut_off=ovl_cut_off,
+                        gt_overlaps_file=gt_overlaps_file,
+                        bootstrap=bootstrap, nproc=nproc)
+        self.partials = self._check([PartialEvalResult.read(fn)
+                                     for fn in partial_jsons])
+        self.sample_fraction = self.partials[0].sampleFraction
+        self.summary.sampleFraction = self.sample_fraction
+        if self.bootstrap is not None and \
+           any([p.zmwHist is None for p in self.partials]):
+            raise ValueError("Bootstrap needs partial results computed " +
+                             "with --bootstrap.")
+
+    @staticmethod
+    def _check(partials):
+        """Return partials sorted by partition index, or raise ValueError
+        if every partition of N does not occur exactly once, or if they
+        have different sample fractions."""
+        if len(partials) == 0:
+            raise ValueError("No partial results to merge.")
+        n = partials[0].numPartitions
+        indices = sorted([p.partition for p in partials])
+        if any([p.numPartitions != n or
+                p.sampleFraction != partials[0].sampleFraction
+                for p in partials]) or indices != range(n):
+            raise ValueError("Partial results must have partitions " +
+                             "0/{n}, ..., {m}/{n} exactly once, and the " +
+                             "same sample fraction, got {i}.".
+                             format(n=n, m=n-1, i=indices))
+        return sorted(partials, key=lambda p: p.partition)
+
+    def run(self):
+        """Run"""
+        with self.metrics.stage("eval.merge_partials",
+                                rows=len(self.partials)):
+            gtHist, numQ = OverlapHistogram(), 0
+            scoreCounts = QTSO.ScoreCounts()
+            for partial in self.partials:
+                gtHist.merge(OverlapHistogram.read(partial.hist),
+                             sameTargets=True)
+                scoreCounts.merge(QTSO.ScoreCounts.read(partial.scoreCounts))
+                numQ += partial.numQ
+                if self.zmw_hist is not None:
+                    self.zmw_hist.merge(ZmwOverlapHistogram.read(
+                                        partial.zmwHist))
+        numT = self.partials[0].numT
+
+        gtShards = [p.gtOverlaps for p in self.partials]
+        if self.gt_overlaps_file is not None and None in gtShards:
+            raise ValueError("Ground truth overlaps are missing in some " +
+                             "partial results.")
+        with self.metrics.stage("eval.merge_shards"):
+            MergeShards([p.qtso for p in self.partials], self.out_qtso,
+                        gtShards, self.gt_overlaps_file)
+        self._write_results(gtHist, numQ, numT, scoreCounts=scoreCounts)
+
+
+def set_parser(parser):
+    """Set parser arguments."""
+    parser.add_argument("partial_jsons", type=str, nargs="+",
+        help="Partial results, e.g., partial.0_of_4.json, of all " +
+             "partitions, produced by pbove_eval.py --partition i/N.")
+
+    parser.add_argument("out_tb", type=str, help="Output table results.")
+
+    parser.add_argument("--ovl_cut_off", type=int, nargs="+", default=[200],
+        help="Minimum number of overlapping base pairs to consider two " +
+             "reads as positive overlap. Multiple distinct cutoffs can be " +
+             "evaluated in one pass, e.g., --ovl_cut_off 200 500 1000.")
+
+    parser.add_argument('-d', "--out_dir", dest="out_dir",
+                        type=str, default="pbove_out", help="Output directory")
+
+    parser.add_argument("--out_qtso", type=str, default=None,
+        help="Each line is a tab-delimited record of a query read, a " +
+             "target read, blasr score and ground truth overlap length.")
+
+    parser.add_argument("--out_dtb", type=str, default=None,
+        help="Delta results in a table.")
+
+    parser.add_argument("--bootstrap", type=int, default=None,
+        help="Number of bootstrap replicates, e.g., 1000, resampling " +
+             "query ZMWs, to compute 95%% confidence bands of sensitivity " +
+             "and FDR. Partial results must be computed with --bootstrap.")
+
+    parser.add_argument("--nproc", type=int, default=1,
+        help="Number of processes to compute bootstrap replicates.")
+    return parser
+
+
+class DoEvalMergeRunner(PBToolRunner):
+    """pbove eval merge runner"""
+    def __init__(self):
+        desc = "Merge partial results of pbove_eval.py --partition i/N " + \
+               "of all partitions."
+        PBToolRunner.__init__(self, desc)
+        set_parser(self.parser)
+        add_profile_arguments(self.parser)
+
+    def getVersion(self):
+        """Get version string"""
+        return get_version()
+
+    @profiled
+    def run(self):
+        """Run"""
+        logging.info("Running {f} v{v}.".format(f=op.basename(__file__),
+                                                v=self.getVersion()))
+        args = self.args
+        try:
+            obj = DoEvalMerge(partial_jsons=args.partial_jsons,
+                              out_dir=args.out_dir,
+                              out_tb=args.out_tb,
+                              out_qtso=args.out_qtso,
+                              out_dtb=args.out_dtb,
+                              ovl_cut_off=args.ovl_cut_off,
+                              bootstrap=args.bootstrap,
+                              nproc=args.nproc)
+            obj.run()
+        except ValueError as e:
+            logging.error(str(e))
+            return 1
+        return 0
+
+
+def main():
+    """Main function."""
+    runner = DoEvalMergeRunner()
+    return runner.start()
+
+if __name__ == "__main__":
+    sys.exit(main())
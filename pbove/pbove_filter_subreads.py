@@ -5,17 +5,31 @@
 import os
 import os.path as op
 import sys
+import time
+import signal
 import logging
 import shutil
+import subprocess
 from multiprocessing import Pool
 from pbove.__init__ import get_version
-from pbove.utils.Utils import realpath, mkdir, revcmp_fasta, cat_files
+from pbove.utils.Profiling import add_profile_arguments, profiled
+from pbove.utils.Utils import realpath, mkdir, read_fasta, write_fasta, \
+        link_or_copy, FASTA_BUFFER_SIZE
 from pbove.io.SDPReader import SDPReader
 from pbove.io.FastaSplitter import FastaSplitter
+from pbove.utils.Metrics import StageMetrics
+from pbove.utils.Progress import Progress
 from pbcore.util.ToolRunner import PBToolRunner
-from pbcore.io import FastaReader, FastaWriter
 from pbcore.util.Process import backticks
 
+# Number of splits of reads per process aligning reads to their reverse
+# complements. Processes pull small splits as they become idle, so that
+# they finish at about the same time.
+SPLITS_PER_PROCESS = 8
+
+# sdpMatcher process of a worker, killed if the worker is terminated.
+_SDP_PROCESS = None
+
 
 class FilterSubreads(object):
     """pbove filter subreads."""
@@ -35,6 +49,12 @@ class FilterSubreads(object):
                                    "filtered_regions.fofn")
         self.nproc = int(nproc)
         self.palindrome_score_cutoff = int(palindrome_score_cutoff)
+        self.metrics = StageMetrics(op.join(self.out_dir, "metrics.json"))
+        # Wall seconds of sdpMatcher of each split, by split fasta.
+        self.split_seconds = {}
+        # Number of reads in all_reads_fasta, set by _split_palindrome,
+        # which reads all of them anyway.
+        self.num_reads = None
 
     def _filter_subreads(self):
         """Filter subreads from input_fofn using pls2fasta, and create
@@ -70,21 +90,19 @@ class FilterSubreads(object):
                 raise RuntimeError("CMD failed. " + str(_o) + ' ' + str(_m))
             logging.info("{f} created.".format(f=self.ori_all_reads_fasta))
 
-        logging.debug("Copying {ori_f} to {f}.".format(
+        # all_reads_fasta is only replaced (e.g., by _split_palindrome),
+        # never rewritten in place, so a hard link of the original reads
+        # saves a copy of the largest file of the pipeline.
+        logging.debug("Linking {ori_f} to {f}.".format(
             ori_f=self.ori_all_reads_fasta, f=self.all_reads_fasta))
-        shutil.copyfile(self.ori_all_reads_fasta, self.all_reads_fasta)
+        link_or_copy(self.ori_all_reads_fasta, self.all_reads_fasta)
 
     @property
-    def rc_all_reads_fasta(self):
-        """Return a fasta file containing the reverse complement sequence of
-        each read in self.all_reads_fasta."""
-        return op.join(self.out_dir, "rc_all_reads.fasta")
-
-    @property
-    def sdp_out_file(self):
-        """Return output file of sdpMatcher aligning all_reads_fasta to
-        rc_all_reads_fasta."""
-        return op.join(self.out_dir, "read_to_rc_read.sdp")
+    def palindrome_names_file(self):
+        """Return names of palindrome reads, i.e., reads of which
+        sdpMatcher hits to their reverse complements score at most
+        palindrome_score_cutoff, one per line after a header line."""
+        return op.join(self.out_dir, "palindrome_reads.txt")
 
     @property
     def tmp_all_reads_fasta(self):
@@ -103,64 +121,90 @@ class FilterSubreads(object):
 
     def _self_align(self):
         """Call SDPMatcher to align every read to its reverse
-        complementary reads."""
+        complementary reads. Return names of palindrome reads."""
         logging.info("Splitting palindrome.")
-        logging.debug("Making reverse complement sequences of reads in " +
-                      "{i} to {o}".format(i=self.ori_all_reads_fasta,
-                                          o=self.rc_all_reads_fasta))
-        num_reads = revcmp_fasta(self.ori_all_reads_fasta,
-                                 self.rc_all_reads_fasta)
-
-        reads_per_split = max(1, int(num_reads/self.nproc) + 1)
-        logging.debug("Splitting {f} to small files each containing {n} reads.".
-                      format(f=self.ori_all_reads_fasta, n=reads_per_split))
+        # Size of the fasta file is an upper bound of number of bases, so
+        # that there are at most nproc * SPLITS_PER_PROCESS splits of
+        # similar bases.
+        bases_per_split = max(1, int(op.getsize(self.ori_all_reads_fasta) /
+                                     (self.nproc * SPLITS_PER_PROCESS)) + 1)
+        logging.debug("Splitting {f} and its reverse complement to small " \
+                      "files each containing {n} bases.".format(
+                      f=self.ori_all_reads_fasta, n=bases_per_split))
         fs = FastaSplitter(input_fasta=self.ori_all_reads_fasta,
-                           reads_per_split=reads_per_split,
+                           reads_per_split=None,
+                           bases_per_split=bases_per_split,
                            out_dir=self.out_dir,
-                           out_prefix="reads.split.")
+                           out_prefix="reads.split.",
+                           rc_out_prefix="rc_reads.split.")
         fs.split()
-        sp_fasta_files = fs.out_fns
-
-        logging.debug("Splitting {f} to smaller files.".
-                      format(f=self.rc_all_reads_fasta))
-        rc_fs = FastaSplitter(input_fasta=self.rc_all_reads_fasta,
-                              reads_per_split=reads_per_split,
-                              out_dir=self.out_dir,
-                              out_prefix="rc_reads.split.")
-        rc_fs.split()
-        rc_sp_fasta_files = rc_fs.out_fns
+        sp_fasta_files, rc_sp_fasta_files = fs.out_fns, fs.rc_out_fns
 
         logging.debug("Aligning each read in {i} to its revese compelement " +
                       "read using sdpMatcher.".format(i=self.ori_all_reads_fasta))
 
-        sdps = ["{f}.sdp".format(f=f) for f in sp_fasta_files]
         jobs = []
-        for f, rc_f, sdp in zip(sp_fasta_files, rc_sp_fasta_files, sdps):
-            cmd = "sdpMatcher {f} {rc_f} ".format(f=f, rc_f=rc_f) + \
-                  "10 -local > {sdp} ".format(sdp=sdp)
-            logging.debug("CMD: {cmd}".format(cmd=cmd))
-            jobs.append(cmd)
-
-        pool = Pool(processes=self.nproc)
-        rets = pool.map(backticks, jobs)
-        pool.close()
-        pool.join()
-
-        for i, job in enumerate(jobs):
-            if rets[i][1] != 0:
-                errMsg = "Job {j} failed.".format(j=job) + str(rets[i][2])
-                raise RuntimeError(errMsg)
-
-        logging.debug("Concatenating all sdp outputs to {f}".
-                      format(f=self.sdp_out_file))
-        cat_files(src=sdps, dst=self.sdp_out_file)
-
-        logging.debug("Cleaning intermediate fasta & sdp files.")
+        for f, rc_f in zip(sp_fasta_files, rc_sp_fasta_files):
+            jobs.append((f, rc_f, "{f}.sdp".format(f=f),
+                         self.palindrome_score_cutoff))
+
+        # Palindromes of every split are collected as soon as its
+        # sdpMatcher job completes, without concatenating sdp files.
+        # Each process pulls one split at a time.
+        palindromes = set()
+        self.split_seconds = {}
+        progress = Progress("Aligning splits to reverse complements",
+                            len(jobs))
+        pool = Pool(processes=self.nproc, initializer=_init_worker)
+        try:
+            for f, cmd, code, msg, names, seconds in \
+                    pool.imap_unordered(_detect_palindromes, jobs,
+                                        chunksize=1):
+                logging.debug("CMD: {cmd} took {s:.1f}s.".format(
+                              cmd=cmd, s=seconds))
+                if code != 0:
+                    raise RuntimeError("Job {j} failed.".format(j=cmd) +
+                                       str(msg))
+                palindromes.update(names)
+                self.split_seconds[op.basename(f)] = seconds
+                progress.update()
+        except BaseException:
+            # Fail early, cancelling jobs queued or running.
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+        progress.done()
+        logging.info("sdpMatcher of {n} splits took {m:.1f}s at most, " \
+                     "{t:.1f}s in total.".format(n=len(jobs),
+                     m=max(self.split_seconds.values() or [0]),
+                     t=sum(self.split_seconds.values())))
+
+        logging.debug("Writing {n} palindrome reads to {f}".format(
+                      n=len(palindromes), f=self.palindrome_names_file))
+        tmp_fn = self.palindrome_names_file + ".tmp"
+        with open(tmp_fn, 'w') as writer:
+            writer.write("#palindrome_score_cutoff={c}\n".format(
+                         c=self.palindrome_score_cutoff))
+            for name in sorted(palindromes):
+                writer.write(name + "\n")
+        os.rename(tmp_fn, self.palindrome_names_file)
+
+        logging.debug("Cleaning intermediate fasta files.")
         fs.rmOutFNs()
-        rc_fs.rmOutFNs()
-
-        for f in sdps:
-            os.remove(f)
+        return palindromes
+
+    def _read_palindrome_names(self):
+        """Return names of palindrome reads in palindrome_names_file, or
+        None if it was computed with a different score cutoff."""
+        with open(self.palindrome_names_file, 'r') as reader:
+            header = reader.readline().rstrip("\n")
+            if header != "#palindrome_score_cutoff={c}".format(
+                    c=self.palindrome_score_cutoff):
+                return None
+            return set([line.rstrip("\n") for line in reader])
 
     def _split_palindrome(self):
         """There exist some chimeric reads in which adapters are either missing
@@ -174,27 +218,30 @@ class FilterSubreads(object):
         range.
         The side effect of this process is that true plindrome reads will be
         cut short.
+        Return number of reads processed, and set num_reads to number of
+        reads kept in all_reads_fasta.
         """
-        if not op.exists(self.sdp_out_file) or self.force_redo is True:
-            self._self_align()
-
-        logging.debug("Parsing sdp and detect plindrome reads")
-        split_table = {}
-        with SDPReader(self.sdp_out_file) as reader:
-            for sdp in reader:
-                if sdp.score <= self.palindrome_score_cutoff:
-                    split_table[str(sdp.qID)] = sdp
+        palindromes = None
+        if op.exists(self.palindrome_names_file) and \
+           self.force_redo is not True:
+            logging.debug("Reading palindrome reads from {f}".format(
+                          f=self.palindrome_names_file))
+            palindromes = self._read_palindrome_names()
+        if palindromes is None:
+            palindromes = self._self_align()
 
         logging.debug("Splitting palindrom reads.")
-        with FastaReader(self.ori_all_reads_fasta) as reader, \
-             FastaWriter(self.tmp_all_reads_fasta) as writer, \
-             FastaWriter(self.palindrome_reads_fasta) as palindrome_writer:
-            for r in reader:
-                if r.name in split_table:
+        num_reads, num_kept = 0, 0
+        with open(self.tmp_all_reads_fasta, 'w',
+                  FASTA_BUFFER_SIZE) as writer, \
+             open(self.palindrome_reads_fasta, 'w',
+                  FASTA_BUFFER_SIZE) as palindrome_writer:
+            for name, seq in read_fasta(self.ori_all_reads_fasta):
+                num_reads += 1
+                if name in palindromes:
                     # found a palindrome
-                    sdp = split_table[r.name]
                     # Write palindrome subreads to palindrome_subreads.fasta
-                    palindrome_writer.writeRecord(r.name, r.sequence)
+                    write_fasta(palindrome_writer, name, seq)
 #
 #                    # split this read in the middle
 #                    split_point = int(sdp.qstart +
@@ -213,18 +260,67 @@ class FilterSubreads(object):
 #                    writer.writeRecord(rname_2,
 #                                       r.sequence[(split_point-sdp.qstart):])
                 else:
-                    writer.writeRecord(r.name, r.sequence)
+                    write_fasta(writer, name, seq)
+                    num_kept += 1
 
         logging.debug("Moving {i} to {o}.".format(i=self.tmp_all_reads_fasta,
                                                   o=self.all_reads_fasta))
         shutil.move(self.tmp_all_reads_fasta, self.all_reads_fasta)
+        self.num_reads = num_kept
+        return num_reads
 
     def run(self):
         """Run"""
-        self._filter_subreads()
+        # Reads are not counted here, which would take another pass over
+        # the largest file of the pipeline.
+        with self.metrics.stage("filter.filter_subreads"):
+            self._filter_subreads()
 
         if self.split_palindrome:
-            self._split_palindrome()
+            with self.metrics.stage("filter.split_palindrome") as stage:
+                stage.rows = self._split_palindrome()
+                if len(self.split_seconds) > 0:
+                    stage.extra["sdpMatcherSeconds"] = self.split_seconds
+
+
+def _init_worker():
+    """Kill sdpMatcher of a worker process when the worker is
+    terminated, e.g., after another job failed."""
+    def _terminate(_signum, _frame):
+        """Kill sdpMatcher and exit."""
+        if _SDP_PROCESS is not None and _SDP_PROCESS.poll() is None:
+            _SDP_PROCESS.kill()
+        os._exit(1)
+    signal.signal(signal.SIGTERM, _terminate)
+
+
+def _detect_palindromes(job):
+    """Align reads in a split to their reverse complements by sdpMatcher,
+    given a job of (split fasta, reverse complement split fasta, sdp
+    output, score cutoff). Return (split fasta, cmd, exit code, error
+    message, names of reads of hits scoring at most the cutoff, wall
+    seconds), and remove the sdp output, so that only names are sent
+    back to the parent process."""
+    global _SDP_PROCESS
+    f, rc_f, sdp, score_cutoff = job
+    cmd = "sdpMatcher {f} {rc_f} ".format(f=f, rc_f=rc_f) + \
+          "10 -local > {sdp} ".format(sdp=sdp)
+    start = time.time()
+    # exec, so that killing the shell kills sdpMatcher.
+    _SDP_PROCESS = subprocess.Popen("exec " + cmd, shell=True,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT)
+    _o, _c = _SDP_PROCESS.communicate()[0], _SDP_PROCESS.returncode
+    _SDP_PROCESS = None
+    if _c != 0:
+        return (f, cmd, _c, _o, None, time.time() - start)
+    names = set()
+    with SDPReader(sdp) as reader:
+        for r in reader:
+            if r.score <= score_cutoff:
+                names.add(str(r.qID))
+    os.remove(sdp)
+    return (f, cmd, 0, None, list(names), time.time() - start)
 
 
 def set_parser(parser):
@@ -258,11 +354,13 @@ class FilterSubreadsRunner(PBToolRunner):
         desc = "Filter subreads from movies."
         PBToolRunner.__init__(self, desc)
         set_parser(self.parser)
+        add_profile_arguments(self.parser)
 
     def getVersion(self):
         """Get version string"""
         return get_version()
 
+    @profiled
     def run(self):
         """Run"""
         logging.info("Running {f} v{v}.".format(f=op.basename(__file__),
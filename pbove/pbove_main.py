@@ -12,15 +12,19 @@
 import os.path as op
 import sys
 import logging
-from pbcore.io import FastaReader
 from pbcore.util.ToolRunner import PBToolRunner
 from pbove.__init__ import get_version
-from pbove.utils.Utils import realpath, mkdir
-from pbove.pbove_filter_subreads import FilterSubreads
-from pbove.pbove_reseq import DoReseq
-from pbove.pbove_preassembly import DoPreassembly
-from pbove.pbove_eval import DoEval
-from pbalign.utils.fileutil import checkReferencePath
+from pbove.utils.Profiling import add_profile_arguments, profiled
+from pbove.utils.Utils import realpath, mkdir, run_in_threads, \
+        to_cutoff_list
+from pbove.utils.StageManifest import StageManifest, tool_version
+from pbove.utils.Metrics import StageMetrics
+from pbove.utils.Progress import SetProgressInterval
+
+# Stages, pbcore.io and pbalign are imported where they are used, so that
+# importing this module (e.g., for add_params_to_parser) and --help are
+# fast.
+
 
 class Pbove(object):
     """Class of pbove."""
@@ -28,10 +32,12 @@ class Pbove(object):
                  reseq_blasr_opts, preassembly_blasr_opts,
                  force_redo, min_seed_len, split_palindrome,
                  ovl_cut_off, palindrome_score_cutoff,
-                 gt_overlaps_file):
+                 gt_overlaps_file, resume=False, nproc=12,
+                 shared_all_reads_fasta=None, shared_reseq_m4=None):
         print gt_overlaps_file
         self.input_fofn = realpath(input_fofn)
 
+        from pbalign.utils.fileutil import checkReferencePath
         self.ref = ref
         self.ref_path, self.ref_fasta, self.ref_sa, self.in_refrepo, \
         _gff = checkReferencePath(self.ref)
@@ -44,13 +50,40 @@ class Pbove(object):
         self.force_redo = force_redo
         self.min_seed_len = min_seed_len
         self.split_palindrome = split_palindrome
-        self.ovl_cut_off = int(ovl_cut_off)
+        self.ovl_cut_off = to_cutoff_list(ovl_cut_off)
         self.palindrome_score_cutoff = int(palindrome_score_cutoff)
         self.gt_overlaps_file = realpath(gt_overlaps_file)
+        self.resume = resume
+        self.nproc = max(2, int(nproc))
+        # Names of stages which have been recomputed in resume mode,
+        # all stages downstream of them will be recomputed as well.
+        self._recomputed = set()
+        # Ground truth, loaded as soon as resequencing completes if eval
+        # is going to run, otherwise when eval runs.
+        self._gt = None
+        # Wall time, CPU time and peak memory of stages.
+        self.metrics = StageMetrics(op.join(self.out_dir, "metrics.json"))
+        # Filtered subreads and resequencing output shared with other
+        # runs of the same movies. If both are given, filtering and
+        # resequencing are not done in this run.
+        self.shared_all_reads_fasta = realpath(shared_all_reads_fasta)
+        self.shared_reseq_m4 = realpath(shared_reseq_m4)
+        if (self.shared_all_reads_fasta is None) != \
+           (self.shared_reseq_m4 is None):
+            raise ValueError("Shared all reads fasta and shared reseq m4 " +
+                             "must be specified together.")
+
+    @property
+    def use_shared_reseq(self):
+        """Return True if filtered subreads and resequencing output
+        are shared with other runs."""
+        return self.shared_reseq_m4 is not None
 
     @property
     def reseq_m4(self):
         """Return resequencing m4 output."""
+        if self.use_shared_reseq:
+            return self.shared_reseq_m4
         return op.join(self.out_dir, "reseq_out.m4")
 
     @property
@@ -61,6 +94,8 @@ class Pbove(object):
     @property
     def all_reads_fasta(self):
         """Return all reads extracted from input.fofn."""
+        if self.use_shared_reseq:
+            return self.shared_all_reads_fasta
         return op.join(self.out_dir, "all_reads.fasta")
 
     @property
@@ -71,58 +106,253 @@ class Pbove(object):
     @property
     def ref_sz(self):
         """Return number of bases in reference."""
+        from pbcore.io import FastaReader
         with FastaReader(self.ref_fasta) as reader:
             sz = 0
             for r in reader:
                 sz += len(r.sequence)
         return sz
 
+    @property
+    def manifest_dir(self):
+        """Return directory of stage manifests."""
+        return op.join(self.out_dir, "manifests")
+
+    def _manifest(self, name, inputs=(), params=None, versions=None,
+                  outputs=()):
+        """Create a manifest of stage `name`."""
+        manifest = StageManifest(name=name, manifest_dir=self.manifest_dir)
+        for fn in inputs:
+            manifest.add_input(fn)
+        for key, value in (params or {}).iteritems():
+            manifest.add_param(key, value)
+        manifest.add_version("pbove", get_version())
+        for tool, version in (versions or {}).iteritems():
+            manifest.add_version(tool, version)
+        for fn in outputs:
+            manifest.add_output(fn)
+        return manifest
+
+    @property
+    def reseq_nproc(self):
+        """Return number of threads for resequencing, which runs
+        concurrently with preassembly."""
+        return self.nproc / 2
+
+    @property
+    def preassembly_nproc(self):
+        """Return number of threads for preassembly."""
+        return self.nproc - self.reseq_nproc
+
+    def _run_stage(self, manifest, stage_func, upstream=()):
+        """Run a stage by calling stage_func(force_redo), which returns
+        number of rows (e.g., reads or alignments) the stage produces.
+
+        In resume mode, a stage is skipped if its saved manifest matches
+        its current inputs, parameters and tool versions, and none of
+        its upstream stages has been recomputed; otherwise the stage is
+        recomputed, and so are all stages downstream of it.
+        Otherwise, each stage decides whether or not to skip by itself
+        (i.e., whether or not its outputs exist), as before, and the
+        manifest is saved whenever the stage rewrites its outputs, so
+        that a later resume never trusts outputs of other parameters.
+        """
+        if self.resume and not self.force_redo:
+            if len(self._recomputed.intersection(upstream)) == 0 and \
+               manifest.is_up_to_date():
+                logging.info("Stage {s} is up to date, skipped.".
+                             format(s=manifest.name))
+                return
+            logging.info("Stage {s} is invalidated, recomputing.".
+                         format(s=manifest.name))
+            self._recomputed.add(manifest.name)
+            with self.metrics.stage("pbove." + manifest.name) as stage:
+                stage.rows = stage_func(True)
+            manifest.save()
+        else:
+            signatures = manifest.output_signatures()
+            with self.metrics.stage("pbove." + manifest.name) as stage:
+                stage.rows = stage_func(self.force_redo)
+            if self.force_redo or not manifest.exists() or \
+               manifest.output_signatures() != signatures:
+                manifest.save()
+            elif not manifest.is_up_to_date():
+                logging.warn("Outputs of stage {s} were created with ".
+                             format(s=manifest.name) +
+                             "different inputs, parameters or tools, " +
+                             "use --resume to recompute stale stages.")
+
+    def _filter_stage(self):
+        """Filter subreads from movies to all_reads_fasta."""
+        def stage_func(force_redo):
+            """Run FilterSubreads, return number of reads."""
+            from pbove.pbove_filter_subreads import FilterSubreads
+            obj = FilterSubreads(input_fofn=self.input_fofn,
+                                 all_reads_fasta=self.all_reads_fasta,
+                                 out_dir=self.out_dir,
+                                 force_redo=force_redo,
+                                 split_palindrome=self.split_palindrome,
+                                 nproc=self.nproc,
+                                 palindrome_score_cutoff=
+                                 self.palindrome_score_cutoff)
+            obj.run()
+            return obj.num_reads
+
+        manifest = self._manifest(name="filter",
+            params={"split_palindrome": self.split_palindrome,
+                    "palindrome_score_cutoff":
+                    self.palindrome_score_cutoff},
+            outputs=[self.all_reads_fasta])
+        manifest.add_fofn(self.input_fofn)
+        self._run_stage(manifest, stage_func)
+
+    def _reseq_stage(self):
+        """Align all reads to reference to get ground truth."""
+        def stage_func(force_redo):
+            """Run DoReseq, return number of alignments."""
+            from pbove.pbove_reseq import DoReseq
+            obj = DoReseq(input_reads=self.all_reads_fasta,
+                          ref=self.ref,
+                          out_m4=self.reseq_m4,
+                          blasr_opts=self.reseq_blasr_opts,
+                          force_redo=force_redo,
+                          nproc=self.reseq_nproc)
+            obj.run()
+            return obj.num_hits
+
+        manifest = self._manifest(name="reseq",
+            inputs=[self.all_reads_fasta, self.ref_fasta],
+            params={"reseq_blasr_opts": self.reseq_blasr_opts},
+            versions={"blasr": tool_version("blasr")},
+            outputs=[self.reseq_m4])
+        self._run_stage(manifest, stage_func, upstream=("filter",))
+
+    def _preassembly(self, force_redo):
+        """Return a DoPreassembly object."""
+        from pbove.pbove_preassembly import DoPreassembly
+        return DoPreassembly(all_reads_fasta=self.all_reads_fasta,
+                             seed_reads_fasta=self.seed_reads_fasta,
+                             out_m4=self.preassembly_m4,
+                             ref_sz=self.ref_sz,
+                             out_dir=self.out_dir,
+                             min_seed_len=self.min_seed_len,
+                             blasr_opts=self.preassembly_blasr_opts,
+                             force_redo=force_redo,
+                             nproc=self.preassembly_nproc)
+
+    def _seed_stage(self):
+        """Select seed reads from all reads."""
+        def stage_func(force_redo):
+            """Create seed reads, return number of seed reads."""
+            obj = self._preassembly(force_redo)
+            obj.create_seed_reads_fasta()
+            return obj.num_seed_reads
+
+        manifest = self._manifest(name="seed",
+            inputs=[self.all_reads_fasta, self.ref_fasta],
+            params={"min_seed_len": self.min_seed_len},
+            outputs=[self.seed_reads_fasta])
+        self._run_stage(manifest, stage_func, upstream=("filter",))
+
+    def _preassembly_stage(self):
+        """Align all reads to seed reads."""
+        def stage_func(force_redo):
+            """Align all reads to seed reads, return number of
+            alignments."""
+            obj = self._preassembly(force_redo)
+            obj.align()
+            return obj.num_hits
+
+        manifest = self._manifest(name="preassembly",
+            inputs=[self.all_reads_fasta, self.seed_reads_fasta],
+            params={"preassembly_blasr_opts": self.preassembly_blasr_opts},
+            versions={"blasr": tool_version("blasr")},
+            outputs=[self.preassembly_m4])
+        self._run_stage(manifest, stage_func, upstream=("filter", "seed"))
+
+    def _eval_stage(self):
+        """Evaluate overlap detection of preassembly."""
+        def stage_func(_force_redo):
+            """Run DoEval, return number of query reads."""
+            from pbove.pbove_eval import DoEval
+            obj = DoEval(query_fasta=self.all_reads_fasta,
+                         target_fasta=self.seed_reads_fasta,
+                         reseq_m4=self.reseq_m4,
+                         preassembly_m4=self.preassembly_m4,
+                         out_dir=self.out_dir,
+                         out_tb=self.out_tb,
+                         ovl_cut_off=self.ovl_cut_off,
+                         gt_overlaps_file=self.gt_overlaps_file,
+                         gt=self._load_ground_truth())
+            obj.run()
+            return obj.summary.numQ
+
+        outputs = [self.out_tb]
+        if self.gt_overlaps_file is not None:
+            outputs.append(self.gt_overlaps_file)
+        manifest = self._manifest(name="eval",
+            inputs=[self.all_reads_fasta, self.seed_reads_fasta,
+                    self.reseq_m4, self.preassembly_m4],
+            params={"ovl_cut_off": self.ovl_cut_off,
+                    "gt_overlaps_file": self.gt_overlaps_file},
+            outputs=outputs)
+        self._run_stage(manifest, stage_func,
+                        upstream=("filter", "reseq", "seed", "preassembly"))
+
+    def _load_ground_truth(self):
+        """Load ground truth from reseq_m4 unless it has been loaded,
+        and return it."""
+        if self._gt is None:
+            logging.info("Loading ground truth from {f}.".format(
+                         f=self.reseq_m4))
+            from pbove.Reseq import ReseqGroundTruth
+            with self.metrics.stage("pbove.load_ground_truth") as stage:
+                self._gt = ReseqGroundTruth(self.reseq_m4)
+                stage.rows = len(self._gt.readToReference)
+        return self._gt
+
+    def _reseq_branch(self):
+        """Do resequencing, and then load ground truth for eval while
+        preassembly is still running, if eval is going to run.
+        In resume mode, eval may be skipped unless filter or reseq has
+        been recomputed, in which case ground truth, which may take GBs
+        of memory, is only loaded if eval runs."""
+        if self.use_shared_reseq:
+            logging.info("Using shared resequencing output {f}.".
+                         format(f=self.reseq_m4))
+        else:
+            logging.info("resequencing started.")
+            self._reseq_stage()
+        if not self.resume or self.force_redo or \
+           len(self._recomputed.intersection(("filter", "reseq"))) > 0:
+            self._load_ground_truth()
+        logging.info("resequencing completed.")
+
+    def _preassembly_branch(self):
+        """Select seed reads and align all reads to seed reads."""
+        logging.info("preassembly started.")
+        self._seed_stage()
+        self._preassembly_stage()
+        logging.info("preassembly completed.")
+
     def run(self):
         """Run"""
 
         logging.info("pbove started.")
-        logging.info("Filter subreads from movies.")
-
-        fsubreads = FilterSubreads(input_fofn=self.input_fofn,
-                                   all_reads_fasta=self.all_reads_fasta,
-                                   out_dir=self.out_dir,
-                                   split_palindrome=self.split_palindrome,
-                                   nproc=12,
-                                   palindrome_score_cutoff=
-                                   self.palindrome_score_cutoff)
-        fsubreads.run()
-
-        logging.info("resequencing started.")
-        reseq = DoReseq(input_reads=self.all_reads_fasta,
-                        ref=self.ref,
-                        out_m4=self.reseq_m4,
-                        blasr_opts=self.reseq_blasr_opts,
-                        force_redo=self.force_redo)
-        reseq.run()
+        with self.metrics.stage("pbove"):
+            if self.use_shared_reseq:
+                logging.info("Using shared filtered subreads {f}.".
+                             format(f=self.all_reads_fasta))
+            else:
+                logging.info("Filter subreads from movies.")
+                self._filter_stage()
 
-        logging.info("preassembly started.")
-        preassembly = DoPreassembly(all_reads_fasta=self.all_reads_fasta,
-                                    seed_reads_fasta=self.seed_reads_fasta,
-                                    out_m4=self.preassembly_m4,
-                                    ref_sz=self.ref_sz,
-                                    out_dir=self.out_dir,
-                                    min_seed_len=self.min_seed_len,
-                                    blasr_opts=self.preassembly_blasr_opts,
-                                    force_redo=self.force_redo)
-
-        preassembly.run()
-
-        logging.info("eval started.")
-        evl = DoEval(query_fasta=self.all_reads_fasta,
-                     target_fasta=self.seed_reads_fasta,
-                     reseq_m4=self.reseq_m4,
-                     preassembly_m4=self.preassembly_m4,
-                     out_dir=self.out_dir,
-                     out_tb=self.out_tb,
-                     ovl_cut_off=self.ovl_cut_off,
-                     gt_overlaps_file=self.gt_overlaps_file)
-
-        evl.run()
+            # Resequencing and preassembly only share all_reads_fasta,
+            # which is read-only from now on, so run them concurrently.
+            run_in_threads([self._reseq_branch, self._preassembly_branch])
+
+            logging.info("eval started.")
+            self._eval_stage()
 
         logging.info("pbove completed.")
 
@@ -149,12 +379,19 @@ def add_params_to_parser(parser):
     helpstr = "Force to recompute even if outupt files exist."
     parser.add_argument("--force_redo", action="store_true", help=helpstr)
 
+    helpstr = "Skip stages whose inputs, parameters and tool versions " + \
+              "match their saved manifests, and recompute from the " + \
+              "first invalidated stage."
+    parser.add_argument("--resume", action="store_true", help=helpstr)
+
     helpstr = "Minimum seed read length"
     parser.add_argument("--min_seed_len", type=int, default=6000, help=helpstr)
 
-    parser.add_argument("--ovl_cut_off", type=int, default=200,
+    parser.add_argument("--ovl_cut_off", type=int, nargs="+", default=[200],
                         help="Minimum number of overlapping base pairs to " +
-                             "consider two reads as positive overlap.")
+                             "consider two reads as positive overlap. " +
+                             "Multiple distinct cutoffs can be evaluated " +
+                             "in one pass.")
 
     parser.add_argument("--split_palindrome", default=False,
                         action='store_true',
@@ -180,10 +417,30 @@ def set_parser(parser):
     parser.add_argument('-d', "--out_dir", dest="out_dir",
                         type=str, default="pbove_out", help="Output directory.")
 
+    parser.add_argument("--nproc", type=int, default=12,
+                        help="Number of threads, which are split between " +
+                             "resequencing and preassembly running " +
+                             "concurrently.")
+
+    parser.add_argument("--shared_all_reads_fasta", type=str, default=None,
+                        help="Filtered subreads shared with other runs " +
+                             "of the same movies. Must be used together " +
+                             "with --shared_reseq_m4, and then filtering " +
+                             "and resequencing are skipped.")
+
+    parser.add_argument("--shared_reseq_m4", type=str, default=None,
+                        help="Resequencing output of shared filtered " +
+                             "subreads.")
+
     parser.add_argument('-g', "--ground_truth_overlaps_file",
                         dest="gt_overlaps_file", type=str, default=None,
                         help="Print out ground truth overlap pairs to file.")
 
+    parser.add_argument("--progress_interval", type=float, default=30,
+                        help="Minimum seconds between two progress " +
+                             "reports of a long loop, with items/s, ETA " +
+                             "and memory. 0 to not report.")
+
     return add_params_to_parser(parser)
 
 
@@ -193,16 +450,19 @@ class PboveRunner(PBToolRunner):
         desc = "Pbove to evaluate overlap sensitivity & sepcificity & so on."
         PBToolRunner.__init__(self, desc)
         set_parser(self.parser)
+        add_profile_arguments(self.parser)
 
     def getVersion(self):
         """Get version string"""
         return get_version()
 
+    @profiled
     def run(self):
         """Run"""
         logging.info("Running {f} v{v}.".format(f=op.basename(__file__),
                                                 v=self.getVersion()))
         args = self.args
+        SetProgressInterval(args.progress_interval)
         try:
             obj = Pbove(input_fofn=args.input_fofn,
                         ref=args.ref,
@@ -215,7 +475,11 @@ class PboveRunner(PBToolRunner):
                         split_palindrome=args.split_palindrome,
                         ovl_cut_off=args.ovl_cut_off,
                         palindrome_score_cutoff=args.palindrome_score_cutoff,
-                        gt_overlaps_file=args.gt_overlaps_file)
+                        gt_overlaps_file=args.gt_overlaps_file,
+                        resume=args.resume,
+                        nproc=args.nproc,
+                        shared_all_reads_fasta=args.shared_all_reads_fasta,
+                        shared_reseq_m4=args.shared_reseq_m4)
             obj.run()
         except ValueError as e:
             logging.error(str(e))
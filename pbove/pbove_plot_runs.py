@@ -8,8 +8,8 @@ from pbcore.util.ToolRunner import PBToolRunner
 from pbcore.util.Process import backticks
 from pbove.utils.Utils import realpath, mkdir, cat_files
 from pbove.io.RunInfoReader import RunInfo, RunInfoReader
-from pbove.pbove_main import add_params_to_parser
 from pbove.__init__ import get_version, get_dir
+from pbove.utils.Profiling import add_profile_arguments, profiled
 
 #run_folders = [
 #"11063P_4pctFMP/",
@@ -124,11 +124,13 @@ class PbovePlotRunner(PBToolRunner):
                "jobs/runs in the context of preassembly overlap prediction."
         PBToolRunner.__init__(self, desc)
         set_parser(self.parser)
+        add_profile_arguments(self.parser)
 
     def getVersion(self):
         """Get version string"""
         return get_version()
 
+    @profiled
     def run(self):
         """Run"""
         logging.info("Running {f} v{v}.".format(f=op.basename(__file__),
@@ -10,7 +10,9 @@ import os.path as op
 import sys
 import logging
 from pbove.__init__ import get_version
-from pbove.utils.Utils import realpath, mkdir
+from pbove.utils.Profiling import add_profile_arguments, profiled
+from pbove.utils.Utils import realpath, mkdir, count_lines
+from pbove.utils.Metrics import StageMetrics
 from pbcore.util.ToolRunner import PBToolRunner
 from pbcore.util.Process import backticks
 
@@ -18,16 +20,23 @@ class DoPreassembly(object):
     """pbove do preassembly."""
     def __init__(self, all_reads_fasta, seed_reads_fasta,
                  out_m4, ref_sz, out_dir, min_seed_len,
-                 blasr_opts, force_redo=False):
+                 blasr_opts, force_redo=False, nproc=12):
         self.all_reads_fasta = realpath(all_reads_fasta)
         self.ref_sz = int(ref_sz)
         self.out_dir = realpath(out_dir)
         self.min_seed_len = min_seed_len
         self.blasr_opts = blasr_opts
         self.force_redo = force_redo
+        # Numbers of reads in seed_reads_fasta and of alignments in
+        # out_m4, set by create_seed_reads_fasta and by align if blasr
+        # is run.
+        self.num_seed_reads = None
+        self.num_hits = None
+        self.nproc = int(nproc)
 
         if not op.exists(self.out_dir):
             mkdir(self.out_dir)
+        self.metrics = StageMetrics(op.join(self.out_dir, "metrics.json"))
 
         self.out_m4 = realpath(out_m4) if out_m4 is not None \
                       else op.join(self.out_dir, "preassembly_out.m4")
@@ -50,72 +59,86 @@ class DoPreassembly(object):
 
     def create_seed_reads_fasta(self):
         """Create seed_reads_fasta from all_reads_fasta."""
-        logging.info("Start to create seed reads.")
-        # First get read lengths of reads in all_reads_fasta
-        cmd = "fastalength {all_reads} ".\
-              format(all_reads=self.all_reads_fasta) + \
-              "| cut -d ' ' -f 1 | sort -nr | " + \
-              "awk '{{t+=$1;if(t>={ref_sz}*30){{print $1;exit;}}}}'".\
-              format(ref_sz=self.ref_sz)
-        logging.info("CMD: {cmd}".format(cmd=cmd))
-        _o, _c, _m = backticks(cmd)
-        if _c != 0:
-            raise RuntimeError("CMD failed. " + str(_o) + ' ' + str(_m))
-
-        min_seed_len = max(int(_o[0] if len(_o) > 0 else 0), self.min_seed_len)
-
-        reads_to_rm = op.join(self.out_dir, "reads_to_rm.txt")
-        cmd = "fastalength {all_reads} ".\
-              format(all_reads=self.all_reads_fasta) + \
-              "| awk '($1 < {len}){{print $2}} ' > ".\
-              format(len=min_seed_len) + \
-              "{reads_to_rm}".format(reads_to_rm=reads_to_rm)
-        logging.info("CMD: {cmd}".format(cmd=cmd))
-        _o, _c, _m = backticks(cmd)
-        if _c != 0:
-            raise RuntimeError("CMD failed. " + str(_o) + ' ' + str(_m))
-
-        cmd = "fastaremove {all_reads} ".\
-              format(all_reads=self.all_reads_fasta) + \
-              "{reads_to_rm} ".format(reads_to_rm=reads_to_rm) + \
-              "> {seed_reads} ".format(seed_reads=self.seed_reads_fasta)
-        logging.info("CMD: {cmd}".format(cmd=cmd))
-        _o, _c, _m = backticks(cmd)
-        if _c != 0:
-            raise RuntimeError("CMD failed. " + str(_o) + ' ' + str(_m))
-
-    def align(self):
-        """Align all_reads_fasta to seed_reads_fasta"""
-        logging.info("Start to align all reads to seed reads")
-        if op.exists(self.seed_reads_sa) and self.force_redo is not True:
-            msg = "sa file {sa} already exist, skip sawriter.".\
-                    format(sa=self.seed_reads_fasta)
-            logging.warn(msg)
-        else:
-            cmd = "sawriter {sa} {fa} -blt 10".format(sa=self.seed_reads_sa,
-                                                      fa=self.seed_reads_fasta)
+        with self.metrics.stage("preassembly.seed_reads") as stage:
+            logging.info("Start to create seed reads.")
+            # First get read lengths of reads in all_reads_fasta
+            cmd = "fastalength {all_reads} ".\
+                  format(all_reads=self.all_reads_fasta) + \
+                  "| cut -d ' ' -f 1 | sort -nr | " + \
+                  "awk '{{t+=$1;if(t>={ref_sz}*30){{print $1;exit;}}}}'".\
+                  format(ref_sz=self.ref_sz)
+            logging.info("CMD: {cmd}".format(cmd=cmd))
+            _o, _c, _m = backticks(cmd)
+            if _c != 0:
+                raise RuntimeError("CMD failed. " + str(_o) + ' ' +
+                                   str(_m))
+
+            min_seed_len = max(int(_o[0] if len(_o) > 0 else 0),
+                               self.min_seed_len)
+
+            # Write names of reads shorter than min_seed_len to
+            # reads_to_rm, and print number of seed reads.
+            reads_to_rm = op.join(self.out_dir, "reads_to_rm.txt")
+            cmd = "fastalength {all_reads} ".\
+                  format(all_reads=self.all_reads_fasta) + \
+                  "| awk 'BEGIN{{printf \"\" > \"{rm}\"}} ".\
+                  format(rm=reads_to_rm) + \
+                  "($1 < {len}){{print $2 > \"{rm}\"; next}} ".\
+                  format(len=min_seed_len, rm=reads_to_rm) + \
+                  "{n++} END{print n+0}'"
             logging.info("CMD: {cmd}".format(cmd=cmd))
             _o, _c, _m = backticks(cmd)
             if _c != 0:
-                raise RuntimeError("CMD failed. " + str(_o) + ' ' + str(_m))
-
-        if op.exists(self.out_m4) and self.force_redo is not True:
-            msg = "preasembly output {m4} already exists, skip blasr.".\
-                    format(m4=self.out_m4)
-            logging.warn(msg)
-        else:
-            cmd = 'blasr ' + \
-                  self.all_reads_fasta + ' ' + \
-                  self.seed_reads_fasta + ' ' + \
-                  '-m 4 -nproc 12 ' + \
-                  '-sa {sa} '.format(sa=self.seed_reads_sa) + \
-                  '-out ' + self.out_m4 + ' ' + \
-                  self.blasr_opts
+                raise RuntimeError("CMD failed. " + str(_o) + ' ' +
+                                   str(_m))
+            self.num_seed_reads = stage.rows = int(_o[0])
+
+            cmd = "fastaremove {all_reads} ".\
+                  format(all_reads=self.all_reads_fasta) + \
+                  "{reads_to_rm} ".format(reads_to_rm=reads_to_rm) + \
+                  "> {seed_reads} ".format(seed_reads=self.seed_reads_fasta)
             logging.info("CMD: {cmd}".format(cmd=cmd))
             _o, _c, _m = backticks(cmd)
             if _c != 0:
-                raise RuntimeError("CMD failed. " + str(_o) + ' ' + str(_m))
-        logging.info("Preassembly m4 output done.")
+                raise RuntimeError("CMD failed. " + str(_o) + ' ' +
+                                   str(_m))
+
+    def align(self):
+        """Align all_reads_fasta to seed_reads_fasta"""
+        with self.metrics.stage("preassembly.align") as stage:
+            logging.info("Start to align all reads to seed reads")
+            if op.exists(self.seed_reads_sa) and self.force_redo is not True:
+                msg = "sa file {sa} already exist, skip sawriter.".\
+                        format(sa=self.seed_reads_fasta)
+                logging.warn(msg)
+            else:
+                cmd = "sawriter {sa} {fa} -blt 10".format(
+                      sa=self.seed_reads_sa, fa=self.seed_reads_fasta)
+                logging.info("CMD: {cmd}".format(cmd=cmd))
+                _o, _c, _m = backticks(cmd)
+                if _c != 0:
+                    raise RuntimeError("CMD failed. " + str(_o) + ' ' +
+                                   str(_m))
+
+            if op.exists(self.out_m4) and self.force_redo is not True:
+                msg = "preasembly output {m4} already exists, skip blasr.".\
+                        format(m4=self.out_m4)
+                logging.warn(msg)
+            else:
+                cmd = 'blasr ' + \
+                      self.all_reads_fasta + ' ' + \
+                      self.seed_reads_fasta + ' ' + \
+                      '-m 4 -nproc {n} '.format(n=self.nproc) + \
+                      '-sa {sa} '.format(sa=self.seed_reads_sa) + \
+                      '-out ' + self.out_m4 + ' ' + \
+                      self.blasr_opts
+                logging.info("CMD: {cmd}".format(cmd=cmd))
+                _o, _c, _m = backticks(cmd)
+                if _c != 0:
+                    raise RuntimeError("CMD failed. " + str(_o) + ' ' +
+                                   str(_m))
+                self.num_hits = stage.rows = count_lines(self.out_m4)
+            logging.info("Preassembly m4 output done.")
 
     def run(self):
         """Run"""
@@ -161,6 +184,9 @@ def set_parser(parser):
     helpstr = "Force to recompute even if outupt files exist."
     parser.add_argument("--force_redo", action="store_true", help=helpstr)
 
+    parser.add_argument("--nproc", type=int, default=12,
+                        help="Number of threads to call blasr.")
+
     return parser
 
 
@@ -170,11 +196,13 @@ class DoPreassemblyRunner(PBToolRunner):
         desc = "Mimic HGAP Preassembly."
         PBToolRunner.__init__(self, desc)
         set_parser(self.parser)
+        add_profile_arguments(self.parser)
 
     def getVersion(self):
         """Get version string"""
         return get_version()
 
+    @profiled
     def run(self):
         """Run"""
         logging.info("Running {f} v{v}.".format(f=op.basename(__file__),
@@ -188,7 +216,8 @@ class DoPreassemblyRunner(PBToolRunner):
                                 out_dir=args.out_dir,
                                 min_seed_len=args.min_seed_len,
                                 blasr_opts=args.blasr_opts,
-                                force_redo=args.force_redo)
+                                force_redo=args.force_redo,
+                                nproc=args.nproc)
             obj.run()
         except ValueError as e:
             logging.error(str(e))
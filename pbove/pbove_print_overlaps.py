@@ -8,6 +8,7 @@ reference, print ground truth overlap pairs.
 import os.path as op
 from pbcore.util.ToolRunner import PBToolRunner
 from pbove.__init__ import get_version
+from pbove.utils.Profiling import add_profile_arguments, profiled
 from pbove.Reseq import ReseqGroundTruth
 from pbove.io.PBIReadFastaHeadIO import PBIReadFastaHeadReader
 from pbove.utils.compute import write_gt_overlaps
@@ -77,11 +78,13 @@ class PrintGTOverlapsRunner(PBToolRunner):
                "(including weak overlaps) to out_file."
         PBToolRunner.__init__(self, desc)
         set_parser(self.parser)
+        add_profile_arguments(self.parser)
 
     def getVersion(self):
         """Get version string"""
         return get_version()
 
+    @profiled
     def run(self):
         """Run"""
         logging.info("Running {f} v{v}.".format(f=op.basename(__file__),
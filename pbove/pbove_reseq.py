@@ -9,16 +9,19 @@ import os.path as op
 import sys
 import logging
 from pbove.__init__ import get_version
-from pbove.utils.Utils import realpath
+from pbove.utils.Profiling import add_profile_arguments, profiled
+from pbove.utils.Utils import realpath, count_lines
+from pbove.utils.Metrics import StageMetrics
 from pbcore.util.ToolRunner import PBToolRunner
 from pbcore.util.Process import backticks
-from pbalign.utils.fileutil import checkReferencePath
 
 
 class DoReseq(object):
     """pbove do resequencing."""
     def __init__(self, input_reads, ref, out_m4,
-                 blasr_opts="", force_redo=False):
+                 blasr_opts="", force_redo=False, nproc=12):
+        # pbalign is slow to import, import it only when needed.
+        from pbalign.utils.fileutil import checkReferencePath
         self.input_reads = realpath(input_reads)
         self.ref = realpath(ref)
         self.out_m4 = realpath(out_m4)
@@ -26,7 +29,12 @@ class DoReseq(object):
         _gff = checkReferencePath(self.ref)
         self.blasr_opts = blasr_opts
         self.force_redo = force_redo
+        # Number of alignments in out_m4, set by run if blasr is run.
+        self.num_hits = None
+        self.nproc = int(nproc)
         self._validate_blasr_opts(self.blasr_opts)
+        self.metrics = StageMetrics(op.join(op.dirname(self.out_m4),
+                                            "metrics.json"))
 
     def _validate_blasr_opts(self, blasr_opts):
         """Validate additional blasr options."""
@@ -42,21 +50,24 @@ class DoReseq(object):
         cmd = 'blasr ' + \
                self.input_reads + ' ' + \
                self.ref_fasta + ' ' + \
-               '-m 4 -nproc 12 -placeRepeatsRandomly ' + \
+               '-m 4 -nproc {n} -placeRepeatsRandomly '.format(n=self.nproc) + \
                '-out ' + self.out_m4 + ' ' + \
                ('' if self.ref_sa is None else \
                 '-sa {sa} '.format(sa=self.ref_sa)) + \
                self.blasr_opts
 
-        if op.exists(self.out_m4) and self.force_redo is False:
-            msg = "Output m4 file {out} exists! Skip blasr ... ".\
-                    format(out=self.out_m4)
-            logging.warn(msg)
-        else:
-            logging.info("CMD: {cmd}".format(cmd=cmd))
-            _o, _c, _m = backticks(cmd)
-            if _c != 0:
-                raise RuntimeError("CMD failed: " + str(_o) + ' ' + str(_m))
+        with self.metrics.stage("reseq.blasr") as stage:
+            if op.exists(self.out_m4) and self.force_redo is False:
+                msg = "Output m4 file {out} exists! Skip blasr ... ".\
+                        format(out=self.out_m4)
+                logging.warn(msg)
+            else:
+                logging.info("CMD: {cmd}".format(cmd=cmd))
+                _o, _c, _m = backticks(cmd)
+                if _c != 0:
+                    raise RuntimeError("CMD failed: " + str(_o) + ' ' +
+                                       str(_m))
+                self.num_hits = stage.rows = count_lines(self.out_m4)
 
 
 def set_parser(parser):
@@ -82,6 +93,9 @@ def set_parser(parser):
     helpstr = "Force to recompute even if outupt files exist."
     parser.add_argument("--force_redo", action="store_true", help=helpstr)
 
+    parser.add_argument("--nproc", type=int, default=12,
+                        help="Number of threads to call blasr.")
+
     return parser
 
 
@@ -91,11 +105,13 @@ class DoReseqRunner(PBToolRunner):
         desc = "Mimic RS_Resequencing protocol."
         PBToolRunner.__init__(self, desc)
         set_parser(self.parser)
+        add_profile_arguments(self.parser)
 
     def getVersion(self):
         """Get version string"""
         return get_version()
 
+    @profiled
     def run(self):
         """Run"""
         logging.info("Running {f} v{v}.".format(f=op.basename(__file__),
@@ -106,7 +122,8 @@ class DoReseqRunner(PBToolRunner):
                           ref=args.ref,
                           out_m4=args.out_m4,
                           blasr_opts=args.blasr_opts,
-                          force_redo=args.force_redo)
+                          force_redo=args.force_redo,
+                          nproc=args.nproc)
             obj.run()
         except ValueError as e:
             logging.error(str(e))
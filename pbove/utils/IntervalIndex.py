@@ -0,0 +1,132 @@
+"""Define static interval indices, which answer 'which intervals overlap
+with [start, end]' in O(log n + k) time.
+
+IntervalIndex is an implicit augmented interval tree (as in cgranges):
+intervals are stored in flat arrays sorted by start, the array itself
+is a complete binary search tree in in-order layout, and each node
+holds the maximum end of its subtree.
+"""
+
+# Subtrees of at most 2**(SCAN_LEVEL+1) intervals are scanned linearly.
+SCAN_LEVEL = 3
+
+
+class IntervalIndex(object):
+    """Static index of closed intervals [starts[i], ends[i]], each
+    having an id ids[i] (default, i). Two intervals overlap if they
+    share at least one point, i.e., touching intervals overlap."""
+    def __init__(self, starts, ends, ids=None):
+        if ids is None:
+            ids = range(len(starts))
+        assert len(starts) == len(ends) == len(ids)
+        # Sort by start; python sort is stable, so intervals with the
+        # same start remain in the input order.
+        order = sorted(range(len(starts)), key=lambda i: starts[i])
+        self.starts = [int(starts[i]) for i in order]
+        self.ends = [int(ends[i]) for i in order]
+        self.ids = [ids[i] for i in order]
+        self.maxEnds = list(self.ends)
+        self.maxLevel = self._index()
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __str__(self):
+        return "IntervalIndex of {n} intervals.\n".format(n=len(self))
+
+    def _index(self):
+        """Compute maximum end of each subtree, return level of root."""
+        a, n = self.maxEnds, len(self.starts)
+        if n == 0:
+            return -1
+        lastIndex, last = 0, 0
+        for i in range(0, n, 2):
+            lastIndex, last = i, a[i]
+        k = 1
+        while (1 << k) <= n:
+            x = 1 << (k - 1)
+            for i in range((x << 1) - 1, n, x << 2):
+                er = a[i + x] if i + x < n else last
+                a[i] = max(a[i], a[i - x], er)
+            lastIndex = lastIndex - x if (lastIndex >> k) & 1 \
+                        else lastIndex + x
+            if lastIndex < n and a[lastIndex] > last:
+                last = a[lastIndex]
+            k += 1
+        return k - 1
+
+    def _positions(self, start, end):
+        """Yield positions of intervals overlapping with [start, end]."""
+        n = len(self.starts)
+        if n == 0:
+            return
+        starts, ends, maxEnds = self.starts, self.ends, self.maxEnds
+        # stack of (level, node, whether the left child is processed)
+        stack = [(self.maxLevel, (1 << self.maxLevel) - 1, False)]
+        while stack:
+            k, x, leftDone = stack.pop()
+            if k <= SCAN_LEVEL:
+                i0 = x >> k << k
+                i1 = min(n, i0 + (1 << (k + 1)) - 1)
+                for i in range(i0, i1):
+                    if starts[i] > end:
+                        break
+                    if ends[i] >= start:
+                        yield i
+            elif not leftDone:
+                y = x - (1 << (k - 1))
+                stack.append((k, x, True))
+                if y >= n or maxEnds[y] >= start:
+                    stack.append((k - 1, y, False))
+            elif x < n and starts[x] <= end:
+                if ends[x] >= start:
+                    yield x
+                stack.append((k - 1, x + (1 << (k - 1)), False))
+
+    def count(self, start, end):
+        """Return number of intervals overlapping with [start, end]."""
+        return sum(1 for _i in self._positions(start, end))
+
+    def overlaps(self, start, end):
+        """Return a list of (start, end, id) of intervals overlapping
+        with [start, end], sorted by start and then input order."""
+        return [(self.starts[i], self.ends[i], self.ids[i])
+                for i in sorted(self._positions(start, end))]
+
+
+class ReferenceIntervalIndex(object):
+    """IntervalIndex of reads mapped to each reference, built from a
+    list of [(read, reference, refStart, refEnd), ...], such as q and t
+    of compute.ComputeAllPosNegNumbers. The id of an interval is the
+    index of its read in the list. Unmappable reads are ignored."""
+    def __init__(self, mappedReads):
+        refToItems = {}
+        for index, (_read, ref, refStart, refEnd) in enumerate(mappedReads):
+            if ref != "":
+                refToItems.setdefault(ref, []).append(
+                        (refStart, refEnd, index))
+        self.indices = {}
+        for ref, items in refToItems.iteritems():
+            starts, ends, ids = zip(*items)
+            self.indices[ref] = IntervalIndex(starts, ends, ids)
+
+    def __str__(self):
+        return "ReferenceIntervalIndex of {n} intervals on {r} references.\n".\
+               format(n=sum([len(i) for i in self.indices.values()]),
+                      r=len(self.indices))
+
+    def count(self, ref, start, end):
+        """Return number of reads which are mapped to reference ref, and
+        overlap with or touch [start, end]."""
+        if ref not in self.indices:
+            return 0
+        return self.indices[ref].count(start, end)
+
+    def overlaps(self, ref, start, end):
+        """Return a sorted list of ids (i.e., indices in mappedReads) of
+        reads which are mapped to reference ref, and overlap with or
+        touch [start, end]."""
+        if ref not in self.indices:
+            return []
+        return sorted([i for _s, _e, i in
+                       self.indices[ref].overlaps(start, end)])
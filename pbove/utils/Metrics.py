@@ -0,0 +1,192 @@
+"""Define class StageMetrics, which records wall time, CPU time, peak
+memory, number of rows processed and throughput of pipeline stages, and
+saves them to a json file, e.g., metrics.json in out_dir."""
+
+import os
+import os.path as op
+import time
+import json
+import logging
+import resource
+import threading
+from contextlib import contextmanager
+
+# Interval in seconds of sampling RSS of this process during a stage.
+RSS_SAMPLE_INTERVAL = 0.5
+
+# Stages of different components (e.g., pbove and pbove_eval) running in
+# threads of one process may save to the same file.
+_SAVE_LOCK = threading.Lock()
+
+
+def cpu_seconds():
+    """Return user and system CPU seconds of this process and of its
+    terminated children, e.g., blasr called by backticks."""
+    t = os.times()
+    return t[0] + t[1] + t[2] + t[3]
+
+
+def _max_rss_mb(who):
+    """Return ru_maxrss in MB of who, e.g., resource.RUSAGE_SELF."""
+    # ru_maxrss is in KB on Linux.
+    return resource.getrusage(who).ru_maxrss / 1024.0
+
+
+def peak_rss_mb():
+    """Return peak resident set size in MB of this process, or of its
+    largest terminated child if larger, since this process started."""
+    return max(_max_rss_mb(resource.RUSAGE_SELF),
+               _max_rss_mb(resource.RUSAGE_CHILDREN))
+
+
+def rss_mb():
+    """Return current resident set size in MB of this process, or peak
+    resident set size if /proc is not available."""
+    try:
+        with open("/proc/self/statm", 'r') as reader:
+            pages = int(reader.read().split()[1])
+        return pages * resource.getpagesize() / (1024.0 * 1024.0)
+    except (IOError, OSError, IndexError, ValueError):
+        return _max_rss_mb(resource.RUSAGE_SELF)
+
+
+class RssSampler(threading.Thread):
+    """Sample RSS of this process every `interval` seconds in a daemon
+    thread until stop() is called, and keep the largest sample as peak,
+    so that peaks shorter than `interval` may be missed."""
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL):
+        super(RssSampler, self).__init__(name="RssSampler")
+        self.daemon = True
+        self.interval = interval
+        self.peak = rss_mb()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.peak = max(self.peak, rss_mb())
+
+    def stop(self):
+        """Stop sampling, return peak RSS in MB."""
+        self._stopped.set()
+        self.join()
+        self.peak = max(self.peak, rss_mb())
+        return self.peak
+
+
+class StageRecord(object):
+    """Metrics of a stage. Set rows to the number of rows (e.g., reads
+    or alignments) processed by the stage, if known.
+    Memory of a stage is startRssMB and endRssMB, RSS of this process
+    when the stage starts and ends, and stagePeakRssMB, peak RSS of this
+    process sampled during the stage. childPeakRssMB is peak RSS of the
+    largest child (e.g., blasr) terminated during the stage, if it is
+    larger than that of children terminated before. peakRssMB is peak
+    RSS since this process started, and so is shared by stages."""
+    def __init__(self, name, rows=None):
+        self.name = name
+        self.rows = rows
+        self.status = "running"
+        self.wallSeconds = None
+        self.cpuSeconds = None
+        self.peakRssMB = None
+        self.startRssMB = None
+        self.endRssMB = None
+        self.stagePeakRssMB = None
+        self.childPeakRssMB = None
+        self.extra = {}
+
+    def __str__(self):
+        return "Stage {n} {s}: wall {w:.2f}s, cpu {c:.2f}s, ".format(
+               n=self.name, s=self.status, w=self.wallSeconds,
+               c=self.cpuSeconds) + \
+               "RSS {s:.1f}MB-{e:.1f}MB, stage peak RSS {m:.1f}MB, ".format(
+               s=self.startRssMB, e=self.endRssMB, m=self.stagePeakRssMB) + \
+               "rows {r}, throughput {t} rows/s.".format(r=self.rows,
+               t=None if self.throughput is None
+               else "{0:.1f}".format(self.throughput))
+
+    @property
+    def throughput(self):
+        """Return rows processed per wall second, or None."""
+        if self.rows is None or not self.wallSeconds:
+            return None
+        return self.rows / self.wallSeconds
+
+    def to_dict(self):
+        """Return this record as a dictionary."""
+        ret = {"stage": self.name, "status": self.status,
+               "wallSeconds": self.wallSeconds,
+               "cpuSeconds": self.cpuSeconds,
+               "peakRssMB": self.peakRssMB,
+               "startRssMB": self.startRssMB,
+               "endRssMB": self.endRssMB,
+               "stagePeakRssMB": self.stagePeakRssMB,
+               "childPeakRssMB": self.childPeakRssMB,
+               "rows": self.rows, "rowsPerSecond": self.throughput}
+        ret.update(self.extra)
+        return ret
+
+
+class StageMetrics(object):
+    """Metrics of stages, each measured by a `with metrics.stage(name):`
+    block and saved to fn as soon as the stage completes or fails.
+    Records of stages already in fn are kept, unless a stage of the same
+    name is measured again, so that components sharing out_dir (e.g.,
+    pbove and pbove_eval) add to the same metrics.json.
+    CPU seconds and RSS include all threads of this process, and so are
+    shared by stages running concurrently in threads."""
+    def __init__(self, fn):
+        self.fn = fn
+        self.records = []
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        """Measure a stage, yield its StageRecord."""
+        record = StageRecord(name=name, rows=rows)
+        wall, cpu = time.time(), cpu_seconds()
+        record.startRssMB = rss_mb()
+        self_peak = _max_rss_mb(resource.RUSAGE_SELF)
+        child_peak = _max_rss_mb(resource.RUSAGE_CHILDREN)
+        sampler = RssSampler()
+        sampler.start()
+        try:
+            yield record
+            record.status = "completed"
+        except BaseException:
+            record.status = "failed"
+            raise
+        finally:
+            record.wallSeconds = time.time() - wall
+            record.cpuSeconds = cpu_seconds() - cpu
+            record.peakRssMB = peak_rss_mb()
+            record.endRssMB = rss_mb()
+            record.stagePeakRssMB = max(record.startRssMB, sampler.stop())
+            # A peak of this process reached during the stage is exact.
+            if _max_rss_mb(resource.RUSAGE_SELF) > self_peak:
+                record.stagePeakRssMB = _max_rss_mb(resource.RUSAGE_SELF)
+            if _max_rss_mb(resource.RUSAGE_CHILDREN) > child_peak:
+                record.childPeakRssMB = \
+                        _max_rss_mb(resource.RUSAGE_CHILDREN)
+            logging.info(str(record))
+            self.records.append(record)
+            self.save()
+
+    def save(self):
+        """Save records, merged with records of other stages in fn."""
+        with _SAVE_LOCK:
+            stages = []
+            if op.exists(self.fn):
+                try:
+                    with open(self.fn, 'r') as reader:
+                        stages = json.load(reader).get("stages", [])
+                except ValueError:
+                    logging.warn("Could not parse metrics {f}.".
+                                 format(f=self.fn))
+            names = set([r.name for r in self.records])
+            stages = [s for s in stages if s.get("stage") not in names] + \
+                     [r.to_dict() for r in self.records]
+            tmp_fn = self.fn + ".tmp"
+            with open(tmp_fn, 'w') as writer:
+                json.dump({"stages": stages}, writer, indent=2,
+                          sort_keys=True)
+            os.rename(tmp_fn, self.fn)
@@ -0,0 +1,258 @@
+"""Define profiling hooks of pbove tools, e.g.,
+    class DoEvalRunner(PBToolRunner):
+        def __init__(self):
+            ...
+            add_profile_arguments(self.parser)
+
+        @profiled
+        def run(self):
+            ...
+With --profile_dir d, run() of a tool is profiled, and the following
+files are written to d, prefixed with name of the tool:
+    {tool}.pstats    : cProfile statistics (deterministic mode only),
+                       which can be loaded by pstats or snakeviz,
+    {tool}.collapsed : collapsed stacks, one 'f1;f2;...;fn count' per
+                       line, which flamegraph.pl or speedscope can draw,
+    {tool}.profile.txt: top functions by cumulative time.
+In deterministic mode, every function call of the main thread, and of
+threads started while profiling (e.g., by run_in_threads), is measured
+by a cProfile of each thread, merged when written, and collapsed stacks
+(in microseconds) are derived from the caller-callee graph. Child
+processes, e.g., of multiprocessing, are not profiled in either mode.
+In sampling mode, stacks of all threads are sampled every few
+milliseconds by a background thread, which adds little overhead to
+multi-hour runs.
+"""
+
+import os.path as op
+import sys
+import time
+import logging
+import threading
+import functools
+from collections import defaultdict
+from pbove.utils.Utils import realpath, mkdir
+
+PROFILE_MODES = ("deterministic", "sampling")
+
+# Number of top functions in summaries.
+NUM_TOP_FUNCTIONS = 30
+
+
+def add_profile_arguments(parser):
+    """Add profiling arguments to parser of a PBToolRunner."""
+    parser.add_argument("--profile_dir", type=str, default=None,
+        help="Profile this tool, and write pstats, collapsed stacks for " +
+             "flame graphs and a summary of top functions to this " +
+             "directory.")
+    parser.add_argument("--profile_mode", type=str, default="deterministic",
+        choices=PROFILE_MODES,
+        help="Profile every function call by cProfile (deterministic), " +
+             "or sample stacks of all threads periodically (sampling), " +
+             "which has lower overhead.")
+    parser.add_argument("--profile_interval", type=float, default=0.005,
+        help="Seconds between two stack samples in sampling mode.")
+    return parser
+
+
+def profiled(run):
+    """Decorate run() of a PBToolRunner, which is profiled if
+    --profile_dir is given, see add_profile_arguments."""
+    @functools.wraps(run)
+    def wrapper(self):
+        """Run, profiled if --profile_dir is given."""
+        profile_dir = getattr(self.args, "profile_dir", None)
+        if profile_dir is None:
+            return run(self)
+        name = op.splitext(op.basename(
+                           sys.modules[run.__module__].__file__))[0]
+        if self.args.profile_mode == "sampling":
+            profiler = SamplingProfiler(self.args.profile_interval)
+        else:
+            profiler = DeterministicProfiler()
+        profiler.start()
+        try:
+            return run(self)
+        finally:
+            profiler.stop()
+            profiler.write(realpath(profile_dir), name)
+    return wrapper
+
+
+def _frameLabel(filename, lineno, funcname):
+    """Return label of a function in collapsed stacks."""
+    return "{f} ({m}:{l})".format(f=funcname, m=op.basename(filename),
+                                  l=lineno)
+
+
+def _writeCollapsed(stacks, fn):
+    """Write a dictionary, tuple of labels from root -> count, to fn."""
+    with open(fn, 'w') as writer:
+        for stack, count in sorted(stacks.iteritems()):
+            if count > 0:
+                writer.write("{s} {c}\n".format(s=";".join(stack),
+                                                c=int(round(count))))
+
+
+def _logSummary(lines, fn):
+    """Write summary lines to fn and log them."""
+    with open(fn, 'w') as writer:
+        writer.write("\n".join(lines) + "\n")
+    logging.info("Profile summary written to {f}:\n{s}".format(
+                 f=fn, s="\n".join(lines[:NUM_TOP_FUNCTIONS + 2])))
+
+
+class DeterministicProfiler(object):
+    """Profile every function call of this thread, and of threads started
+    by it until stop(), by a cProfile of each thread."""
+    def __init__(self):
+        import cProfile
+        self.profile = cProfile.Profile()
+        # Profiles of threads started while profiling.
+        self.threadProfiles = []
+        self._lock = threading.Lock()
+
+    def _startThread(self, _frame, _event, _arg):
+        """Profile hook of a new thread, called on its first event,
+        which replaces itself by a new cProfile of the thread."""
+        import cProfile
+        profile = cProfile.Profile()
+        with self._lock:
+            self.threadProfiles.append(profile)
+        profile.enable()
+
+    def start(self):
+        """Start profiling."""
+        threading.setprofile(self._startThread)
+        self.profile.enable()
+
+    def stop(self):
+        """Stop profiling. Threads still running are profiled until they
+        complete."""
+        self.profile.disable()
+        threading.setprofile(None)
+
+    def stats(self, stream=None):
+        """Return pstats.Stats of this thread and other threads merged."""
+        import pstats
+        with self._lock:
+            profiles = [self.profile] + self.threadProfiles
+        for profile in profiles:
+            profile.create_stats()
+        # Stats can not be created from a profile of no function calls.
+        return pstats.Stats(*[p for p in profiles if len(p.stats) > 0],
+                            stream=stream)
+
+    def collapsedStacks(self, minSeconds=1e-5, maxDepth=128):
+        """Return a dictionary, stack -> microseconds, derived from the
+        caller-callee graph of cProfile, by splitting time of a function
+        between its callers in proportion to time spent under each, as
+        pstats only keeps one level of callers."""
+        stats = self.stats().stats
+        callees = defaultdict(list)
+        for key, (_cc, _nc, _tt, _ct, callers) in stats.iteritems():
+            for caller, edge in callers.iteritems():
+                # edge is (cc, nc, tt, ct) of key called by caller.
+                callees[caller].append((key, edge[3]))
+        stacks = defaultdict(float)
+
+        def visit(key, path, seconds):
+            """Add stacks of key, of which path (labels) spends seconds
+            in key."""
+            _cc, _nc, tt, ct, _callers = stats[key]
+            if ct <= 0 or seconds < minSeconds:
+                return
+            scale = seconds / ct
+            stacks[path] += tt * scale * 1e6
+            if len(path) >= maxDepth:
+                return
+            for callee, edgeSeconds in callees.get(key, []):
+                label = _frameLabel(*callee)
+                if label in path:
+                    # Recursion, already counted in the caller.
+                    continue
+                visit(callee, path + (label,), edgeSeconds * scale)
+
+        for key, (_cc, _nc, _tt, ct, callers) in stats.iteritems():
+            if len(callers) == 0:
+                visit(key, (_frameLabel(*key),), ct)
+        return stacks
+
+    def write(self, out_dir, name):
+        """Write {name}.pstats, {name}.collapsed and {name}.profile.txt
+        to out_dir."""
+        from cStringIO import StringIO
+        mkdir(out_dir)
+        prefix = op.join(out_dir, name)
+        logging.info("Merging profiles of {n} threads.".format(
+                     n=len(self.threadProfiles) + 1))
+        self.stats().dump_stats(prefix + ".pstats")
+        _writeCollapsed(self.collapsedStacks(), prefix + ".collapsed")
+        buf = StringIO()
+        self.stats(stream=buf).sort_stats("cumulative").\
+                print_stats(NUM_TOP_FUNCTIONS)
+        _logSummary(buf.getvalue().strip("\n").split("\n"),
+                    prefix + ".profile.txt")
+
+
+class SamplingProfiler(threading.Thread):
+    """Sample stacks of all other threads every interval seconds."""
+    def __init__(self, interval=0.005):
+        threading.Thread.__init__(self, name="SamplingProfiler")
+        self.daemon = True
+        self.interval = float(interval)
+        self.stacks = defaultdict(int)
+        self.numSamples = 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        """Sample until stopped."""
+        while not self._stopped.is_set():
+            time.sleep(self.interval)
+            self.sample()
+
+    def sample(self):
+        """Add the current stack of every other thread."""
+        me = threading.current_thread().ident
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(_frameLabel(code.co_filename,
+                                         code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+        self.numSamples += 1
+
+    def stop(self):
+        """Stop sampling."""
+        self._stopped.set()
+        self.join()
+
+    def summary(self):
+        """Return lines of top functions by number of samples in which
+        they are on the stack (cumulative) or on top of it (self)."""
+        total = sum(self.stacks.values())
+        cumulative, own = defaultdict(int), defaultdict(int)
+        for stack, count in self.stacks.iteritems():
+            for label in set(stack):
+                cumulative[label] += count
+            own[stack[-1]] += count
+        lines = ["{n} samples of all threads, one every {i} seconds.".
+                 format(n=total, i=self.interval),
+                 "cumulative%\tself%\tfunction"]
+        for label, count in sorted(cumulative.iteritems(),
+                                   key=lambda x: (-x[1], x[0])):
+            lines.append("{c:.2f}\t{s:.2f}\t{f}".format(
+                         c=100.0 * count / max(total, 1),
+                         s=100.0 * own[label] / max(total, 1), f=label))
+        return lines
+
+    def write(self, out_dir, name):
+        """Write {name}.collapsed and {name}.profile.txt to out_dir."""
+        mkdir(out_dir)
+        prefix = op.join(out_dir, name)
+        _writeCollapsed(self.stacks, prefix + ".collapsed")
+        _logSummary(self.summary(), prefix + ".profile.txt")
@@ -0,0 +1,90 @@
+"""Define class Progress, which reports progress of a loop, e.g., over
+millions of query reads or preassembly hits, to logging at most once
+every few seconds, with items/s, ETA and memory."""
+
+import time
+import logging
+from pbove.utils.Metrics import rss_mb
+
+# Minimum seconds between two reports of a loop, see SetProgressInterval.
+_INTERVAL = 30.0
+
+# Reports go to this logger, so that they can be silenced by its level
+# without silencing other messages.
+LOGGER = logging.getLogger("pbove.progress")
+
+
+def SetProgressInterval(seconds):
+    """Set minimum seconds between two reports of a loop. If seconds is
+    None or not positive, do not report progress at all."""
+    global _INTERVAL
+    _INTERVAL = None if seconds is None or seconds <= 0 else float(seconds)
+
+
+class Progress(object):
+    """Progress of a loop of total items (None if unknown), e.g.,
+        progress = Progress("Processing query", len(q))
+        for qitem in q:
+            progress.update()
+            ...
+        progress.done()
+    update() only compares the clock once every few items, so that it
+    is cheap to call in a tight loop."""
+    def __init__(self, desc, total=None, interval=None):
+        self.desc = desc
+        self.total = total
+        self.interval = _INTERVAL if interval is None else interval
+        self.count = 0
+        self.start = time.time()
+        self._last = self.start
+        # Number of items at which to compare the clock next.
+        self._nextCheck = 1
+        self._reported = False
+
+    def update(self, n=1):
+        """Count n more items, and report if interval has elapsed."""
+        self.count += n
+        if self.count >= self._nextCheck and self.interval is not None:
+            self._check()
+
+    def _check(self):
+        """Report if interval has elapsed since the last report, and
+        estimate when to compare the clock next, about 10 times per
+        interval at the current rate."""
+        now = time.time()
+        if now - self._last >= self.interval:
+            self._report(now)
+            self._last = now
+        rate = self.count / max(now - self.start, 1e-6)
+        self._nextCheck = self.count + \
+                          max(1, min(int(rate * self.interval / 10), 100000))
+
+    def _report(self, now):
+        """Log progress at time now."""
+        elapsed = now - self.start
+        rate = self.count / elapsed if elapsed > 0 else 0.0
+        if self.total is not None:
+            msg = "{d}: {c} / {t} ({p:.1f}%)".format(d=self.desc,
+                  c=self.count, t=self.total,
+                  p=100.0 * self.count / max(self.total, 1))
+            if rate > 0:
+                msg += ", ETA {e}".format(e=_fmtSeconds(
+                       max(0, self.total - self.count) / rate))
+        else:
+            msg = "{d}: {c}".format(d=self.desc, c=self.count)
+        LOGGER.info(msg + ", {r:.1f} items/s, RSS {m:.1f}MB.".format(
+                    r=rate, m=rss_mb()))
+        self._reported = True
+
+    def done(self):
+        """Report the final count of a loop which has been reported."""
+        if self._reported and self.interval is not None:
+            self._report(time.time())
+
+
+def _fmtSeconds(seconds):
+    """Format seconds as h:mm:ss."""
+    seconds = int(round(seconds))
+    return "{h}:{m:02d}:{s:02d}".format(h=seconds // 3600,
+                                        m=seconds % 3600 // 60,
+                                        s=seconds % 60)
@@ -0,0 +1,192 @@
+"""Define class StageManifest, which records digests of inputs, parameters
+and tool versions of a pipeline stage, so that the stage can be skipped
+when none of them has changed since the stage last completed."""
+
+import os
+import os.path as op
+import json
+import hashlib
+import logging
+from pbcore.util.Process import backticks
+from pbove.utils.Utils import mkdir
+
+# Digests of files which have been hashed in this process,
+# (realpath, size, mtime) -> md5 hex digest
+_DIGESTS = {}
+
+# Versions of external tools, executable -> version string
+_TOOL_VERSIONS = {}
+
+
+def file_digest(fn, block_size=4*1024*1024):
+    """Return md5 hex digest of content of file fn.
+    A file shared by several stages (e.g., all_reads.fasta) is only read
+    once per process, as long as its size and mtime do not change."""
+    fn = op.realpath(fn)
+    st = os.stat(fn)
+    key = (fn, st.st_size, st.st_mtime)
+    if key not in _DIGESTS:
+        md5 = hashlib.md5()
+        with open(fn, 'rb') as reader:
+            while True:
+                block = reader.read(block_size)
+                if not block:
+                    break
+                md5.update(block)
+        _DIGESTS[key] = md5.hexdigest()
+    return _DIGESTS[key]
+
+
+def file_signature(fn, precise=False):
+    """Return a cheap signature (size and mtime) of file fn, for huge
+    inputs such as bax.h5 files which are too expensive to hash.
+    If precise is True, mtime is not rounded to seconds."""
+    st = os.stat(fn)
+    return "size={sz},mtime={mt}".format(sz=st.st_size,
+        mt=repr(st.st_mtime) if precise else int(st.st_mtime))
+
+
+def tool_version(exe, version_opt="-version"):
+    """Return the first line printed by `exe version_opt`, or 'unknown'
+    if the version of exe can not be determined."""
+    if exe not in _TOOL_VERSIONS:
+        _o, _c, _m = backticks("{exe} {opt}".format(exe=exe, opt=version_opt))
+        _TOOL_VERSIONS[exe] = str(_o[0]).strip() \
+                              if _c == 0 and len(_o) > 0 else "unknown"
+    return _TOOL_VERSIONS[exe]
+
+
+class StageManifest(object):
+    """Manifest of a pipeline stage, including digests of input files,
+    parameters and versions of tools used in this stage, and output
+    files produced by this stage. The manifest of a completed stage is
+    saved to manifest_dir/name.json.
+    Inputs recorded by content are hashed lazily, and only if their size
+    or mtime differ from those in the saved manifest, so that checking a
+    stage of unchanged multi-GB inputs does not read them."""
+    def __init__(self, name, manifest_dir):
+        self.name = name
+        self.manifest_dir = manifest_dir
+        self.inputs = {}
+        # Signatures of inputs recorded by content, which are not hashed
+        # until needed, realpath -> file_signature(precise=True)
+        self.signatures = {}
+        self.params = {}
+        self.versions = {}
+        self.outputs = []
+
+    @property
+    def fn(self):
+        """Return path to the saved manifest of this stage."""
+        return op.join(self.manifest_dir, "{n}.json".format(n=self.name))
+
+    def add_input(self, fn, by_content=True):
+        """Add an input file. If by_content is True, the input is recorded
+        by md5 digest of its content, otherwise, by its size and mtime."""
+        fn = op.realpath(fn)
+        if by_content:
+            self.signatures[fn] = file_signature(fn, precise=True)
+            self.inputs.pop(fn, None)
+        else:
+            self.inputs[fn] = file_signature(fn)
+            self.signatures.pop(fn, None)
+
+    def add_fofn(self, fofn):
+        """Add a fofn and files listed in the fofn as inputs."""
+        self.add_input(fofn)
+        with open(fofn, 'r') as reader:
+            for line in reader:
+                if len(line.strip()) > 0:
+                    self.add_input(line.strip(), by_content=False)
+
+    def add_param(self, key, value):
+        """Add a parameter."""
+        self.params[key] = value
+
+    def add_version(self, tool, version):
+        """Add version of a tool."""
+        self.versions[tool] = version
+
+    def add_output(self, fn):
+        """Add an output file."""
+        self.outputs.append(op.realpath(fn))
+
+    def _input_digests(self, saved=None):
+        """Return digests of all inputs, reusing digests of inputs in the
+        saved manifest (a dictionary) whose signatures have not changed."""
+        inputs = dict(self.inputs)
+        saved_inputs = (saved or {}).get("inputs", {})
+        saved_signatures = (saved or {}).get("signatures", {})
+        for fn, signature in self.signatures.iteritems():
+            if saved_signatures.get(fn) == signature and fn in saved_inputs:
+                inputs[fn] = saved_inputs[fn]
+            else:
+                inputs[fn] = file_digest(fn)
+        return inputs
+
+    def to_dict(self, saved=None):
+        """Return this manifest as a dictionary, see _input_digests."""
+        return {"stage": self.name, "inputs": self._input_digests(saved),
+                "signatures": self.signatures,
+                "params": self.params, "versions": self.versions,
+                "outputs": self.outputs}
+
+    def exists(self):
+        """Return True if a manifest of this stage has been saved."""
+        return op.exists(self.fn)
+
+    def outputs_exist(self):
+        """Return True if all output files of this stage exist."""
+        return all([op.exists(f) for f in self.outputs])
+
+    def output_signatures(self):
+        """Return a list of (inode, size, mtime) of output files, or None
+        of missing ones, which change if a stage rewrites or replaces its
+        outputs."""
+        signatures = []
+        for fn in self.outputs:
+            if op.exists(fn):
+                st = os.stat(fn)
+                signatures.append((st.st_ino, st.st_size, st.st_mtime))
+            else:
+                signatures.append(None)
+        return signatures
+
+    def load(self):
+        """Return the saved manifest as a dictionary, or None."""
+        if not self.exists():
+            return None
+        try:
+            with open(self.fn, 'r') as reader:
+                return json.load(reader)
+        except ValueError:
+            logging.warn("Could not parse manifest {f}.".format(f=self.fn))
+            return None
+
+    def is_up_to_date(self):
+        """Return True if the saved manifest matches this manifest and
+        all outputs of this stage exist. Signatures are not compared, an
+        input touched but not changed is still up to date."""
+        saved = self.load()
+        if saved is None or not self.outputs_exist():
+            return False
+        current = json.loads(json.dumps(self.to_dict(saved)))
+        current_signatures = current.pop("signatures", None)
+        saved_signatures = saved.pop("signatures", None)
+        if current != saved:
+            return False
+        if current_signatures != saved_signatures:
+            # Save current signatures, so that the next check does not
+            # hash inputs again.
+            self.save()
+        return True
+
+    def save(self):
+        """Save this manifest to self.fn."""
+        mkdir(self.manifest_dir)
+        saved = self.load()
+        tmp_fn = self.fn + ".tmp"
+        with open(tmp_fn, 'w') as writer:
+            json.dump(self.to_dict(saved), writer, indent=2,
+                      sort_keys=True)
+        os.rename(tmp_fn, self.fn)
@@ -1,8 +1,22 @@
 """Define util functions."""
 import os.path as op
 import os
+import sys
+import string
 import shutil
-from pbcore.io import FastaReader, FastaWriter
+import threading
+import heapq
+
+# Complement of IUPAC nucleotide codes in both cases, e.g., R (A or G)
+# -> Y (C or T). N and other characters (e.g., '-') are kept as they are.
+_COMPLEMENT = string.maketrans("ACGTURYKMBDHVacgturykmbdhv",
+                               "TGCAAYRMKVHDBtgcaayrmkvhdb")
+
+# Buffer size in bytes of streaming FASTA files.
+FASTA_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Block size in bytes of copying files.
+COPY_BUFFER_SIZE = 16 * 1024 * 1024
 
 
 def realpath(f):
@@ -27,27 +41,70 @@ def mknewdir(path):
     os.makedirs(path)
 
 
+def to_int_list(value):
+    """Return value, an int, a string or a list of them, as a list of
+    int, e.g., 200 -> [200], "200" -> [200], [200, "500"] -> [200, 500]."""
+    if isinstance(value, (list, tuple)):
+        return [int(v) for v in value]
+    return [int(value)]
+
+
+def to_cutoff_list(value):
+    """Return overlap length cutoffs, see to_int_list, and raise a
+    ValueError if a cutoff is given more than once, which would count
+    its overlaps more than once."""
+    cutoffs = to_int_list(value)
+    duplicates = sorted(set([c for c in cutoffs if cutoffs.count(c) > 1]))
+    if len(duplicates) > 0:
+        raise ValueError("Overlap length cutoffs must be distinct, got " +
+                         "{d} more than once.".format(
+                         d=", ".join([str(c) for c in duplicates])))
+    return cutoffs
+
+
 def revcmp(seq):
-    """Given a sequence return its reverse complement sequence."""
-    NTMAP = {'a':'t', 'c':'g', 't':'a', 'g':'c',
-             'A':'T', 'C':'G', 'T':'A', 'G':'C'}
-    return "".join([NTMAP[x] for x in seq])[::-1]
+    """Given a sequence return its reverse complement sequence.
+    IUPAC ambiguity codes are complemented, and N is kept."""
+    return str(seq).translate(_COMPLEMENT)[::-1]
+
+
+def read_fasta(fn):
+    """Yield (name, sequence) of every read in fasta file fn, where name
+    is the header line without '>'. Unlike pbcore.io.FastaReader, no
+    record object is made per read, which matters for gigabases."""
+    with open(fn, 'r', FASTA_BUFFER_SIZE) as reader:
+        name, lines = None, []
+        for line in reader:
+            if line.startswith('>'):
+                if name is not None:
+                    yield (name, "".join(lines))
+                name, lines = line[1:].strip(), []
+            elif name is not None:
+                lines.append(line.strip())
+            elif len(line.strip()) > 0:
+                raise ValueError("{f} is not a fasta file.".format(f=fn))
+        if name is not None:
+            yield (name, "".join(lines))
+
+
+def write_fasta(writer, name, seq):
+    """Write a read to writer, an open fasta file."""
+    writer.write(">" + name + "\n" + seq + "\n")
 
 
 def revcmp_fasta(in_fasta, out_fasta):
     """Reverse compelement every reads in in_fasta and
-    output it to out_fasta.
+    output it to out_fasta. Return number of reads.
     """
     if realpath(in_fasta) == realpath(out_fasta):
         raise ValueError("revcmp_fasta input and output fasta files " +
                          "are identical.")
 
     num_reads = 0
-    with FastaReader(in_fasta) as reader, \
-         FastaWriter(out_fasta) as writer:
-        for r in reader:
+    with open(out_fasta, 'w', FASTA_BUFFER_SIZE) as writer:
+        for name, seq in read_fasta(in_fasta):
             num_reads += 1
-            writer.writeRecord(r.name, revcmp(r.sequence))
+            write_fasta(writer, name, revcmp(seq))
     return num_reads
 
 
@@ -55,15 +112,124 @@ def cat_files(src, dst):
     """Concatenate files in src and save to dst.
        src --- source file names in a list
        dst --- destinate file name
+    Files are copied in large blocks, and a newline is added after a
+    file only if it does not end with one.
     """
     if src is None or len(src) == 0:
         raise ValueError("src should contain at least one file.")
-    if dst in src:
+    if realpath(dst) in [realpath(f) for f in src]:
         raise IOError("Unable to cat a file and save to itself.")
 
-    with open (dst, 'w') as writer:
+    with open(dst, 'wb') as writer:
         for src_f in src:
-            with open(src_f, 'r') as reader:
-                for line in reader:
-                    writer.write(line.rstrip() + '\n')
+            with open(src_f, 'rb') as reader:
+                shutil.copyfileobj(reader, writer, COPY_BUFFER_SIZE)
+                if reader.tell() > 0:
+                    reader.seek(-1, os.SEEK_END)
+                    if reader.read(1) != '\n':
+                        writer.write('\n')
+
+
+def count_lines(fn, first_char=None):
+    """Return number of lines in fn, or number of lines starting with
+    first_char if it is given, e.g., '>' to count reads of a fasta
+    file. fn is read in large blocks instead of line by line."""
+    num_lines, last = 0, '\n'
+    with open(fn, 'rb') as reader:
+        while True:
+            block = reader.read(COPY_BUFFER_SIZE)
+            if len(block) == 0:
+                break
+            if first_char is None:
+                num_lines += block.count('\n')
+            else:
+                # A line starts after a newline, or at the beginning.
+                num_lines += block.count('\n' + first_char) + \
+                             int(last == '\n' and
+                                 block.startswith(first_char))
+            last = block[-1]
+    if first_char is None and last != '\n':
+        num_lines += 1
+    return num_lines
+
+
+def link_or_copy(src, dst):
+    """Make dst a hard link of src, or a copy of src if hard links are
+    not supported, e.g., across file systems. dst is replaced by rename,
+    and never opened for writing, which would truncate src if dst is
+    already a link of it."""
+    if op.exists(dst) and op.samefile(src, dst):
+        return
+    tmp_dst = dst + ".tmp"
+    if op.lexists(tmp_dst):
+        os.remove(tmp_dst)
+    try:
+        os.link(src, tmp_dst)
+    except (OSError, AttributeError):
+        shutil.copyfile(src, tmp_dst)
+    os.rename(tmp_dst, dst)
+
+
+def run_in_threads(funcs):
+    """Call every function in funcs in a separate thread, wait for all
+    of them to complete, and re-raise the first exception raised by any
+    of them, if there is one.
+    Threads are adequate here because each function is expected to
+    spend most of its time waiting for an external program (e.g., blasr).
+    """
+    errors = []
+
+    def _call(func):
+        """Call func and save any exception raised."""
+        try:
+            func()
+        except Exception:
+            errors.append(sys.exc_info())
+
+    threads = [threading.Thread(target=_call, args=(func,)) for func in funcs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if len(errors) > 0:
+        exc_type, exc_value, exc_tb = errors[0]
+        raise exc_type, exc_value, exc_tb
+
+
+def parse_mem_size(value):
+    """Return number of bytes of a memory size string, e.g.,
+    '512M' -> 536870912, '4G' -> 4294967296, '1000' -> 1000."""
+    units = {'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+    value = str(value).strip().upper().rstrip('B')
+    try:
+        if len(value) > 0 and value[-1] in units:
+            return int(float(value[:-1]) * units[value[-1]])
+        return int(value)
+    except ValueError:
+        raise ValueError("Could not parse {v} as a memory size, e.g., 4G.".
+                         format(v=value))
+
+
+def merge_sorted_shards(shards, dst, key_func, header=None):
+    """Merge lines of shard files, each of which is sorted by key_func,
+    and write to dst in order of key_func.
+       shards   --- shard file names in a list
+       dst      --- destinate file name
+       key_func --- function of a line, returns (key, line_to_write)
+       header   --- line to write before all merged lines, if any
+    Lines with equal keys keep their order within a shard, and shards
+    are merged in a streaming way, one line per shard in memory."""
+    def _keyed_lines(fn):
+        """Yield (key, line number, line to write) of lines in fn."""
+        with open(fn, 'r') as reader:
+            for line_no, line in enumerate(reader):
+                key, out_line = key_func(line)
+                yield (key, line_no, out_line)
 
+    with open(dst, 'w') as writer:
+        if header is not None:
+            writer.write(header)
+        for _key, _line_no, out_line in \
+                heapq.merge(*[_keyed_lines(fn) for fn in shards]):
+            writer.write(out_line)
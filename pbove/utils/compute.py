@@ -1,6 +1,11 @@
 """Provide util functions for computing mappable/unmapble reads,
 number of good/bad overlaps."""
 from sys import maxint
+import math
+import numpy as np
+from pbove.utils.IntervalIndex import ReferenceIntervalIndex
+from pbove.io.OverlapHistogramIO import OverlapHistogram
+from pbove.utils.Progress import Progress
 
 def GetOverlapLengthOfTwoIntervals(start1, end1, start2, end2):
     """Given two intervals [start1, end1) and [start2, end2),
@@ -16,6 +21,18 @@ def GetOverlapLengthOfTwoIntervals(start1, end1, start2, end2):
         return - min(abs(min(start1, end1 - 1) - max(start2, end2 - 1) - 1),
                      abs(max(start1, end1 - 1) - min(start2, end2 - 1) - 1))
 
+def GetOverlapLengthsOfIntervalArrays(starts1, ends1, starts2, ends2):
+    """Vectorized GetOverlapLengthOfTwoIntervals, given numpy arrays of
+    intervals [starts1[i], ends1[i]) and [starts2[i], ends2[i]), return
+    an array of their overlap lengths (or -distance if apart)."""
+    ovlLens = np.minimum(ends1, ends2) - np.maximum(starts1, starts2)
+    dists = np.minimum(
+        np.abs(np.minimum(starts1, ends1 - 1) -
+               np.maximum(starts2, ends2 - 1) - 1),
+        np.abs(np.maximum(starts1, ends1 - 1) -
+               np.minimum(starts2, ends2 - 1) - 1))
+    return np.where(ovlLens >= 0, ovlLens, -dists)
+
 def GetDistanceBetweenTwoIntervals(start1, end1, start2, end2):
     """Given two intervals [start1, end1) and [start2, end2),
     if they overlap, return 0 - length of the overlapping region.
@@ -24,6 +41,30 @@ def GetDistanceBetweenTwoIntervals(start1, end1, start2, end2):
     return - GetOverlapLengthOfTwoIntervals(
              start1, end1, start2, end2)
 
+def OverlapLengthOfMappedIntervals(interval1, interval2):
+    """Given two intervals (reference, start, end) where two reads are
+    mapped to, return their overlap length (or -distance if apart),
+    or -sys.maxint if they are not mapped to the same reference."""
+    ref1, start1, end1 = interval1
+    ref2, start2, end2 = interval2
+    if ref1 != ref2 or ref1 == "":
+        return -maxint
+    return GetOverlapLengthOfTwoIntervals(start1, end1, start2, end2)
+
+def WilsonInterval(k, n, z=1.96):
+    """Return (p, low, high), where p = k/n is the fraction of successes
+    in n binomial trials, and [low, high] is the Wilson score interval of
+    p, e.g., a 95% confidence interval if z = 1.96. Return (0, 0, 1) if
+    n is 0."""
+    if n <= 0:
+        return (0.0, 0.0, 1.0)
+    n = float(n)
+    p = k / n
+    denom = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denom
+    half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denom
+    return (p, max(0.0, center - half), min(1.0, center + half))
+
 def GetBestReadToQueryForInterval(reads, start, end):
     """Given an array of reads and an interval [start, end),
     return the read whose query interval [abs_qstart, abs_qend)
@@ -64,15 +105,14 @@ def GetNumOfUnmappable(q):
     return numUnmappable
 
 
-def ComputeAllPosNegNumbers(q, t, overlapLengthCutoff=200):
+def ComputeOverlapLengthDistribution(q, t, tIndex=None, zmwHist=None):
     """Given a list of sorted query reads q and a list of sorted
     target reads t, for each pair of (q_i, t_j) where q_i in q,
-    and t_j in t, identify whether they overlap or not. Return
-    numGTPos:  number of alns that indeed overlap by more than
-               overlapLengthCutoff base pairs.
-    numGTNeg:  number of alns that do not overlap (negative),
-    numGTWeak: number of alns that overlap by a short reigon
-               with less than overlaplengthCutoff base pairs
+    and t_j in t, compute the length of their overlapping region in
+    reference if they overlap. Return an OverlapHistogram, which has
+    numbers of alns whose query and target overlap by each length in
+    each reference (only alns of which query and target overlap or
+    touch are included), and
     numUnmappableAlns: number of alns that either query or target
                read is not mappable to the reference.
     numMappableAlns: number of alns that both query and target reads
@@ -85,22 +125,59 @@ def ComputeAllPosNegNumbers(q, t, overlapLengthCutoff=200):
     t: target, each item has four columns, sorted by reference, then
     refStart, then -refEnd:
        (target_read, reference, refStart, refEnd).
-    overlapLengthCutoff: the minumum number of overlapping bases to be
-    considered positive overlap.
+    tIndex: ReferenceIntervalIndex of t, built from t if None.
+    zmwHist: if not None, a ZmwOverlapHistogram to which all query ZMWs
+    and overlap lengths of their pairs are added as well.
     """
     numQMappable = len(q) - GetNumOfUnmappable(q)
     numTMappable = len(t) - GetNumOfUnmappable(t)
-    numQTMappable = numQMappable * numTMappable
-    numQTUnmappable  = len(q) * len(t) - numQTMappable
-    numAlns = len(q) * len(t)
-
-    # Get the maximum length of intervals in the reference which the target
-    # reads can map to.
-    (_objcol, _refcol, startcol, endcol) = (0, 1, 2, 3)
-    maxtlen = 0
-    for titem in t:
-        maxtlen = max(maxtlen, titem[endcol] - titem[startcol])
-    print "maxtlen = {0}".format(maxtlen)
+    hist = OverlapHistogram()
+    hist.numMappableAlns = numQMappable * numTMappable
+    hist.numUnmappableAlns = len(q) * len(t) - hist.numMappableAlns
+    hist.numAlns = len(q) * len(t)
+    for _qread, qref, _qrefstart, _qrefend in q:
+        if qref != "":
+            hist.numQMapped[qref] += 1
+    for _tread, tref, _trefstart, _trefend in t:
+        if tref != "":
+            hist.numTMapped[tref] += 1
+
+    if tIndex is None:
+        tIndex = ReferenceIntervalIndex(t)
+
+    progress = Progress("Processing query", len(q))
+    for qitem in q:
+        qread, qref, qrefstart, qrefend = qitem
+        progress.update()
+        if zmwHist is not None:
+            zmwIndex = zmwHist.addZmw("{0}/{1}".format(qread.movie,
+                                                       qread.holeNumber))
+        if (qref == ""):
+            # this query read is not mappable to the reference,
+            continue
+
+        # Target reads which overlap with or touch this query read.
+        for tindex in tIndex.overlaps(qref, qrefstart, qrefend):
+            _tread, _tref, trefstart, trefend = t[tindex]
+            overlapLength = int(GetOverlapLengthOfTwoIntervals(
+                    qrefstart, qrefend,
+                    trefstart, trefend))
+            hist.add(qref, overlapLength)
+            if zmwHist is not None:
+                zmwHist.add(zmwIndex, overlapLength)
+    progress.done()
+
+    return hist
+
+
+def GetAllPosNegNumbersForCutoffs(hist, overlapLengthCutoffs):
+    """Given an OverlapHistogram of ground truth overlap lengths, compute
+    numbers of ground truth positive, negative and weak overlaps of
+    multiple overlap length cutoffs.
+    Return a dictionary, cutoff -> (numGTPos, numGTNeg, numGTWeak,
+    numUnmappableAlns, numMappableAlns, numAlns)."""
+    numQTUnmappable, numQTMappable, numAlns = \
+            hist.numUnmappableAlns, hist.numMappableAlns, hist.numAlns
 
     # if q & t overlap length >= OverlapLengthCutoff,
     #    it is a ground truth positive overlap
@@ -108,71 +185,60 @@ def ComputeAllPosNegNumbers(q, t, overlapLengthCutoff=200):
     #    it is a gt weak overlap
     # otherwise, negative overlap, which is computed as
     #     numGTNeg = numQTMappable - numGTPos - numGTWeak
-    numGTPos, numGTWeak = 0, 0
-    for qindex, qitem in enumerate(q):
-        # for each query read, first identify a range of target
-        # reads which the query read may overlap with.
-        _qread, qref, qrefstart, qrefend = qitem
-        if (qindex % 100 == 0):
-            print "Processing query {0} / {1} ".format(
-                    qindex, len(q))
-        if (qref == ""):
-            # this query read is not mappable to the reference,
-            continue
-
-        searchStart, searchEnd = 0, len(t) - 1
-        searchMid = -1
-        while (searchStart <= searchEnd and
-               searchStart >= 0 and searchEnd >= 0 and
-               searchStart < len(t) and searchEnd < len(t)):
-            searchMid = int((searchStart + searchEnd) / 2)
-            _midread, midref, midrefstart, _midrefend = t[searchMid]
-            if (qref < midref or
-                (qref == midref and qrefend < midrefstart)):
-                searchEnd = searchMid - 1
-                continue
-            elif (qref > midref):
-                searchStart = searchMid + 1
-                continue
-            elif (qref == midref and qrefstart > midrefstart + maxtlen):
-                searchStart = searchMid + 1
-                continue
-            else:
-                break
-
-        if (searchStart > searchEnd):
-            # This query read is mappable to the reference, but
-            # do not overlap with any target reads.
-            pass
-        else:
-            # This query read may overlap with some target
-            # reads in the search range.
-            for titem in t[searchStart: searchEnd + 1]:
-                _tread, tref, trefstart, trefend = titem
-                if (tref == "" or qref != tref ):
-                    continue
-                elif (trefend < qrefstart or qrefend < trefstart):
-                    continue
-
-                overlapLength = int(GetOverlapLengthOfTwoIntervals(
-                        qrefstart, qrefend,
-                        trefstart, trefend))
-                if int(overlapLength) >= int(overlapLengthCutoff):
-                    numGTPos += 1
-                elif overlapLength > 0:
-                    numGTWeak += 1
-
-    numGTNeg = numQTMappable - numGTPos - numGTWeak
-    print ("numGTPos={0}, numGTNeg = {1}, numGTWeak={2}, ".\
-            format(numGTPos, numGTNeg, numGTWeak))
+    ret = {}
+    posWeak = hist.getPosWeak(overlapLengthCutoffs)
+    for cutoff, (numGTPos, numGTWeak) in posWeak.iteritems():
+        numGTNeg = numQTMappable - numGTPos - numGTWeak
+        print ("overlapLengthCutoff={0}, ".format(cutoff) +
+               "numGTPos={0}, numGTNeg = {1}, numGTWeak={2}, ".\
+               format(numGTPos, numGTNeg, numGTWeak))
+        ret[cutoff] = (numGTPos, numGTNeg, numGTWeak, numQTUnmappable,
+                       numQTMappable, numAlns)
 
     print ("numUnmappable={0}, numQTMappable = {1}, numAlns ={2}, ".\
             format(numQTUnmappable, numQTMappable, numAlns))
-    return (numGTPos, numGTNeg, numGTWeak, numQTUnmappable,
-            numQTMappable, numAlns)
+    return ret
+
+
+def ComputeAllPosNegNumbersForCutoffs(q, t, overlapLengthCutoffs):
+    """Same as ComputeAllPosNegNumbers, but compute numbers of ground
+    truth positive, negative and weak overlaps of multiple overlap length
+    cutoffs from one overlap length distribution.
+    Return a dictionary, cutoff -> (numGTPos, numGTNeg, numGTWeak,
+    numUnmappableAlns, numMappableAlns, numAlns)."""
+    return GetAllPosNegNumbersForCutoffs(
+            ComputeOverlapLengthDistribution(q, t), overlapLengthCutoffs)
+
+
+def ComputeAllPosNegNumbers(q, t, overlapLengthCutoff=200):
+    """Given a list of sorted query reads q and a list of sorted
+    target reads t, for each pair of (q_i, t_j) where q_i in q,
+    and t_j in t, identify whether they overlap or not. Return
+    numGTPos:  number of alns that indeed overlap by more than
+               overlapLengthCutoff base pairs.
+    numGTNeg:  number of alns that do not overlap (negative),
+    numGTWeak: number of alns that overlap by a short reigon
+               with less than overlaplengthCutoff base pairs
+    numUnmappableAlns: number of alns that either query or target
+               read is not mappable to the reference.
+    numMappableAlns: number of alns that both query and target reads
+               can map to the reference.
+    numAlns: |query reads| * |target reads|
+
+    q: query, each item has four columns, sorted by reference, then
+    refStart, then -refEnd:
+       (query_read, reference, refStart, refEnd).
+    t: target, each item has four columns, sorted by reference, then
+    refStart, then -refEnd:
+       (target_read, reference, refStart, refEnd).
+    overlapLengthCutoff: the minumum number of overlapping bases to be
+    considered positive overlap.
+    """
+    return ComputeAllPosNegNumbersForCutoffs(
+            q, t, [overlapLengthCutoff])[overlapLengthCutoff]
 
 
-def write_gt_overlaps(query, target, out_file):
+def write_gt_overlaps(query, target, out_file, tIndex=None, prefixes=None):
     """Given a list of sorted query reads q and a list of sorted
     target reads t, for each pair of (q_i, t_j) where q_i in q,
     and t_j in t, identify whether they (ground truth) overlap or
@@ -184,29 +250,38 @@ def write_gt_overlaps(query, target, out_file):
     target     : target, each item has four columns, sorted by reference, then
                  refStart, then -refEnd:
                  (target_read, reference, refStart, refEnd).
-    #ovl_cut_off: the minumum number of overlapping bases to be
-    #             considered positive overlap.
+    tIndex     : ReferenceIntervalIndex of target, built from target
+                 if None.
+    prefixes   : if not None, prefixes[i] is written before every
+                 overlap of query[i], e.g., a sort key, and the header
+                 line is not written.
     """
     # if q & t overlap length >= OverlapLengthCutoff,
     #    it is a ground truth positive overlap
     # if q & t overlap length > 0 && < OverlapLengthCutoff,
     #    it is a gt weak overlap
     # Here, we report all gt overlaps including weak overlaps
+    if tIndex is None:
+        tIndex = ReferenceIntervalIndex(target)
     of = open(out_file, 'w')
-    of.write("#query\ttarget\toverlap_len\n")
+    if prefixes is None:
+        of.write("#query\ttarget\toverlap_len\n")
 
+    progress = Progress("Writing ground truth overlaps of query",
+                        len(query))
     for qindex, qitem in enumerate(query):
         qread, qref, qrefstart, qrefend = qitem
-        #if (qindex % 1000 == 0):
-        #    print "Processing query {0} / {1} ".format(qindex, len(query))
+        progress.update()
         if (qref == ""):
             # this query read is not mappable to the reference,
             continue
-        for _tindex, titem in enumerate(target):
-            tread, tref, trefstart, trefend = titem
-            if (qref == tref):
-                ol = max(0, min(trefend, qrefend) - max(trefstart, qrefstart))
-                if ol > 0:
-                    of.write("{qread}\t{tread}\t{ovl_len}\n".format(
-                             qread=qread, tread=tread, ovl_len=ol))
+        for tindex in tIndex.overlaps(qref, qrefstart, qrefend):
+            tread, _tref, trefstart, trefend = target[tindex]
+            ol = max(0, min(trefend, qrefend) - max(trefstart, qrefstart))
+            if ol > 0:
+                if prefixes is not None:
+                    of.write(prefixes[qindex])
+                of.write("{qread}\t{tread}\t{ovl_len}\n".format(
+                         qread=qread, tread=tread, ovl_len=ol))
+    progress.done()
     of.close()
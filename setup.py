@@ -9,6 +9,8 @@ setup(
     author_email='devnet@pacificbiosciences.com',
     license='LICENSE.txt',
     scripts = ['pbove/pbove_eval.py',
+               'pbove/pbove_bench.py',
+               'pbove/pbove_eval_merge.py',
                'pbove/pbove_compare_runs.py',
                'pbove/pbove_compare_overlap.py',
                'pbove/pbove_plot_runs.py',
@@ -24,5 +26,6 @@ setup(
     zip_safe = False,
     install_requires=[
         'pbcore >= 0.6.3',
-        'pbalign >= 0.1.0']
+        'pbalign >= 0.1.0',
+        'numpy']
     )
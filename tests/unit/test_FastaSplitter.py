@@ -0,0 +1,131 @@
+"""Test pbove.io.FastaSplitter."""
+import os.path as op
+import random
+import shutil
+import tempfile
+import unittest
+from pbove.io.FastaSplitter import FastaSplitter, splitFasta, mergeSplits
+from pbove.utils.Utils import read_fasta, write_fasta, revcmp
+
+
+class TestFastaSplitter(unittest.TestCase):
+    """Test splitting a fasta file and merging splits back."""
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp(prefix="test_FastaSplitter")
+        self.input_fasta = op.join(self.out_dir, "input.fasta")
+        rng = random.Random(11)
+        self.reads = [("m/{i}/0_{n}".format(i=i, n=n),
+                       "".join(rng.choice("ACGT") for _j in range(n)))
+                      for i, n in enumerate(rng.randint(1, 300)
+                                            for _i in range(250))]
+        with open(self.input_fasta, 'w') as writer:
+            for name, seq in self.reads:
+                write_fasta(writer, name, seq)
+
+    def tearDown(self):
+        shutil.rmtree(self.out_dir)
+
+    def _reads_of(self, fns):
+        """Return reads of fasta files fns, in order."""
+        return [r for fn in fns for r in read_fasta(fn)]
+
+    def test_reads_per_split(self):
+        """Test splits of reads_per_split reads, in order, and that
+        names of splits sort in order."""
+        fns = splitFasta(self.input_fasta, 30, self.out_dir, "s")
+        self.assertEqual(len(fns), 9)
+        self.assertEqual(sorted(fns), fns)
+        self.assertEqual([len(list(read_fasta(fn))) for fn in fns],
+                         [30] * 8 + [10])
+        self.assertEqual(self._reads_of(fns), self.reads)
+
+    def test_bases_per_split(self):
+        """Test that a split is complete once it has bases_per_split
+        bases."""
+        fs = FastaSplitter(self.input_fasta, None, self.out_dir, "s",
+                           bases_per_split=2000)
+        fns = fs.split()
+        self.assertEqual(self._reads_of(fns), self.reads)
+        for fn in fns[:-1]:
+            seqs = [seq for _name, seq in read_fasta(fn)]
+            self.assertTrue(sum(len(s) for s in seqs) >= 2000)
+            self.assertTrue(sum(len(s) for s in seqs[:-1]) < 2000)
+
+    def test_many_splits(self):
+        """Test that more than 100 splits are named in order, and are
+        merged back in input order."""
+        fs = FastaSplitter(self.input_fasta, 2, self.out_dir, "s",
+                           write_index=True)
+        fns = fs.split()
+        self.assertEqual(len(fns), 125)
+        # Names are padded to the same width, which is at least the
+        # width of the largest index.
+        self.assertEqual(sorted(fns), fns)
+        self.assertEqual(len(set(len(fn) for fn in fns)), 1)
+        self.assertTrue(op.basename(fns[-1]).endswith("124.fa"))
+        out_fasta = op.join(self.out_dir, "merged.fasta")
+        self.assertEqual(fs.merge(fns, out_fasta), len(self.reads))
+        self.assertEqual(list(read_fasta(out_fasta)), self.reads)
+        fs.rmOutFNs()
+        self.assertFalse(any(op.exists(fn) for fn in fns))
+        self.assertFalse(op.exists(fs.index_fn))
+
+    def test_balanced(self):
+        """Test num_splits splits of similar bases, merged back in input
+        order by index."""
+        fs = FastaSplitter(self.input_fasta, None, self.out_dir, "b",
+                           num_splits=7, rc_out_prefix="rc",
+                           write_index=True)
+        fns = fs.split()
+        self.assertEqual(len(fns), 7)
+        self.assertEqual(len(fs.rc_out_fns), 7)
+        bases = [sum(len(s) for _n, s in read_fasta(fn)) for fn in fns]
+        self.assertTrue(max(bases) - min(bases) <=
+                        max(len(s) for _n, s in self.reads))
+        self.assertEqual(sorted(self._reads_of(fns)), sorted(self.reads))
+        for fn, rc_fn in zip(fns, fs.rc_out_fns):
+            self.assertEqual([(n, revcmp(s)) for n, s in read_fasta(fn)],
+                             list(read_fasta(rc_fn)))
+        out_fasta = op.join(self.out_dir, "merged.fasta")
+        self.assertEqual(mergeSplits(fns, fs.index_fn, out_fasta),
+                         len(self.reads))
+        self.assertEqual(list(read_fasta(out_fasta)), self.reads)
+
+    def test_more_splits_than_reads(self):
+        """Test that extra splits of num_splits are empty."""
+        fs = FastaSplitter(self.input_fasta, None, self.out_dir, "e",
+                           num_splits=300, write_index=True)
+        fns = fs.split()
+        self.assertEqual(len(fns), 300)
+        self.assertEqual(op.basename(fns[0]), "e_000.fa")
+        self.assertEqual(len(self._reads_of(fns)), len(self.reads))
+        out_fasta = op.join(self.out_dir, "merged.fasta")
+        fs.merge(fns, out_fasta)
+        self.assertEqual(list(read_fasta(out_fasta)), self.reads)
+
+    def test_merge_mismatch(self):
+        """Test that merging splits which do not match the index
+        fails."""
+        fs = FastaSplitter(self.input_fasta, 100, self.out_dir, "s",
+                           write_index=True)
+        fns = fs.split()
+        out_fasta = op.join(self.out_dir, "merged.fasta")
+        self.assertRaises(ValueError, fs.merge, fns[::-1], out_fasta)
+        self.assertRaises(ValueError, fs.merge, fns[:-1], out_fasta)
+
+    def test_invalid_arguments(self):
+        """Test invalid combinations of split sizes."""
+        self.assertRaises(ValueError, FastaSplitter, self.input_fasta,
+                          None, self.out_dir, "s")
+        self.assertRaises(ValueError, FastaSplitter, self.input_fasta,
+                          10, self.out_dir, "s", num_splits=2)
+        self.assertRaises(ValueError, FastaSplitter, self.input_fasta,
+                          None, self.out_dir, "s", num_splits=0)
+        fs = FastaSplitter(self.input_fasta, 10, self.out_dir, "s")
+        fs.split()
+        self.assertRaises(ValueError, fs.merge, fs.out_fns,
+                          op.join(self.out_dir, "merged.fasta"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+"""Test pbove.utils.IntervalIndex against brute force."""
+import random
+import unittest
+from pbove.utils.IntervalIndex import IntervalIndex, ReferenceIntervalIndex
+
+
+def _brute_force(starts, ends, ids, start, end):
+    """Return sorted (start, end, id) of intervals overlapping with or
+    touching [start, end]."""
+    return sorted([(s, e, i) for s, e, i in zip(starts, ends, ids)
+                   if s <= end and e >= start],
+                  key=lambda x: x[0])
+
+
+class TestIntervalIndex(unittest.TestCase):
+    """Test IntervalIndex."""
+    def setUp(self):
+        self.rng = random.Random(7)
+
+    def _random_intervals(self, n, span, max_len):
+        """Return (starts, ends) of n random intervals."""
+        starts = [self.rng.randint(0, span) for _i in range(n)]
+        ends = [s + self.rng.randint(0, max_len) for s in starts]
+        return starts, ends
+
+    def test_empty(self):
+        """Test an index of no intervals."""
+        index = IntervalIndex([], [])
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.count(0, 100), 0)
+        self.assertEqual(index.overlaps(0, 100), [])
+
+    def test_touching(self):
+        """Test that touching intervals overlap."""
+        index = IntervalIndex([0, 10, 21], [10, 20, 30], ids=["a", "b", "c"])
+        self.assertEqual(index.overlaps(20, 20), [(10, 20, "b")])
+        self.assertEqual(index.overlaps(10, 21),
+                         [(0, 10, "a"), (10, 20, "b"), (21, 30, "c")])
+        self.assertEqual(index.count(31, 40), 0)
+
+    def test_same_starts(self):
+        """Test that intervals of the same start keep input order."""
+        index = IntervalIndex([5, 5, 5, 1], [6, 9, 7, 2])
+        self.assertEqual(index.overlaps(5, 5),
+                         [(5, 6, 0), (5, 9, 1), (5, 7, 2)])
+
+    def test_brute_force(self):
+        """Test overlaps and count of random intervals of every size
+        around powers of two against brute force."""
+        for n in range(0, 70) + [127, 128, 129, 255, 256, 257, 1000]:
+            starts, ends = self._random_intervals(n, 2000, 300)
+            ids = range(n)
+            index = IntervalIndex(starts, ends)
+            self.assertEqual(len(index), n)
+            for _q in range(30):
+                start = self.rng.randint(-50, 2400)
+                end = start + self.rng.randint(0, 200)
+                expected = _brute_force(starts, ends, ids, start, end)
+                self.assertEqual(index.overlaps(start, end), expected)
+                self.assertEqual(index.count(start, end), len(expected))
+
+    def test_long_intervals(self):
+        """Test that long intervals starting far to the left of a query
+        are found."""
+        starts, ends = self._random_intervals(500, 100000, 50)
+        starts.append(0)
+        ends.append(100000)
+        ids = range(len(starts))
+        index = IntervalIndex(starts, ends)
+        for start in range(0, 100000, 997):
+            self.assertEqual(index.overlaps(start, start + 10),
+                             _brute_force(starts, ends, ids,
+                                          start, start + 10))
+
+
+class TestReferenceIntervalIndex(unittest.TestCase):
+    """Test ReferenceIntervalIndex."""
+    def test_overlaps(self):
+        """Test overlaps of reads mapped to different references, and
+        that unmappable reads are ignored."""
+        mapped = [("r0", "ref1", 0, 100), ("r1", "ref2", 50, 150),
+                  ("r2", "", -1, -1), ("r3", "ref1", 100, 200),
+                  ("r4", "ref1", 300, 400)]
+        index = ReferenceIntervalIndex(mapped)
+        self.assertEqual(index.overlaps("ref1", 50, 150), [0, 3])
+        self.assertEqual(index.count("ref1", 50, 150), 2)
+        self.assertEqual(index.overlaps("ref2", 0, 60), [1])
+        self.assertEqual(index.overlaps("ref3", 0, 1000), [])
+        self.assertEqual(index.count("", -1, -1), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()